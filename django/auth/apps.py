@@ -5,3 +5,8 @@ from django.apps import AppConfig
 
 class AuthConfig(AppConfig):
     name = 'auth'
+    # django.contrib.auth already has the auth label
+    label = 'ranker_auth'
+
+    def ready(self):
+        from auth import signals
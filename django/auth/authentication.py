@@ -0,0 +1,121 @@
+""" Token authentication which caches each token's user.
+
+Tokens are looked up in a small in-process LRU first, then in the shared
+cache, and only read from the database when neither has them. Only hits in
+the LRU avoid the database. The shared cache maps each token to its user's
+id, so a hit there still loads the user by primary key, and checks it is
+active, in place of the token lookup.
+
+The shared cache must be shared by every process, such as memcached, for a
+deleted token to stop working everywhere. Deleting a token also leaves a
+revocation marker there, so a process that read the token just before it was
+deleted can't cache it again. Entries in the LRU expire after
+TOKEN_CACHE_LOCAL_TIMEOUT seconds, so a token deleted or a user deactivated
+by another process stops working within that time.
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from timeit import default_timer
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import caches
+from django.utils.translation import ugettext_lazy as _
+from rest_framework import exceptions
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+
+
+def _cache():
+    return caches[getattr(settings, 'TOKEN_CACHE', 'default')]
+
+
+def _token_key(key):
+    # Keep the tokens themselves out of the shared cache's keys
+    return 'auth:token:{}'.format(hashlib.sha1(key.encode()).hexdigest())
+
+
+def _revoked_key(key):
+    return 'auth:revoked:{}'.format(hashlib.sha1(key.encode()).hexdigest())
+
+
+class _TokenCache(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, key):
+        now = default_timer()
+        with self.lock:
+            entry = self.entries.pop(key, None)
+            if entry is not None and entry[0] > now:
+                self.entries[key] = entry
+                return entry[1]
+
+        found = _cache().get_many([_token_key(key), _revoked_key(key)])
+        user_id = found.get(_token_key(key))
+        if user_id is None or _revoked_key(key) in found:
+            return None
+        user = get_user_model()._default_manager.filter(id=user_id).first()
+        if user is None:
+            return None
+        token = Token(key=key, user=user)
+        self.add(key, token)
+        return token
+
+    def add(self, key, token):
+        expires = default_timer() + getattr(
+            settings, 'TOKEN_CACHE_LOCAL_TIMEOUT', 10)
+        with self.lock:
+            self.entries.pop(key, None)
+            self.entries[key] = (expires, token)
+            while len(self.entries) > getattr(settings, 'TOKEN_CACHE_SIZE',
+                                              1024):
+                self.entries.popitem(last=False)
+
+    def set(self, key, token):
+        _cache().set(_token_key(key), token.user_id,
+                     getattr(settings, 'TOKEN_CACHE_TIMEOUT', 300))
+        self.add(key, token)
+
+    def delete(self, keys, revoked=False):
+        if revoked:
+            # Outlasts any entry cached for the token before it was deleted
+            _cache().set_many({_revoked_key(key): True for key in keys},
+                              getattr(settings, 'TOKEN_CACHE_TIMEOUT', 300))
+        _cache().delete_many([_token_key(key) for key in keys])
+        with self.lock:
+            for key in keys:
+                self.entries.pop(key, None)
+
+
+_tokens = _TokenCache()
+
+
+def invalidate_tokens(keys):
+    """ Removes tokens from the cache, such as when they are deleted
+    """
+    _tokens.delete(list(keys))
+
+
+def revoke_tokens(keys):
+    """ Removes deleted tokens from the cache, and stops them being cached
+    again
+    """
+    _tokens.delete(list(keys), revoked=True)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """ TokenAuthentication which caches each token's user
+    """
+    def authenticate_credentials(self, key):
+        token = _tokens.get(key)
+        if token is None:
+            user, token = super(CachedTokenAuthentication,
+                                self).authenticate_credentials(key)
+            _tokens.set(key, token)
+        elif not token.user.is_active:
+            raise exceptions.AuthenticationFailed(
+                _('User inactive or deleted.'))
+        return (token.user, token)
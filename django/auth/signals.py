@@ -0,0 +1,26 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from auth.authentication import invalidate_tokens, revoke_tokens
+
+
+@receiver(post_delete, sender=Token)
+def on_token_delete(sender, instance, **kwargs):
+    # The key is the primary key, so is cleared once the deletion finishes
+    keys = [instance.key]
+    revoke_tokens(keys)
+    # A request in another process may cache the token again before the
+    # deletion commits
+    transaction.on_commit(lambda: revoke_tokens(keys))
+
+
+@receiver(post_save, sender=settings.AUTH_USER_MODEL)
+def on_user_save(sender, instance, created, **kwargs):
+    # The local cache holds each token's user, which may have just been
+    # deactivated
+    if not created:
+        invalidate_tokens(Token.objects.filter(user=instance)
+                          .values_list('key', flat=True))
@@ -0,0 +1,114 @@
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.test import override_settings
+from django.urls import reverse
+
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from auth import authentication
+
+
+class CachedTokenTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        authentication._tokens.entries.clear()
+
+        self.user_cred = {
+            'username': 'user',
+            'password': 'password'
+        }
+        self.user = get_user_model().objects.create_user(**self.user_cred)
+        self.token = Token.objects.create(user=self.user)
+        self.url = reverse('ranker-topics-list')
+
+    def get(self, key):
+        self.client.credentials(HTTP_AUTHORIZATION='Token ' + key)
+        return self.client.get(self.url)
+
+    def test_cached(self):
+        # The first request looks up the token
+        with self.assertNumQueries(2):
+            response = self.get(self.token.key)
+        self.assertEqual(response.status_code, 200)
+
+        with self.assertNumQueries(1):
+            response = self.get(self.token.key)
+        self.assertEqual(response.status_code, 200)
+
+        # Other processes find its user's id in the shared cache, and only
+        # need to load the user
+        authentication._tokens.entries.clear()
+        with self.assertNumQueries(2):
+            response = self.get(self.token.key)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            cache.get(authentication._token_key(self.token.key)),
+            self.user.id)
+
+    def test_invalid_token(self):
+        response = self.get('invalid')
+        self.assertEqual(response.status_code, 401)
+
+    def test_token_reset(self):
+        self.assertEqual(self.get(self.token.key).status_code, 200)
+
+        response = self.client.delete(reverse('auth_token'), self.user_cred)
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(self.get(self.token.key).status_code, 401)
+        self.assertEqual(self.get(response.json()['token']).status_code, 200)
+
+    def test_token_delete(self):
+        key = self.token.key
+        self.assertEqual(self.get(key).status_code, 200)
+        self.token.delete()
+        self.assertEqual(self.get(key).status_code, 401)
+
+    def test_token_deleted_elsewhere(self):
+        key = self.token.key
+        self.assertEqual(self.get(key).status_code, 200)
+
+        # A request in another process read the token just before it was
+        # deleted, and cached it afterwards
+        self.token.delete()
+        authentication._tokens.set(key, Token(key=key, user=self.user))
+        authentication._tokens.entries.clear()
+
+        self.assertEqual(self.get(key).status_code, 401)
+
+    def test_user_deactivated(self):
+        self.assertEqual(self.get(self.token.key).status_code, 200)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.get(self.token.key).status_code, 401)
+
+    def test_user_deactivated_elsewhere(self):
+        self.assertEqual(self.get(self.token.key).status_code, 200)
+
+        # Another process deactivated the user
+        get_user_model().objects.filter(id=self.user.id).update(
+            is_active=False)
+        authentication._tokens.entries.clear()
+
+        self.assertEqual(self.get(self.token.key).status_code, 401)
+
+    @override_settings(TOKEN_CACHE_LOCAL_TIMEOUT=0)
+    def test_local_timeout(self):
+        self.assertEqual(self.get(self.token.key).status_code, 200)
+
+        # Another process rotated the token
+        Token.objects.filter(user=self.user).delete()
+        cache.clear()
+
+        self.assertEqual(self.get(self.token.key).status_code, 401)
+
+    @override_settings(TOKEN_CACHE_SIZE=1)
+    def test_lru(self):
+        other = get_user_model().objects.create_user('other')
+        other_token = Token.objects.create(user=other)
+
+        self.get(self.token.key)
+        self.get(other_token.key)
+        self.assertEqual(list(authentication._tokens.entries),
+                         [other_token.key])
@@ -1,10 +1,15 @@
 from __future__ import unicode_literals
 
 from django.apps import AppConfig
+from django.core.signals import request_started
+from django.db.backends.signals import connection_created
 
 
 class CategorizerConfig(AppConfig):
     name = 'categorizer'
 
     def ready(self):
-        from categorizer import signals
+        from categorizer import db, signals
+
+        request_started.connect(db.close_unusable_connections)
+        connection_created.connect(db.configure_sqlite)
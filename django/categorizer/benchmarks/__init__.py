@@ -0,0 +1,7 @@
+""" Benchmarks for the ranking engine and the API.
+
+electorates generates deterministic synthetic ballots, algorithms times the
+ranked preference functions over a grid of electorate sizes, and endpoints
+seeds a topic through the ORM and times requests against it. Results are
+plain dicts which report writes out as JSON and compares between runs.
+"""
@@ -0,0 +1,86 @@
+""" Times the ranked preference functions over a grid of synthetic
+electorates
+"""
+import timeit
+from collections import OrderedDict
+
+from categorizer import ranked_preference
+from categorizer.benchmarks.electorates import ELECTORATES
+
+
+def _matrix_method(method):
+    def rank(candidates, ballots):
+        matrix = ranked_preference.pairwise_matrix(candidates, ballots)
+        return list(method(candidates, matrix))
+    return rank
+
+
+def _runoff(method):
+    def rank(candidates, ballots):
+        try:
+            return method(candidates, ballots)
+        except AssertionError:
+            # Nobody ranked any candidate
+            return None
+    return rank
+
+
+ALGORITHMS = OrderedDict([
+    ('pairwise_rankings', lambda candidates, ballots: list(
+        ranked_preference.pairwise_rankings(candidates, ballots))),
+    ('fast_pairwise_rankings', lambda candidates, ballots: list(
+        ranked_preference.fast_pairwise_rankings(candidates, ballots))),
+    ('condorcet_winner', ranked_preference.condorcet_winner),
+    ('condorcet_rankings',
+     _matrix_method(ranked_preference.condorcet_rankings)),
+    ('schulze_rankings', _matrix_method(ranked_preference.schulze_rankings)),
+    ('ranked_pairs_rankings',
+     _matrix_method(ranked_preference.ranked_pairs_rankings)),
+    ('instant_runoff', _runoff(ranked_preference.instant_runoff)),
+    ('fast_instant_runoff', _runoff(ranked_preference.fast_instant_runoff)),
+    ('full_ranked_preference', lambda candidates, ballots: list(
+        ranked_preference.full_ranked_preference(candidates, ballots))),
+    ('fast_full_ranked_preference', lambda candidates, ballots: list(
+        ranked_preference.fast_full_ranked_preference(candidates,
+                                                      ballots))),
+])
+
+
+def time_algorithms(candidate_counts, voter_counts, electorates=None,
+                    algorithms=None, repeat=3, seed=0, time_limit=None):
+    """ Runs every algorithm against every electorate and size, returning a
+    result for each with the fastest of its timings in seconds. Once a run
+    takes longer than time_limit, the algorithm is skipped for the rest of
+    that electorate's grid.
+    """
+    electorates = electorates or list(ELECTORATES)
+    algorithms = algorithms or list(ALGORITHMS)
+
+    results = []
+    for electorate in electorates:
+        too_slow = set()
+        for candidates in candidate_counts:
+            for voters in voter_counts:
+                ballots = ELECTORATES[electorate](range(candidates), voters,
+                                                  seed=seed)
+                for algorithm in algorithms:
+                    result = OrderedDict([
+                        ('algorithm', algorithm),
+                        ('electorate', electorate),
+                        ('candidates', candidates),
+                        ('voters', voters),
+                    ])
+                    results.append(result)
+                    if algorithm in too_slow:
+                        result['seconds'] = None
+                        continue
+
+                    timings = []
+                    for _ in range(repeat):
+                        start = timeit.default_timer()
+                        ALGORITHMS[algorithm](range(candidates), ballots)
+                        timings.append(timeit.default_timer() - start)
+                    result['seconds'] = min(timings)
+                    if time_limit is not None and min(timings) > time_limit:
+                        too_slow.add(algorithm)
+    return results
@@ -0,0 +1,78 @@
+""" Synthetic electorates. Every generator takes the candidates, a number of
+voters and a seed, and returns a list of ballots, each a list of candidates
+in order of preference. The same arguments always give the same ballots.
+"""
+import bisect
+import random
+from collections import OrderedDict
+
+
+def _ballot_length(rng, candidates, min_length):
+    if min_length is None:
+        return len(candidates)
+    return rng.randint(min(min_length, len(candidates)), len(candidates))
+
+
+def uniform(candidates, voters, seed=0, min_length=None):
+    """ Every voter ranks the candidates in an independent random order. With
+    a min_length, each ballot is cut off after a random number of candidates.
+    """
+    rng = random.Random(seed)
+    candidates = list(candidates)
+    return [rng.sample(candidates,
+                       _ballot_length(rng, candidates, min_length))
+            for _ in range(voters)]
+
+
+def _accumulate(values):
+    total = 0
+    totals = []
+    for value in values:
+        total += value
+        totals.append(total)
+    return totals
+
+
+def mallows(candidates, voters, seed=0, dispersion=0.5, min_length=None):
+    """ Ballots scattered around a single reference order, drawn from the
+    Mallows model by repeated insertion. A dispersion near 0 makes every
+    voter agree with the reference, and 1 is the same as uniform.
+    """
+    rng = random.Random(seed)
+    reference = list(candidates)
+    rng.shuffle(reference)
+
+    # The i-th candidate is inserted k places ahead of the end of the ballot
+    # with probability proportional to dispersion ** k
+    cumulative = [_accumulate(dispersion ** k for k in range(i + 1))
+                  for i in range(len(reference))]
+
+    ballots = []
+    for _ in range(voters):
+        ballot = []
+        for i, candidate in enumerate(reference):
+            weights = cumulative[i]
+            k = bisect.bisect_right(weights, rng.random() * weights[-1])
+            ballot.insert(i - min(k, i), candidate)
+        ballots.append(ballot[:_ballot_length(rng, ballot, min_length)])
+    return ballots
+
+
+def heavy_tie(candidates, voters, seed=0, blocs=2):
+    """ Voters are split evenly between a few random orders and their
+    reverses, so that most pairwise contests end up exactly tied
+    """
+    rng = random.Random(seed)
+    orders = []
+    for _ in range(blocs):
+        order = list(candidates)
+        rng.shuffle(order)
+        orders.extend([order, order[::-1]])
+    return [list(orders[voter % len(orders)]) for voter in range(voters)]
+
+
+ELECTORATES = OrderedDict([
+    ('uniform', uniform),
+    ('mallows', mallows),
+    ('heavy-tie', heavy_tie),
+])
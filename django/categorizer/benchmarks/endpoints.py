@@ -0,0 +1,129 @@
+""" Seeds a topic through the ORM and times requests against the API
+"""
+import random
+import timeit
+import uuid
+from collections import OrderedDict
+
+from django.contrib.auth.models import User
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from categorizer import matchups
+from categorizer.models import (Topic, Option, TopicOption, OptionRanking,
+                                PairwiseTally, OptionAggregate)
+from categorizer.ranking_cache import invalidate_rankings
+
+
+def seed_topic(options, users, rankings_per_user, seed=0):
+    """ Creates a topic with options, and users who have each ranked a random
+    selection of them. Returns the topic and its users.
+    """
+    rng = random.Random(seed)
+    prefix = 'benchmark-{}'.format(uuid.uuid4().hex[:8])
+    topic = Topic.objects.create(label=prefix)
+
+    # bulk_create doesn't return ids on every database, so read them back
+    Option.objects.bulk_create(
+        [Option(label='{} option {}'.format(prefix, n))
+         for n in range(options)], batch_size=500)
+    option_ids = (Option.objects.filter(label__startswith=prefix + ' ')
+                  .values_list('id', flat=True))
+    TopicOption.objects.bulk_create(
+        [TopicOption(topic=topic, option_id=option_id)
+         for option_id in option_ids], batch_size=500)
+    topicoption_ids = list(topic.topicoption.order_by('id')
+                           .values_list('id', flat=True))
+
+    User.objects.bulk_create(
+        [User(username='{}-{}'.format(prefix, n)) for n in range(users)],
+        batch_size=500)
+    seeded_users = list(User.objects.filter(username__startswith=prefix)
+                        .order_by('id'))
+
+    default_score = OptionRanking._meta.get_field('score').default
+    OptionRanking.objects.bulk_create([
+        OptionRanking(topicoption_id=topicoption_id, user=user,
+                      score=rng.gauss(default_score, 100))
+        for user in seeded_users
+        for topicoption_id in rng.sample(
+            topicoption_ids, min(rankings_per_user, len(topicoption_ids)))
+    ], batch_size=500)
+
+    # bulk_create skips the signals which keep these up to date
+    PairwiseTally.objects.rebuild(topic)
+    OptionAggregate.objects.rebuild(topic)
+    invalidate_rankings(topic.id)
+    matchups.invalidate_candidates(topic.id)
+    return topic, seeded_users
+
+
+def _summary(name, timings, queries):
+    timings = sorted(timings)
+
+    def percentile(p):
+        return timings[min(len(timings) - 1, int(p * len(timings)))]
+
+    return OrderedDict([
+        ('endpoint', name),
+        ('requests', len(timings)),
+        ('mean', sum(timings) / len(timings)),
+        ('p50', percentile(0.5)),
+        ('p95', percentile(0.95)),
+        ('max', timings[-1]),
+        ('queries', float(sum(queries)) / len(queries)),
+        ('max_queries', max(queries)),
+    ])
+
+
+class _Timer(object):
+    def __init__(self):
+        self.timings = []
+        self.queries = []
+
+    def __call__(self, function, *args, **kwargs):
+        with CaptureQueriesContext(connection) as captured:
+            start = timeit.default_timer()
+            result = function(*args, **kwargs)
+            self.timings.append(timeit.default_timer() - start)
+        self.queries.append(len(captured))
+        return result
+
+
+def time_endpoints(topic, users, requests, seed=0):
+    """ Makes each kind of request the given number of times, as users chosen
+    in turn, and summarizes their latency and query counts
+    """
+    rng = random.Random(seed)
+    client = APIClient()
+    rankings_url = reverse('ranker-topics-rankings',
+                           kwargs={'topic_id': topic.id})
+    contest_url = reverse('ranker-topics-contest',
+                          kwargs={'topic_id': topic.id})
+
+    timers = OrderedDict((name, _Timer()) for name in [
+        'calculate_top_options', 'rankings (cold)', 'rankings (cached)',
+        'contest', 'vote'])
+    for n in range(requests):
+        user = users[n % len(users)]
+        client.force_authenticate(user=user)
+
+        timers['calculate_top_options'](topic.calculate_top_options, 10)
+
+        invalidate_rankings(topic.id)
+        response = timers['rankings (cold)'](client.get, rankings_url)
+        assert(response.status_code == 200)
+        response = timers['rankings (cached)'](client.get, rankings_url)
+        assert(response.status_code == 200)
+
+        response = timers['contest'](client.get, contest_url)
+        assert(response.status_code == 200)
+        winner = rng.choice(response.json())['id']
+        response = timers['vote'](client.post, contest_url,
+                                  {'winner': winner})
+        assert(response.status_code == 200)
+
+    return [_summary(name, timer.timings, timer.queries)
+            for name, timer in timers.items()]
@@ -0,0 +1,133 @@
+""" Serves the API over HTTP and drives it with concurrent contest clients.
+
+serve runs a WSGI application either one request at a time, or with each
+connection handed to a pool of worker threads. contest_clients then has a
+thread per user fetch and vote on contests through real HTTP requests, so
+the two servers can be compared on the same database.
+"""
+import json
+import random
+import threading
+import timeit
+import urllib
+import urllib2
+from collections import OrderedDict
+from multiprocessing.pool import ThreadPool
+from wsgiref.simple_server import WSGIServer, WSGIRequestHandler
+
+
+class _QuietHandler(WSGIRequestHandler):
+    def log_message(self, *args):
+        pass
+
+
+class PooledWSGIServer(WSGIServer):
+    """ A WSGI server which handles each connection on a pool of threads
+    """
+    def __init__(self, address, handler, threads):
+        WSGIServer.__init__(self, address, handler)
+        self.pool = ThreadPool(threads)
+
+    def process_request(self, request, client_address):
+        self.pool.apply_async(self._process, (request, client_address))
+
+    def _process(self, request, client_address):
+        try:
+            self.finish_request(request, client_address)
+        except Exception:
+            self.handle_error(request, client_address)
+        finally:
+            self.shutdown_request(request)
+
+    def server_close(self):
+        WSGIServer.server_close(self)
+        self.pool.close()
+        self.pool.join()
+
+
+def serve(application, threads=0):
+    """ Starts serving the application on a free local port in a background
+    thread. With threads, requests are handled on a pool of that many
+    threads, otherwise one at a time.
+    """
+    address = ('127.0.0.1', 0)
+    if threads:
+        server = PooledWSGIServer(address, _QuietHandler, threads)
+    else:
+        server = WSGIServer(address, _QuietHandler)
+    server.set_app(application)
+
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def stop(server):
+    server.shutdown()
+    server.server_close()
+
+
+def _request(url, token, data=None):
+    request = urllib2.Request(
+        url, urllib.urlencode(data) if data is not None else None,
+        {'Authorization': 'Token ' + token})
+    response = urllib2.urlopen(request, timeout=60)
+    try:
+        return json.load(response)
+    finally:
+        response.close()
+
+
+def _percentile(timings, p):
+    return timings[min(len(timings) - 1, int(p * len(timings)))]
+
+
+def contest_clients(url, tokens, requests, seed=0):
+    """ Has a client for each token fetch its current contest at url and
+    vote for a random contestant, the given number of times. Returns the
+    throughput and latencies of the fetches and votes.
+    """
+    timings = {'contest': [], 'vote': []}
+    errors = []
+    lock = threading.Lock()
+
+    def run(n, token):
+        rng = random.Random(seed + n)
+        for _ in range(requests):
+            try:
+                start = timeit.default_timer()
+                options = _request(url, token)
+                fetched = timeit.default_timer()
+                _request(url, token, {'winner': rng.choice(options)['id']})
+                voted = timeit.default_timer()
+            except (urllib2.URLError, ValueError) as e:
+                with lock:
+                    errors.append(str(e))
+                continue
+            with lock:
+                timings['contest'].append(fetched - start)
+                timings['vote'].append(voted - fetched)
+
+    clients = [threading.Thread(target=run, args=(n, token))
+               for n, token in enumerate(tokens)]
+    start = timeit.default_timer()
+    for client in clients:
+        client.start()
+    for client in clients:
+        client.join()
+    seconds = timeit.default_timer() - start
+
+    result = OrderedDict([
+        ('clients', len(tokens)),
+        ('requests', 2 * len(timings['vote'])),
+        ('errors', len(errors)),
+        ('seconds', seconds),
+        ('throughput', 2 * len(timings['vote']) / seconds),
+    ])
+    for name in ['contest', 'vote']:
+        values = sorted(timings[name])
+        for p in [50, 95]:
+            result['{}_p{}'.format(name, p)] = (
+                _percentile(values, p / 100.0) if values else None)
+    return result
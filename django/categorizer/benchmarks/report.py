@@ -0,0 +1,59 @@
+""" Writes benchmark results as JSON and compares them between runs
+"""
+import json
+import platform
+from collections import OrderedDict
+
+import django
+import numpy
+
+
+def results_document(results, **parameters):
+    """ Wraps results with the environment and parameters they came from
+    """
+    return OrderedDict([
+        ('environment', OrderedDict([
+            ('python', platform.python_version()),
+            ('django', django.get_version()),
+            ('numpy', numpy.__version__),
+            ('machine', platform.machine()),
+        ])),
+        ('parameters', OrderedDict(sorted(parameters.items()))),
+        ('results', results),
+    ])
+
+
+def dump(document, stream):
+    # In one write, since management command output adds line endings
+    stream.write(json.dumps(document, indent=2, separators=(',', ': ')) +
+                 '\n')
+
+
+def compare_results(baseline, current, keys, metric):
+    """ Pairs up results with the same keys from two documents. Generates
+    (key, baseline value, current value, ratio) for each pair, where the
+    ratio is None if either run has no value.
+    """
+    def by_key(document):
+        return OrderedDict((tuple(result[k] for k in keys), result)
+                           for result in document['results'])
+
+    previous = by_key(baseline)
+    for key, result in by_key(current).items():
+        if key not in previous:
+            continue
+        old = previous[key].get(metric)
+        new = result.get(metric)
+        ratio = new / old if old and new is not None else None
+        yield key, old, new, ratio
+
+
+def format_comparison(comparison):
+    """ Formats the output of compare_results as lines of text
+    """
+    for key, old, new, ratio in comparison:
+        yield '{}: {} -> {}{}'.format(
+            ' '.join(str(k) for k in key),
+            'skipped' if old is None else '{:.6f}'.format(old),
+            'skipped' if new is None else '{:.6f}'.format(new),
+            '' if ratio is None else ' ({:.2f}x)'.format(ratio))
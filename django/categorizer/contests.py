@@ -0,0 +1,43 @@
+""" The contest fetch and vote paths, each as a single call.
+
+Every function does all of a request's database work and returns plain
+data, without handing querysets or model instances back to the caller, and
+runs in a transaction of its own. This keeps each path a self-contained unit
+that can run on one of a server's worker threads, as it does under the
+threaded Gunicorn workers set up in ranker_api/gunicorn_conf.py.
+"""
+from django.db import transaction
+from django.shortcuts import get_object_or_404
+
+from categorizer.models import Topic, Option, Contest
+
+
+@transaction.atomic
+def current_contestants(topic_id, user):
+    """ Returns the id and label of each option in the user's current
+    contest, creating the contest if needed
+    """
+    topic = get_object_or_404(Topic, id=topic_id)
+    contest = Contest.current_for(topic=topic, user=user)
+    return list(Option.objects
+                .filter(topicoption__rankings__contest=contest)
+                .order_by('id').values('id', 'label'))
+
+
+@transaction.atomic
+def vote(topic_id, user, option_id):
+    """ Decides the user's current contest in favor of one of its options.
+    Raises OptionRanking.DoesNotExist if the option isn't a contestant.
+    """
+    topic = get_object_or_404(Topic, id=topic_id)
+    contest = topic.contests.get(user=user, current=True)
+    winner = contest.contestants.get(topicoption__option_id=option_id)
+    contest.set_winner(winner)
+
+
+@transaction.atomic
+def skip(topic_id, user):
+    """ Discards the user's current contest without a winner
+    """
+    topic = get_object_or_404(Topic, id=topic_id)
+    topic.contests.get(user=user, current=True).delete()
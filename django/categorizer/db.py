@@ -0,0 +1,98 @@
+""" Database routing and connection upkeep.
+
+ReplicaRouter sends reads made inside replica_reads() to one of the
+DATABASE_REPLICAS, and everything else to the default database. Only views
+which can tolerate the replicas lagging behind use it, such as the rankings
+and the option and topic lists. Reads inside primary_reads() go to the
+default database again, such as for results that are cached.
+"""
+import functools
+import random
+import threading
+from contextlib import contextmanager
+
+from django.conf import settings
+from django.db import DEFAULT_DB_ALIAS, connections
+
+_local = threading.local()
+
+
+@contextmanager
+def _reads(replica):
+    previous = getattr(_local, 'replica_reads', False)
+    _local.replica_reads = replica
+    try:
+        yield
+    finally:
+        _local.replica_reads = previous
+
+
+def replica_reads():
+    """ Lets the queries made inside the block read from a replica
+    """
+    return _reads(True)
+
+
+def primary_reads():
+    """ Sends the queries made inside the block to the default database,
+    even inside replica_reads()
+    """
+    return _reads(False)
+
+
+def reads_from_replica(view):
+    """ Decorates a view so that its GET requests read from a replica
+    """
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        if request.method != 'GET':
+            return view(request, *args, **kwargs)
+        with replica_reads():
+            return view(request, *args, **kwargs)
+    return wrapped
+
+
+class ReplicaRouter(object):
+    def db_for_read(self, model, **hints):
+        replicas = getattr(settings, 'DATABASE_REPLICAS', [])
+        if not replicas or not getattr(_local, 'replica_reads', False):
+            return None
+        # A transaction on the default database may have written rows that
+        # the replicas can't see yet
+        if connections[DEFAULT_DB_ALIAS].in_atomic_block:
+            return None
+        return random.choice(replicas)
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        # The replicas hold the same rows as the default database
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        # Replicas receive their schema from the default database
+        return db not in getattr(settings, 'DATABASE_REPLICAS', [])
+
+
+def close_unusable_connections(**kwargs):
+    """ Closes persistent connections that the server has dropped, so that
+    the request opens a new one instead of failing on its first query. Only
+    checks databases with CONN_HEALTH_CHECKS set.
+    """
+    for connection in connections.all():
+        if (connection.settings_dict.get('CONN_HEALTH_CHECKS') and
+                connection.connection is not None and
+                not connection.is_usable()):
+            connection.close()
+
+
+def configure_sqlite(sender, connection, **kwargs):
+    """ Applies SQLITE_PRAGMAS to each new SQLite connection
+    """
+    if connection.vendor != 'sqlite':
+        return
+    # Run on the underlying connection, so that these aren't counted as the
+    # request's queries
+    for name, value in getattr(settings, 'SQLITE_PRAGMAS', {}).items():
+        connection.connection.execute('PRAGMA {} = {}'.format(name, value))
@@ -0,0 +1,112 @@
+""" Set-based deletion of topic options and option rankings.
+
+QuerySet.delete() loads every row and sends the OptionRanking delete signal
+for each one, which deletes that ranking's contests with a query of its own.
+These functions gather the affected contests with a single query and delete
+everything in chunks instead. Like QuerySet.delete(), they return the total
+number of rows deleted along with a count for each model.
+"""
+from collections import Counter, defaultdict
+
+from django.db import transaction
+from django.db.models import Q
+
+from categorizer import matchups
+from categorizer.models import (Contest, OptionAggregate, OptionRanking,
+                                PairwiseTally, TopicOption,
+                                TopicRankingSnapshot, chunked)
+from categorizer.ranking_cache import invalidate_rankings
+
+
+def _result(counts):
+    counts = {label: count for label, count in counts.items() if count}
+    return sum(counts.values()), counts
+
+
+def delete_contests(contest_ids, chunk_size=500):
+    """ Deletes contests by id, a chunk at a time, taking the decided ones
+    out of their options' wins and losses
+    """
+    counts = Counter()
+    for chunk in chunked(set(contest_ids), chunk_size):
+        contests = Contest.objects.filter(id__in=chunk)
+        OptionAggregate.objects.remove_contests(contests)
+        counts.update(contests.delete()[1])
+    return _result(counts)
+
+
+def _raw_delete(queryset, ids, chunk_size):
+    # Only used once nothing refers to the rows, since no cascades or
+    # signals are run
+    deleted = 0
+    for chunk in chunked(ids, chunk_size):
+        rows = queryset.model.objects.filter(id__in=chunk)
+        deleted += rows._raw_delete(rows.db)
+    return deleted
+
+
+def delete_rankings(rankings, chunk_size=500):
+    """ Deletes a queryset of OptionRankings along with the contests they
+    were in, and takes them off their users' ballots
+    """
+    counts = Counter()
+    with transaction.atomic():
+        contest_ids = (Contest.contestants.through.objects
+                       .filter(optionranking__in=rankings)
+                       .values_list('contest_id', flat=True))
+        counts.update(delete_contests(list(contest_ids), chunk_size)[1])
+
+        rows = list(rankings.values_list('id', 'topicoption_id',
+                                         'topicoption__topic_id', 'user_id',
+                                         'score'))
+        ballots = defaultdict(dict)
+        for _, topicoption_id, topic_id, user_id, score in rows:
+            ballots[(topic_id, user_id)][topicoption_id] = (score, None)
+        for (topic_id, user_id), changed in ballots.items():
+            PairwiseTally.objects.record_ballot(topic_id, user_id, changed)
+        OptionAggregate.objects.record(
+            [(topicoption_id, score, None)
+             for _, topicoption_id, _, user_id, score in rows
+             if user_id is not None])
+
+        counts[OptionRanking._meta.label] = _raw_delete(
+            rankings, [row[0] for row in rows], chunk_size)
+
+    for topic_id in set(row[2] for row in rows):
+        matchups.invalidate_candidates(topic_id)
+        invalidate_rankings(topic_id)
+        TopicRankingSnapshot.objects.discard(topic_id)
+    return _result(counts)
+
+
+def delete_topic_options(topicoptions, chunk_size=500):
+    """ Deletes a queryset of TopicOptions, with every ranking of them and
+    the contests those were in. The rest of each topic's tallies don't
+    change, since they only count ballots that rank both options of a pair.
+    """
+    counts = Counter()
+    with transaction.atomic():
+        contest_ids = (Contest.contestants.through.objects
+                       .filter(optionranking__topicoption__in=topicoptions)
+                       .values_list('contest_id', flat=True))
+        counts.update(delete_contests(list(contest_ids), chunk_size)[1])
+
+        rows = list(topicoptions.values_list('id', 'topic_id'))
+        ids = [topicoption_id for topicoption_id, _ in rows]
+        for chunk in chunked(ids, chunk_size):
+            counts.update(PairwiseTally.objects.filter(
+                Q(topicoption_a_id__in=chunk) |
+                Q(topicoption_b_id__in=chunk)).delete()[1])
+            counts.update(OptionAggregate.objects.filter(
+                topicoption_id__in=chunk).delete()[1])
+            rankings = OptionRanking.objects.filter(topicoption_id__in=chunk)
+            counts[OptionRanking._meta.label] += rankings._raw_delete(
+                rankings.db)
+        counts[TopicOption._meta.label] = _raw_delete(topicoptions, ids,
+                                                      chunk_size)
+
+    for topic_id in set(topic_id for _, topic_id in rows):
+        matchups.invalidate_candidates(topic_id)
+        invalidate_rankings(topic_id)
+        TopicRankingSnapshot.objects.discard(topic_id)
+    return _result(counts)
@@ -0,0 +1,55 @@
+import numpy
+
+
+def expected_scores(scores):
+    """ Returns a matrix where [i, j] is contestant i's expected score
+    against contestant j
+    """
+    scores = numpy.asarray(scores, dtype=numpy.float64)
+    score_range = scores[numpy.newaxis, :] - scores[:, numpy.newaxis]
+    return 1.0 / (1 + numpy.power(10, score_range / 400))
+
+
+def k_factors(k_factor, games=None, decay=0):
+    """ Returns each contestant's K-factor. With a decay, K is halved once a
+    contestant has played that many games, and keeps shrinking after that.
+    """
+    if games is None or not decay:
+        return k_factor
+    games = numpy.asarray(games, dtype=numpy.float64)
+    return k_factor * decay / (decay + games)
+
+
+def contest_deltas(scores, results, k_factor=16, games=None, decay=0):
+    """ Computes the score change for every contestant in a contest.
+    results holds each contestant's actual score against every opponent:
+    1 for the winner and 0 for the others, or 0.5 for contestants that drew.
+    """
+    expected = expected_scores(scores)
+    numpy.fill_diagonal(expected, 0)
+    results = numpy.asarray(results, dtype=numpy.float64)
+
+    opponents = len(results) - 1
+    adjustment = results * opponents - expected.sum(axis=1)
+    return k_factors(k_factor, games, decay) * adjustment
+
+
+def winner_results(count, winner):
+    """ Builds the results array for a contest with a single winner
+    """
+    results = numpy.zeros(count)
+    results[winner] = 1
+    return results
+
+
+def replay(scores, games, contests, k_factor=16, decay=0):
+    """ Applies a sequence of contests to the scores and games arrays in
+    place. Each contest is a pair of (contestant indexes, results).
+    """
+    for contestants, results in contests:
+        contestants = numpy.asarray(contestants, dtype=numpy.intp)
+        scores[contestants] += contest_deltas(scores[contestants], results,
+                                              k_factor, games[contestants],
+                                              decay)
+        games[contestants] += 1
+    return scores, games
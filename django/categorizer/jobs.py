@@ -0,0 +1,69 @@
+""" Recomputes topic rankings away from the web workers.
+
+Deciding a contest queues its topic as a RankingJob. The process_ranking_jobs
+command claims queued topics from that table and recomputes every ranking
+method for each of them, on a pool of processes, storing the results as
+TopicRankingSnapshots for the rankings endpoint to serve.
+"""
+import logging
+import multiprocessing
+
+from django.conf import settings
+from django.db import connections
+
+from categorizer.models import Topic, RankingJob, TopicRankingSnapshot
+
+logger = logging.getLogger(__name__)
+
+
+def snapshot_methods():
+    return getattr(settings, 'RANKING_SNAPSHOT_METHODS',
+                   Topic.RANKING_METHODS)
+
+
+def compute_snapshots(topic_id):
+    """ Stores a fresh snapshot of each ranking method for the topic.
+    Returns whether it succeeded.
+    """
+    try:
+        topic = Topic.objects.get(id=topic_id)
+        for method in snapshot_methods():
+            TopicRankingSnapshot.objects.store(
+                topic.id, method, list(topic.ranked_option_ids(method)))
+    except Topic.DoesNotExist:
+        # Deleting the topic also deleted its job
+        pass
+    except Exception:
+        logger.exception('Failed to compute rankings for topic %d',
+                         topic_id)
+        return False
+    return True
+
+
+def start_pool(processes):
+    """ Starts a pool of worker processes for run_jobs
+    """
+    # The forked processes mustn't share this process's connections
+    connections.close_all()
+    return multiprocessing.Pool(processes)
+
+
+def run_jobs(limit=10, timeout=600, pool=None):
+    """ Claims up to limit queued jobs and computes their snapshots, on the
+    pool if one is given. Jobs which fail are left claimed, so they are
+    retried once timeout seconds have passed. Returns how many jobs were
+    claimed and how many of those were finished.
+    """
+    jobs = RankingJob.objects.claim(limit, timeout)
+    topic_ids = [topic_id for topic_id, _ in jobs]
+    if pool is not None:
+        results = pool.map(compute_snapshots, topic_ids)
+    else:
+        results = [compute_snapshots(topic_id) for topic_id in topic_ids]
+
+    finished = 0
+    for (topic_id, requested_at), succeeded in zip(jobs, results):
+        if succeeded:
+            RankingJob.objects.finish(topic_id, requested_at)
+            finished += 1
+    return len(jobs), finished
@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+
+from categorizer.benchmarks.endpoints import seed_topic, time_endpoints
+from categorizer.benchmarks.report import (compare_results, dump,
+                                           format_comparison,
+                                           results_document)
+
+
+class Command(BaseCommand):
+    help = ('Seeds a test database with a topic and times requests against '
+            'the API, writing the latencies and query counts as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--options', type=int, default=100,
+                            help='Number of options in the topic')
+        parser.add_argument('--users', type=int, default=50)
+        parser.add_argument('--rankings-per-user', type=int, default=20,
+                            help='Number of options each user has ranked')
+        parser.add_argument('--requests', type=int, default=50,
+                            help='Number of times to make each request')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output',
+                            help='File to write to, instead of stdout')
+        parser.add_argument('--compare',
+                            help='Earlier results to compare against')
+
+    def handle(self, *args, **options):
+        # Never touch the real database
+        setup_test_environment()
+        database_name = connection.settings_dict['NAME']
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            topic, users = seed_topic(options['options'], options['users'],
+                                      options['rankings_per_user'],
+                                      seed=options['seed'])
+            results = time_endpoints(topic, users, options['requests'],
+                                     seed=options['seed'])
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0)
+            teardown_test_environment()
+
+        document = results_document(
+            results, options=options['options'], users=options['users'],
+            rankings_per_user=options['rankings_per_user'],
+            requests=options['requests'], seed=options['seed'],
+            database=connection.vendor)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                dump(document, output)
+        else:
+            dump(document, self.stdout)
+
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                comparison = compare_results(json.load(baseline), document,
+                                             ['endpoint'], 'p50')
+            for line in format_comparison(comparison):
+                self.stderr.write(line)
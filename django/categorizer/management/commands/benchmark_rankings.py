@@ -0,0 +1,63 @@
+import json
+
+from django.core.management.base import BaseCommand
+
+from categorizer.benchmarks.algorithms import ALGORITHMS, time_algorithms
+from categorizer.benchmarks.electorates import ELECTORATES
+from categorizer.benchmarks.report import (compare_results, dump,
+                                           format_comparison,
+                                           results_document)
+
+
+class Command(BaseCommand):
+    help = ('Times the ranked preference algorithms on synthetic '
+            'electorates and writes the results as JSON')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--candidates', nargs='+', type=int,
+                            default=[5, 20, 50],
+                            help='Candidate counts to time')
+        parser.add_argument('--voters', nargs='+', type=int,
+                            default=[100, 1000],
+                            help='Voter counts to time')
+        parser.add_argument('--electorates', nargs='+',
+                            choices=list(ELECTORATES),
+                            default=list(ELECTORATES))
+        parser.add_argument('--algorithms', nargs='+',
+                            choices=list(ALGORITHMS),
+                            default=list(ALGORITHMS))
+        parser.add_argument('--repeat', type=int, default=3,
+                            help='Number of timings to take the fastest of')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--time-limit', type=float, default=10,
+                            help='Skip larger sizes once an algorithm takes '
+                                 'longer than this many seconds')
+        parser.add_argument('--output',
+                            help='File to write to, instead of stdout')
+        parser.add_argument('--compare',
+                            help='Earlier results to compare against')
+
+    def handle(self, *args, **options):
+        results = time_algorithms(
+            options['candidates'], options['voters'],
+            options['electorates'], options['algorithms'],
+            repeat=options['repeat'], seed=options['seed'],
+            time_limit=options['time_limit'])
+        document = results_document(
+            results, repeat=options['repeat'], seed=options['seed'],
+            time_limit=options['time_limit'])
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                dump(document, output)
+        else:
+            dump(document, self.stdout)
+
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                comparison = compare_results(
+                    json.load(baseline), document,
+                    ['algorithm', 'electorate', 'candidates', 'voters'],
+                    'seconds')
+            for line in format_comparison(comparison):
+                self.stderr.write(line)
@@ -0,0 +1,34 @@
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand
+
+from categorizer.models import Topic, Contest
+
+
+class Command(BaseCommand):
+    help = ('Pre-generates pending contests for every user who has voted in '
+            'a topic')
+
+    def add_arguments(self, parser):
+        parser.add_argument('topic_ids', nargs='*', type=int,
+                            help='Topics to fill, defaults to all topics')
+        parser.add_argument('--size', type=int,
+                            default=getattr(settings, 'CONTEST_QUEUE_SIZE',
+                                            10),
+                            help='Number of contests to keep queued')
+
+    def handle(self, *args, **options):
+        topics = Topic.objects.order_by('id')
+        if options['topic_ids']:
+            topics = topics.filter(id__in=options['topic_ids'])
+
+        for topic in topics:
+            if topic.topicoption.count() < 2:
+                continue
+
+            users = User.objects.filter(
+                optionranking__topicoption__topic=topic).distinct()
+            created = sum(Contest.fill_queue(topic, user, options['size'])
+                          for user in users)
+            self.stdout.write('Topic {}: queued {} contests'.format(
+                topic.id, created))
@@ -0,0 +1,92 @@
+import json
+import os
+import tempfile
+from collections import OrderedDict
+
+from django.core.management.base import BaseCommand
+from django.core.wsgi import get_wsgi_application
+from django.db import connection
+from django.test.utils import (setup_test_environment,
+                               teardown_test_environment)
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from categorizer.benchmarks.endpoints import seed_topic
+from categorizer.benchmarks.load import contest_clients, serve, stop
+from categorizer.benchmarks.report import (compare_results, dump,
+                                           format_comparison,
+                                           results_document)
+
+
+class Command(BaseCommand):
+    help = ('Seeds a test database with a topic, then serves the API over '
+            'HTTP and has concurrent clients fetch and vote on contests, '
+            'comparing a serial server with a thread pool')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--options', type=int, default=100,
+                            help='Number of options in the topic')
+        parser.add_argument('--clients', type=int, default=8,
+                            help='Number of concurrent users')
+        parser.add_argument('--requests', type=int, default=25,
+                            help='Number of votes each client makes')
+        parser.add_argument('--threads', type=int, default=8,
+                            help='Size of the pooled server\'s thread pool')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--output',
+                            help='File to write to, instead of stdout')
+        parser.add_argument('--compare',
+                            help='Earlier results to compare against')
+
+    def handle(self, *args, **options):
+        # Never touch the real database. The server's threads each open
+        # their own connection, so SQLite needs a file rather than memory.
+        setup_test_environment()
+        database_name = connection.settings_dict['NAME']
+        if connection.vendor == 'sqlite':
+            handle, test_name = tempfile.mkstemp(suffix='.sqlite3')
+            os.close(handle)
+            connection.settings_dict['TEST']['NAME'] = test_name
+        connection.creation.create_test_db(verbosity=0, autoclobber=True)
+        try:
+            topic, users = seed_topic(options['options'], options['clients'],
+                                      0, seed=options['seed'])
+            tokens = [Token.objects.create(user=user).key for user in users]
+            path = reverse('ranker-topics-contest',
+                           kwargs={'topic_id': topic.id})
+
+            application = get_wsgi_application()
+            results = []
+            for name, threads in [('serial', 0),
+                                  ('pooled', options['threads'])]:
+                server = serve(application, threads)
+                try:
+                    url = 'http://127.0.0.1:{}{}'.format(server.server_port,
+                                                         path)
+                    result = contest_clients(url, tokens, options['requests'],
+                                             seed=options['seed'])
+                finally:
+                    stop(server)
+                results.append(OrderedDict(
+                    [('server', name), ('threads', threads)] +
+                    list(result.items())))
+        finally:
+            connection.creation.destroy_test_db(database_name, verbosity=0)
+            teardown_test_environment()
+
+        document = results_document(
+            results, options=options['options'], clients=options['clients'],
+            requests=options['requests'], threads=options['threads'],
+            seed=options['seed'], database=connection.vendor)
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                dump(document, output)
+        else:
+            dump(document, self.stdout)
+
+        if options['compare']:
+            with open(options['compare']) as baseline:
+                comparison = compare_results(json.load(baseline), document,
+                                             ['server'], 'throughput')
+            for line in format_comparison(comparison):
+                self.stderr.write(line)
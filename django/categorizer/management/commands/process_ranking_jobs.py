@@ -0,0 +1,46 @@
+import multiprocessing
+import time
+
+from django.core.management.base import BaseCommand
+
+from categorizer import jobs
+
+
+class Command(BaseCommand):
+    help = ('Recomputes the rankings of topics whose contests have been '
+            'decided, storing them as snapshots for the rankings endpoint')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int,
+                            default=multiprocessing.cpu_count(),
+                            help='Number of worker processes, or 0 to '
+                                 'compute in this process')
+        parser.add_argument('--batch-size', type=int, default=10,
+                            help='Number of topics to claim at a time')
+        parser.add_argument('--timeout', type=int, default=600,
+                            help='Seconds after which a job claimed by '
+                                 'another worker is retried')
+        parser.add_argument('--interval', type=float, default=5,
+                            help='Seconds to wait when no jobs are queued')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty')
+
+    def handle(self, *args, **options):
+        pool = None
+        if options['processes']:
+            pool = jobs.start_pool(options['processes'])
+        try:
+            while True:
+                claimed, finished = jobs.run_jobs(options['batch_size'],
+                                                  options['timeout'], pool)
+                if claimed:
+                    self.stdout.write('Computed rankings for {} of {} '
+                                      'topics'.format(finished, claimed))
+                elif options['once']:
+                    return
+                else:
+                    time.sleep(options['interval'])
+        finally:
+            if pool is not None:
+                pool.close()
+                pool.join()
@@ -0,0 +1,53 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from categorizer.models import Topic, PairwiseTally, OptionAggregate
+from categorizer.ranked_preference import (matrix_rankings, pairwise_matrix,
+                                           pairwise_rankings)
+
+
+class Command(BaseCommand):
+    help = ('Rebuilds the stored pairwise tallies and option aggregates '
+            'from the option rankings, and checks the tallies against '
+            'pairwise_rankings')
+
+    def add_arguments(self, parser):
+        parser.add_argument('topic_ids', nargs='*', type=int,
+                            help='Topics to rebuild, defaults to all topics')
+        parser.add_argument('--check', action='store_true',
+                            help='Only verify the existing tallies')
+
+    def handle(self, *args, **options):
+        topics = Topic.objects.order_by('id')
+        if options['topic_ids']:
+            topics = topics.filter(id__in=options['topic_ids'])
+
+        failed = []
+        for topic in topics:
+            if not options['check']:
+                count = PairwiseTally.objects.rebuild(topic)
+                aggregates = OptionAggregate.objects.rebuild(topic)
+                self.stdout.write(
+                    'Topic {}: stored {} pairs and {} aggregates'.format(
+                        topic.id, count, aggregates))
+
+            if not self.verify(topic):
+                failed.append(topic.id)
+                self.stderr.write('Topic {}: tallies do not match'.format(
+                    topic.id))
+
+        if failed:
+            raise CommandError('Mismatched tallies for topics {}'.format(
+                ', '.join(str(topic_id) for topic_id in failed)))
+
+    def verify(self, topic):
+        topicoption_ids = list(topic.topicoption.order_by('id')
+                               .values_list('id', flat=True))
+        ballots = topic.ballots(topicoption_ids)
+
+        stored = PairwiseTally.objects.matrix(topic, topicoption_ids)
+        counted = pairwise_matrix(topicoption_ids, ballots)
+        if (stored != counted).any():
+            return False
+
+        expected = list(pairwise_rankings(topicoption_ids, ballots))
+        return list(matrix_rankings(topicoption_ids, stored)) == expected
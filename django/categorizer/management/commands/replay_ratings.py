@@ -0,0 +1,141 @@
+import numpy
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+from django.db.models import Case, FloatField, IntegerField, Q, When
+
+from categorizer import elo, matchups
+from categorizer.models import (Topic, Contest, OptionRanking, PairwiseTally,
+                                OptionAggregate, RankingJob)
+from categorizer.ranking_cache import invalidate_rankings
+
+
+def decided_contests(topic, chunk_size, batch_size=500):
+    """ Generates (OptionRanking ids, winner id) for each decided contest in
+    the topic, in the order they were decided. Contests are read in chunks
+    so that memory use doesn't depend on how many there are.
+    """
+    through = Contest.contestants.through
+    decided = (Contest.objects.filter(topic=topic, winner__isnull=False)
+               .order_by('decided_at', 'id'))
+    last = None
+    while True:
+        contests = decided
+        if last is not None:
+            contests = contests.filter(
+                Q(decided_at__gt=last[0]) |
+                Q(decided_at=last[0], id__gt=last[1]))
+        chunk = list(contests.values_list('decided_at', 'id', 'winner_id')
+                     [:chunk_size])
+        if not chunk:
+            return
+        last = chunk[-1][:2]
+
+        contestants = {contest_id: [] for _, contest_id, _ in chunk}
+        ids = list(contestants)
+        for start in range(0, len(ids), batch_size):
+            rows = (through.objects
+                    .filter(contest_id__in=ids[start:start + batch_size])
+                    .order_by('contest_id', 'optionranking_id')
+                    .values_list('contest_id', 'optionranking_id'))
+            for contest_id, ranking_id in rows.iterator():
+                contestants[contest_id].append(ranking_id)
+
+        for _, contest_id, winner_id in chunk:
+            yield contestants[contest_id], winner_id
+
+
+class Command(BaseCommand):
+    help = ('Recomputes every OptionRanking score in a topic by replaying '
+            'its decided contests in order')
+
+    def add_arguments(self, parser):
+        parser.add_argument('topic_id', type=int)
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Report the score changes without saving')
+        parser.add_argument('--chunk-size', type=int, default=5000,
+                            help='Number of contests to read per query')
+        parser.add_argument('--batch-size', type=int, default=500,
+                            help='Number of rankings to write per update')
+        parser.add_argument('--show', type=int, default=10,
+                            help='Number of largest changes to list')
+
+    def handle(self, *args, **options):
+        try:
+            topic = Topic.objects.get(id=options['topic_id'])
+        except Topic.DoesNotExist:
+            raise CommandError('Unknown topic {}'.format(options['topic_id']))
+
+        rankings = list(OptionRanking.objects
+                        .filter(topicoption__topic=topic).order_by('id')
+                        .values_list('id', 'score', 'games'))
+        index = {ranking_id: i for i, (ranking_id, _, _) in
+                 enumerate(rankings)}
+        current_scores = numpy.array([row[1] for row in rankings])
+        current_games = numpy.array([row[2] for row in rankings])
+
+        default_score = OptionRanking._meta.get_field('score').default
+        scores = numpy.full(len(rankings), default_score, dtype=numpy.float64)
+        games = numpy.zeros(len(rankings), dtype=numpy.float64)
+
+        total = Contest.objects.filter(topic=topic,
+                                       winner__isnull=False).count()
+        replayed = 0
+        for contestants, winner_id in decided_contests(
+                topic, options['chunk_size']):
+            contest = ([index[ranking_id] for ranking_id in contestants],
+                       elo.winner_results(len(contestants),
+                                          contestants.index(winner_id)))
+            elo.replay(scores, games, [contest], topic.elo_k_factor,
+                       topic.elo_k_decay)
+
+            replayed += 1
+            if replayed % options['chunk_size'] == 0:
+                self.stdout.write('Replayed {}/{} contests'.format(replayed,
+                                                                   total))
+        self.stdout.write('Replayed {}/{} contests'.format(replayed, total))
+
+        # Ignore rounding differences from the scores having been updated
+        # one contest at a time
+        changed = numpy.flatnonzero(
+            ~numpy.isclose(scores, current_scores, rtol=0, atol=1e-6) |
+            (games != current_games))
+        self.report(rankings, scores, current_scores, changed,
+                    options['show'])
+        if options['dry_run'] or not len(changed):
+            return
+
+        with transaction.atomic():
+            for start in range(0, len(changed), options['batch_size']):
+                batch = changed[start:start + options['batch_size']]
+                ids = [rankings[i][0] for i in batch]
+                OptionRanking.objects.filter(id__in=ids).update(
+                    score=Case(*[When(id=rankings[i][0],
+                                      then=float(scores[i]))
+                                 for i in batch],
+                               output_field=FloatField()),
+                    games=Case(*[When(id=rankings[i][0], then=int(games[i]))
+                                 for i in batch],
+                               output_field=IntegerField()))
+
+            # The new scores reorder the ballots, so recount the tallies
+            PairwiseTally.objects.rebuild(topic)
+            OptionAggregate.objects.rebuild(topic)
+            RankingJob.objects.mark_dirty(topic.id)
+        invalidate_rankings(topic.id)
+        matchups.invalidate_candidates(topic.id)
+        self.stdout.write('Updated {} rankings'.format(len(changed)))
+
+    def report(self, rankings, scores, current_scores, changed, show):
+        if not len(changed):
+            self.stdout.write('No scores changed')
+            return
+
+        differences = scores[changed] - current_scores[changed]
+        self.stdout.write('{} of {} rankings changed, largest change '
+                          '{:.2f}'.format(len(changed), len(rankings),
+                                          abs(differences).max()))
+        for i in numpy.argsort(-abs(differences))[:show]:
+            ranking = changed[i]
+            self.stdout.write('  OptionRanking {}: {:.2f} -> {:.2f}'.format(
+                rankings[ranking][0], current_scores[ranking],
+                scores[ranking]))
@@ -0,0 +1,221 @@
+""" Strategies for choosing which two options a user is asked to compare.
+
+Each strategy works on a MatchupCandidates snapshot of the topic's options
+and the user's scores and contest counts, held in a small in-process LRU so
+that choosing a pair does not have to scan the topic's options.
+"""
+import copy
+import random
+import threading
+from collections import OrderedDict
+
+import numpy
+from django.conf import settings
+from django.core.cache import cache
+
+
+def _membership_key(topic_id):
+    return 'matchups:{}:version'.format(topic_id)
+
+
+def _user_key(topic_id, user_id):
+    return 'matchups:{}:{}:version'.format(topic_id, user_id)
+
+
+def _start_version(key):
+    # A counter that went missing may have been evicted, so start it from a
+    # random value that candidates loaded earlier are unlikely to share
+    cache.add(key, random.randint(1, 1 << 30), None)
+    return cache.get(key)
+
+
+def _bump(key):
+    try:
+        return cache.incr(key)
+    except ValueError:
+        return _start_version(key)
+
+
+def invalidate_candidates(topic_id):
+    """ Marks every user's candidates for a topic as out of date, such as when
+    an option is added or removed
+    """
+    _bump(_membership_key(topic_id))
+
+
+class MatchupCandidates(object):
+    """ The options in a topic, along with one user's score for each option
+    and how many decided contests it has been in
+    """
+    def __init__(self, topicoption_ids, scores, comparisons):
+        self.topicoption_ids = numpy.asarray(topicoption_ids,
+                                             dtype=numpy.int64)
+        self.scores = numpy.asarray(scores, dtype=numpy.float64)
+        self.comparisons = numpy.asarray(comparisons, dtype=numpy.int64)
+        self.index = {v: i for i, v in enumerate(topicoption_ids)}
+        self.version = None
+
+    @classmethod
+    def load(cls, topic_id, user):
+        from categorizer.models import TopicOption, OptionRanking
+
+        topicoption_ids = list(TopicOption.objects.filter(topic_id=topic_id)
+                               .order_by('id').values_list('id', flat=True))
+        default_score = OptionRanking._meta.get_field('score').default
+        candidates = cls(topicoption_ids,
+                         [default_score] * len(topicoption_ids),
+                         [0] * len(topicoption_ids))
+
+        if user is not None:
+            rankings = (OptionRanking.objects
+                        .filter(topicoption__topic_id=topic_id, user=user)
+                        .values_list('topicoption_id', 'score', 'games'))
+            for topicoption_id, score, games in rankings:
+                i = candidates.index[topicoption_id]
+                candidates.scores[i] = score
+                candidates.comparisons[i] = games
+        return candidates
+
+    def record_contest(self, scores, counts=None):
+        """ Applies the new scores from decided contests
+        """
+        for topicoption_id, score in scores.items():
+            i = self.index.get(topicoption_id)
+            if i is not None:
+                self.scores[i] = score
+                self.comparisons[i] += (counts or {}).get(topicoption_id, 1)
+
+    def __len__(self):
+        return len(self.topicoption_ids)
+
+
+class _CandidateCache(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.entries = OrderedDict()
+
+    def get(self, topic_id, user):
+        user_id = getattr(user, 'id', None)
+        membership_key = _membership_key(topic_id)
+        user_key = _user_key(topic_id, user_id)
+        versions = cache.get_many([membership_key, user_key])
+        version = tuple(versions[key] if key in versions
+                        else _start_version(key)
+                        for key in [membership_key, user_key])
+
+        key = (topic_id, user_id)
+        with self.lock:
+            candidates = self.entries.pop(key, None)
+            if candidates is not None and candidates.version == version:
+                self.entries[key] = candidates
+                return candidates
+
+        candidates = MatchupCandidates.load(topic_id, user)
+        candidates.version = version
+        with self.lock:
+            self.entries[key] = candidates
+            while len(self.entries) > getattr(settings, 'MATCHUP_CACHE_SIZE',
+                                              128):
+                self.entries.popitem(last=False)
+        return candidates
+
+    def record_contest(self, topic_id, user_id, scores, counts=None):
+        membership_version = cache.get(_membership_key(topic_id))
+        user_version = _bump(_user_key(topic_id, user_id))
+        key = (topic_id, user_id)
+        with self.lock:
+            candidates = self.entries.pop(key, None)
+            if candidates is None:
+                return
+            # Only keep the candidates if nothing else changed them since
+            # they were loaded, otherwise they are reloaded on next use
+            if candidates.version == (membership_version, user_version - 1):
+                candidates.record_contest(scores, counts)
+                candidates.version = (membership_version, user_version)
+                self.entries[key] = candidates
+
+
+_candidates = _CandidateCache()
+
+
+def record_contest(topic_id, user_id, scores, counts=None):
+    """ Updates the user's candidates after contests were decided. scores
+    maps each contestant's TopicOption id to its new score, and counts to how
+    many of the contests it was in, defaulting to one.
+    """
+    _candidates.record_contest(topic_id, user_id, scores, counts)
+
+
+def _least(values, rng, exclude=None):
+    """ Returns a random index out of those with the lowest value
+    """
+    values = numpy.array(values, dtype=numpy.float64)
+    if exclude is not None:
+        values[exclude] = numpy.inf
+    return rng.choice(numpy.flatnonzero(values == values.min()))
+
+
+def random_pair(candidates, rng):
+    first = rng.randrange(len(candidates))
+    second = rng.randrange(len(candidates) - 1)
+    return first, second + 1 if second >= first else second
+
+
+def least_compared_pair(candidates, rng):
+    first = _least(candidates.comparisons, rng)
+    second = _least(candidates.comparisons, rng, exclude=first)
+    return first, second
+
+
+def closest_elo_pair(candidates, rng):
+    first = rng.randrange(len(candidates))
+    distance = numpy.abs(candidates.scores - candidates.scores[first])
+    second = _least(distance, rng, exclude=first)
+    return first, second
+
+
+def uncertain_pair(candidates, rng):
+    # Start from the option we know least about, and pit it against the
+    # opponent whose result is hardest to predict. Options which have been
+    # compared less often are favored, since their scores are less settled.
+    first = _least(candidates.comparisons, rng)
+    score_range = candidates.scores - candidates.scores[first]
+    expected = 1.0 / (1 + numpy.power(10, score_range / 400))
+    information = (expected * (1 - expected) /
+                   numpy.sqrt(1 + candidates.comparisons))
+    second = _least(-information, rng, exclude=first)
+    return first, second
+
+
+STRATEGIES = OrderedDict([
+    ('random', random_pair),
+    ('least-compared', least_compared_pair),
+    ('closest-elo', closest_elo_pair),
+    ('uncertainty', uncertain_pair),
+])
+
+
+def choose_pair(topic, user, rng=random):
+    """ Picks two TopicOption ids for the user to compare, using the
+    topic's pairing strategy
+    """
+    return choose_pairs(topic, user, 1, rng)[0]
+
+
+def choose_pairs(topic, user, count, rng=random):
+    """ Picks several pairs at once. Each pair counts as a comparison for the
+    following picks, so that a batch is spread over the topic's options.
+    """
+    candidates = _candidates.get(topic.id, user)
+    assert(len(candidates) >= 2)
+
+    strategy = STRATEGIES[topic.pairing_strategy]
+    planned = copy.copy(candidates)
+    planned.comparisons = candidates.comparisons.copy()
+
+    pairs = []
+    for _ in range(count):
+        pair = strategy(planned, rng)
+        planned.comparisons[list(pair)] += 1
+        pairs.append([int(candidates.topicoption_ids[i]) for i in pair])
+    return pairs
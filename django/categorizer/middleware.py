@@ -0,0 +1,47 @@
+import random
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+from categorizer import timing
+
+
+def view_name(view_func, request):
+    """ Names a view for its timings, such as 'topic_rankings' or
+    'TopicViewSet.list'
+    """
+    cls = getattr(view_func, 'cls', None)
+    if cls is None:
+        return '{}.{}'.format(view_func.__module__, view_func.__name__)
+
+    actions = getattr(view_func, 'actions', None)
+    if actions:
+        method = request.method.lower()
+        return '{}.{}'.format(cls.__name__, actions.get(method, method))
+    return cls.__name__
+
+
+class RequestTimingMiddleware(MiddlewareMixin):
+    """ Times a sample of requests, adding a Server-Timing header to their
+    responses and recording them in a histogram for their view. Set
+    REQUEST_TIMING_SAMPLE_RATE to time only a fraction of requests.
+    """
+    def process_request(self, request):
+        rate = getattr(settings, 'REQUEST_TIMING_SAMPLE_RATE', 1.0)
+        if rate >= 1 or random.random() < rate:
+            timing.start()
+
+    def process_view(self, request, view_func, view_args, view_kwargs):
+        if timing.current() is not None:
+            request.timing_view = view_name(view_func, request)
+
+    def process_response(self, request, response):
+        if timing.current() is None:
+            return response
+
+        request_timing = timing.stop()
+        response['Server-Timing'] = request_timing.server_timing()
+        view = getattr(request, 'timing_view', None)
+        if view is not None:
+            timing.histograms.add(view, request_timing)
+        return response
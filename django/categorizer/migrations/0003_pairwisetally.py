@@ -0,0 +1,66 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 16:00
+from __future__ import unicode_literals
+
+import itertools
+import operator
+
+from django.db import migrations, models
+import django.db.models.deletion
+import numpy
+
+from categorizer.ranked_preference import ballot_tallies
+
+
+def count_tallies(apps, schema_editor):
+    # The same tallies as PairwiseTally.objects.rebuild, for every topic
+    Topic = apps.get_model('categorizer', 'Topic')
+    TopicOption = apps.get_model('categorizer', 'TopicOption')
+    OptionRanking = apps.get_model('categorizer', 'OptionRanking')
+    PairwiseTally = apps.get_model('categorizer', 'PairwiseTally')
+
+    for topic_id in Topic.objects.values_list('id', flat=True):
+        topicoption_ids = list(TopicOption.objects.filter(topic_id=topic_id)
+                               .order_by('id').values_list('id', flat=True))
+        votes = (OptionRanking.objects
+                 .filter(topicoption__topic_id=topic_id, user__isnull=False)
+                 .order_by('user', '-score', 'topicoption')
+                 .values_list('user_id', 'topicoption_id'))
+        ballots = ([topicoption_id for _, topicoption_id in ballot]
+                   for _, ballot in itertools.groupby(
+                       votes.iterator(), operator.itemgetter(0)))
+        _, ordered = ballot_tallies(topicoption_ids, ballots, processes=0)
+
+        PairwiseTally.objects.bulk_create([
+            PairwiseTally(topic_id=topic_id,
+                          topicoption_a_id=topicoption_ids[i],
+                          topicoption_b_id=topicoption_ids[j],
+                          wins_a=ordered[i, j], wins_b=ordered[j, i])
+            for i, j in zip(*numpy.nonzero(numpy.triu(ordered + ordered.T)))
+        ], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categorizer', '0002_auto_20170415_1207'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PairwiseTally',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('wins_a', models.IntegerField(default=0)),
+                ('wins_b', models.IntegerField(default=0)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='tallies', to='categorizer.Topic')),
+                ('topicoption_a', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='categorizer.TopicOption')),
+                ('topicoption_b', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='categorizer.TopicOption')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='pairwisetally',
+            unique_together=set([('topicoption_a', 'topicoption_b')]),
+        ),
+        migrations.RunPython(count_tallies, migrations.RunPython.noop),
+    ]
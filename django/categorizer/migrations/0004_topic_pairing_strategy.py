@@ -0,0 +1,20 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 16:05
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categorizer', '0003_pairwisetally'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='topic',
+            name='pairing_strategy',
+            field=models.CharField(choices=[(b'random', b'random'), (b'least-compared', b'least-compared'), (b'closest-elo', b'closest-elo'), (b'uncertainty', b'uncertainty')], default='random', max_length=32),
+        ),
+    ]
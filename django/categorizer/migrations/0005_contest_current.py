@@ -0,0 +1,40 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def mark_current_contests(apps, schema_editor):
+    # The most recent undecided contest for each user and topic is the one
+    # being shown, and any older undecided ones are queued behind it.
+    Contest = apps.get_model('categorizer', 'Contest')
+    latest = (Contest.objects.filter(winner__isnull=True)
+              .values('topic', 'user').annotate(latest=models.Max('id'))
+              .values_list('latest', flat=True))
+    Contest.objects.filter(id__in=list(latest)).update(current=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categorizer', '0004_topic_pairing_strategy'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contest',
+            name='current',
+            field=models.NullBooleanField(default=None),
+        ),
+        migrations.RunPython(mark_current_contests,
+                             migrations.RunPython.noop),
+        migrations.AlterField(
+            model_name='contest',
+            name='current',
+            field=models.NullBooleanField(default=True),
+        ),
+        migrations.AlterUniqueTogether(
+            name='contest',
+            unique_together=set([('topic', 'user', 'current')]),
+        ),
+    ]
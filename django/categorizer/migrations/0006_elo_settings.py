@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 16:10
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+
+
+def count_games(apps, schema_editor):
+    OptionRanking = apps.get_model('categorizer', 'OptionRanking')
+    games = (OptionRanking.objects.filter(contest__winner__isnull=False)
+             .values_list('id').annotate(models.Count('contest')).order_by())
+    for ranking_id, count in games:
+        OptionRanking.objects.filter(id=ranking_id).update(games=count)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categorizer', '0005_contest_current'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='optionranking',
+            name='games',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='elo_k_decay',
+            field=models.FloatField(default=0),
+        ),
+        migrations.AddField(
+            model_name='topic',
+            name='elo_k_factor',
+            field=models.FloatField(default=16),
+        ),
+        migrations.RunPython(count_games, migrations.RunPython.noop),
+    ]
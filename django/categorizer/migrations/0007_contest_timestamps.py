@@ -0,0 +1,39 @@
+# -*- coding: utf-8 -*-
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+def mark_decided(apps, schema_editor):
+    # The decision time of older contests isn't known, so use the migration
+    # time and let the id keep them in order
+    Contest = apps.get_model('categorizer', 'Contest')
+    Contest.objects.filter(winner__isnull=False).update(
+        decided_at=models.F('created_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categorizer', '0006_elo_settings'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contest',
+            name='created_at',
+            field=models.DateTimeField(auto_now_add=True, default=django.utils.timezone.now),
+            preserve_default=False,
+        ),
+        migrations.AddField(
+            model_name='contest',
+            name='decided_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(mark_decided, migrations.RunPython.noop),
+        migrations.AlterIndexTogether(
+            name='contest',
+            index_together=set([('topic', 'user', 'winner'), ('topic', 'decided_at')]),
+        ),
+    ]
@@ -0,0 +1,19 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 16:45
+from __future__ import unicode_literals
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categorizer', '0007_contest_timestamps'),
+    ]
+
+    operations = [
+        migrations.AlterIndexTogether(
+            name='optionranking',
+            index_together=set([('topicoption', 'score')]),
+        ),
+    ]
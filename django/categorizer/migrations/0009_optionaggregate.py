@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 16:48
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def count_aggregates(apps, schema_editor):
+    # The same counts as OptionAggregate.objects.rebuild, for every topic
+    TopicOption = apps.get_model('categorizer', 'TopicOption')
+    OptionRanking = apps.get_model('categorizer', 'OptionRanking')
+    Contest = apps.get_model('categorizer', 'Contest')
+    OptionAggregate = apps.get_model('categorizer', 'OptionAggregate')
+
+    means = dict(
+        (topicoption_id, (mean, votes)) for topicoption_id, mean, votes in
+        OptionRanking.objects.filter(user__isnull=False)
+        .order_by().values('topicoption')
+        .annotate(mean=models.Avg('score'), votes=models.Count('id'))
+        .values_list('topicoption', 'mean', 'votes'))
+    wins = dict(Contest.objects.filter(winner__isnull=False)
+                .order_by().values('winner__topicoption')
+                .annotate(wins=models.Count('id'))
+                .values_list('winner__topicoption', 'wins'))
+    contests = dict(Contest.contestants.through.objects
+                    .filter(contest__winner__isnull=False)
+                    .order_by().values('optionranking__topicoption')
+                    .annotate(contests=models.Count('id'))
+                    .values_list('optionranking__topicoption', 'contests'))
+
+    aggregates = []
+    for topicoption_id, topic_id in TopicOption.objects.values_list(
+            'id', 'topic_id'):
+        mean, votes = means.get(topicoption_id, (1000, 0))
+        won = wins.get(topicoption_id, 0)
+        aggregates.append(OptionAggregate(
+            topicoption_id=topicoption_id, topic_id=topic_id,
+            mean_score=mean, votes=votes, wins=won,
+            losses=contests.get(topicoption_id, 0) - won))
+    OptionAggregate.objects.bulk_create(aggregates, batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categorizer', '0008_optionranking_score_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='OptionAggregate',
+            fields=[
+                ('topicoption', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='aggregate', serialize=False, to='categorizer.TopicOption')),
+                ('mean_score', models.FloatField()),
+                ('votes', models.IntegerField(default=0)),
+                ('wins', models.IntegerField(default=0)),
+                ('losses', models.IntegerField(default=0)),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='aggregates', to='categorizer.Topic')),
+            ],
+        ),
+        migrations.AlterIndexTogether(
+            name='optionaggregate',
+            index_together=set([('topic', 'mean_score')]),
+        ),
+        migrations.RunPython(count_aggregates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# -*- coding: utf-8 -*-
+# Generated by Django 1.10 on 2026-10-18 17:07
+from __future__ import unicode_literals
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('categorizer', '0009_optionaggregate'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RankingJob',
+            fields=[
+                ('topic', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, primary_key=True, related_name='ranking_job', serialize=False, to='categorizer.Topic')),
+                ('requested_at', models.DateTimeField()),
+                ('claimed_at', models.DateTimeField(null=True)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='TopicRankingSnapshot',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('method', models.CharField(max_length=32)),
+                ('option_ids', models.TextField()),
+                ('created_at', models.DateTimeField()),
+                ('topic', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ranking_snapshots', to='categorizer.Topic')),
+            ],
+        ),
+        migrations.AlterUniqueTogether(
+            name='topicrankingsnapshot',
+            unique_together=set([('topic', 'method')]),
+        ),
+    ]
@@ -1,24 +1,133 @@
 from __future__ import unicode_literals
 
 import itertools
+import json
 import operator
+import random
+import uuid
+from collections import defaultdict
+from datetime import timedelta
 
-from django.db import models
+from django.db import (connection, connections, models, transaction,
+                       IntegrityError)
+from django.db.models import Avg, Case, Count, F, When
 from django.contrib.auth.models import User
+from django.utils import timezone
 
-from .ranked_preference import pairwise_rankings
+import numpy
+
+from . import elo, matchups, timing
+from .ranking_cache import invalidate_rankings
+from .ranked_preference import (MATRIX_METHODS, BallotStore, ballot_tallies,
+                                fast_full_ranked_preference, score_rankings,
+                                tally_matrix, top_rankings)
+
+
+def stream_rows(queryset, chunk_size=2000):
+    """ Generates the rows of a values_list queryset a chunk at a time. On
+    PostgreSQL this uses a named server-side cursor, so the full result is
+    never held in memory; those only exist inside a transaction.
+    """
+    db = connections[queryset.db]
+    if db.vendor != 'postgresql':
+        for row in queryset.iterator():
+            yield row
+        return
+
+    sql, params = queryset.query.get_compiler(queryset.db).as_sql()
+    with transaction.atomic(using=queryset.db):
+        db.ensure_connection()
+        cursor = db.connection.cursor(
+            name='stream_{}'.format(uuid.uuid4().hex))
+        cursor.itersize = chunk_size
+        try:
+            cursor.execute(sql, params)
+            while True:
+                rows = cursor.fetchmany(chunk_size)
+                if not rows:
+                    break
+                for row in rows:
+                    yield row
+        finally:
+            cursor.close()
+
+
+def chunked(values, size=500):
+    """ Splits values into lists short enough to use in an IN clause
+    """
+    values = list(values)
+    for start in range(0, len(values), size):
+        yield values[start:start + size]
+
+
+class OptionManager(models.Manager):
+    def ensure_labels(self, labels):
+        """ Gets or creates an option for each label in bulk, returning a
+        dict of their ids
+        """
+        labels = set(labels)
+        existing = {}
+        for chunk in chunked(labels):
+            existing.update(self.filter(label__in=chunk)
+                            .values_list('label', 'id'))
+        missing = [label for label in labels if label not in existing]
+        if not missing:
+            return existing
+
+        try:
+            with transaction.atomic():
+                self.bulk_create([Option(label=label) for label in missing],
+                                 batch_size=500)
+        except IntegrityError:
+            # Another request created some of them first
+            for label in missing:
+                self.get_or_create(label=label)
+        for chunk in chunked(missing):
+            existing.update(self.filter(label__in=chunk)
+                            .values_list('label', 'id'))
+        return existing
 
 
 class Option(models.Model):
     label = models.CharField(max_length=128, unique=True)
 
+    objects = OptionManager()
+
+    @classmethod
+    def in_order(cls, ids):
+        """ Fetches the options with the given ids, keeping their order.
+        Ids of options that have since been deleted are skipped.
+        """
+        results = cls.objects.in_bulk(ids)
+        return [results[id] for id in ids if id in results]
+
 
 class Topic(models.Model):
     label = models.CharField(max_length=128, unique=True)
     options = models.ManyToManyField(Option, related_name='topics',
                                      through='TopicOption')
+    pairing_strategy = models.CharField(
+        max_length=32, default='random',
+        choices=[(name, name) for name in matchups.STRATEGIES])
+    elo_k_factor = models.FloatField(default=16)
+    # Number of games after which an option's K-factor is halved, or 0 to
+    # keep it constant
+    elo_k_decay = models.FloatField(default=0)
 
-    def calculate_top_options(self, count):
+    RANKING_METHODS = ('copeland', 'irv', 'condorcet', 'schulze',
+                       'ranked-pairs', 'elo-mean')
+
+    def calculate_top_options(self, count, method='copeland'):
+        with timing.span('ranking'):
+            top_ids = list(itertools.islice(
+                self.ranked_option_ids(method, limit=count), count))
+        return Option.in_order(top_ids)
+
+    def ranked_option_ids(self, method='copeland', limit=None):
+        """ Generates the id of every option in the topic, best first, using
+        one of RANKING_METHODS. With a limit, only the tie groups covering
+        that many of the best options are ranked.
+        """
         def flatten_rankings(rankings):
             for rank in rankings:
                 if isinstance(rank, set):
@@ -27,22 +136,125 @@ class Topic(models.Model):
                 else:
                     yield rank
 
-        all_votes = (self.options.order_by('topicoption__rankings__user',
-                                           '-topicoption__rankings__score')
-                     .values_list('topicoption__rankings__user__id', 'id'))
-        all_candidates = self.options.values_list('id', flat=True)
+        assert(method in self.RANKING_METHODS)
+        if method == 'elo-mean':
+            # Ranked by the database, so the topic's options aren't loaded
+            return flatten_rankings(self.mean_rankings(limit))
+
+        topicoptions = list(self.topicoption.order_by('id')
+                            .values_list('id', 'option_id'))
+        topicoption_ids = [topicoption_id for topicoption_id, _ in topicoptions]
+        option_ids = [option_id for _, option_id in topicoptions]
 
-        user_votes = (map(operator.itemgetter(1), votes) for _, votes in
-                      itertools.groupby(all_votes, lambda x: x[0]))
+        if method == 'irv':
+            option_for = dict(topicoptions)
+            # Each place is a separate election, so stop once enough
+            # options have been placed
+            sorted_ids = (
+                set(option_for[v] for v in rank) if isinstance(rank, set)
+                else option_for[rank]
+                for rank in top_rankings(fast_full_ranked_preference(
+                    topicoption_ids, self.ballots(topicoption_ids)), limit))
+        else:
+            matrix = PairwiseTally.objects.matrix(self, topicoption_ids)
+            sorted_ids = MATRIX_METHODS[method](option_ids, matrix, limit)
+        return flatten_rankings(sorted_ids)
 
-        sorted_ids = pairwise_rankings(all_candidates, user_votes)
-        flatted_ids = flatten_rankings(sorted_ids)
-        top_ids = list(itertools.islice(flatted_ids, count))
+    def mean_rankings(self, limit=None):
+        """ Ranks option ids by the average of every user's score, read from
+        the options' aggregates. Options nobody has ranked have the default
+        score. With a limit, the database only returns the best means, down
+        to the end of the tie group the limit falls in.
+        """
+        aggregates = (self.aggregates.order_by('-mean_score', 'topicoption')
+                      .values_list('topicoption__option', 'mean_score'))
+        if limit is None:
+            means = list(aggregates)
+        elif limit <= 0:
+            means = []
+        else:
+            means = list(aggregates[:limit])
+            if len(means) == limit:
+                # Options tied with the last one may have been cut off
+                last = means[-1][1]
+                means = ([(option_id, mean) for option_id, mean in means
+                          if mean != last] +
+                         list(aggregates.filter(mean_score=last)))
+        return score_rankings([option_id for option_id, _ in means],
+                              [mean for _, mean in means], limit)
 
-        top_results = {obj.id: obj for obj in
-                       Option.objects.filter(id__in=top_ids)}
+    def ballots(self, topicoption_ids=None):
+        """ Loads each user's TopicOption ids, in order of preference, into a
+        BallotStore. The votes are streamed from a single ordered query.
+        """
+        if topicoption_ids is None:
+            topicoption_ids = (self.topicoption.order_by('id')
+                               .values_list('id', flat=True))
+        store = BallotStore(topicoption_ids)
 
-        return [top_results[id] for id in top_ids]
+        all_votes = (OptionRanking.objects
+                     .filter(topicoption__topic=self, user__isnull=False)
+                     .order_by('user', '-score', 'topicoption')
+                     .values_list('user_id', 'topicoption_id'))
+        for _, votes in itertools.groupby(stream_rows(all_votes),
+                                          operator.itemgetter(0)):
+            store.add(topicoption_id for _, topicoption_id in votes)
+        return store
+
+
+class TopicOptionManager(models.Manager):
+    def add_options(self, topic, option_ids):
+        """ Adds each option to the topic unless it is already there, in
+        bulk. Returns how many were added.
+        """
+        added = 0
+        with transaction.atomic():
+            for chunk in chunked(set(option_ids)):
+                added += self._add_options(topic, chunk)
+        if added:
+            matchups.invalidate_candidates(topic.id)
+            invalidate_rankings(topic.id)
+            TopicRankingSnapshot.objects.discard(topic.id)
+        return added
+
+    def _add_options(self, topic, option_ids):
+        existing = set(self.filter(topic=topic, option_id__in=option_ids)
+                       .values_list('option_id', flat=True))
+        missing = sorted(set(option_ids) - existing)
+        if not missing:
+            return 0
+
+        try:
+            with transaction.atomic():
+                self.bulk_create([TopicOption(topic=topic, option_id=option_id)
+                                  for option_id in missing])
+            added = len(missing)
+        except IntegrityError:
+            # Another request added some of them first
+            added = sum(self.get_or_create(topic=topic,
+                                           option_id=option_id)[1]
+                        for option_id in missing)
+
+        # bulk_create skips the save signals, which create the aggregates
+        OptionAggregate.objects.ensure(
+            topic.id, list(self.filter(topic=topic, option_id__in=missing)
+                           .values_list('id', flat=True)))
+        return added
+
+    def remove_options(self, topic, option_ids):
+        """ Removes the options from the topic, along with every ranking of
+        them and the contests those were in. Returns how many options were
+        removed.
+        """
+        from categorizer.deletion import delete_topic_options
+
+        removed = 0
+        with transaction.atomic():
+            for chunk in chunked(set(option_ids)):
+                _, counts = delete_topic_options(
+                    self.filter(topic=topic, option_id__in=chunk))
+                removed += counts.get(self.model._meta.label, 0)
+        return removed
 
 
 class TopicOption(models.Model):
@@ -51,16 +263,56 @@ class TopicOption(models.Model):
     topic = models.ForeignKey(Topic, on_delete=models.CASCADE,
                               related_name='topicoption')
 
+    objects = TopicOptionManager()
+
     class Meta:
         unique_together = (("option", "topic"),)
 
 
+class OptionRankingManager(models.Manager):
+    def ensure(self, topic_id, user_id, topicoption_ids):
+        """ Gets or creates the user's rankings for each TopicOption in bulk,
+        returning a dict of their ids
+        """
+        existing = dict(self.filter(topicoption_id__in=topicoption_ids,
+                                    user_id=user_id)
+                        .values_list('topicoption_id', 'id'))
+        missing = [topicoption_id for topicoption_id in topicoption_ids
+                   if topicoption_id not in existing]
+        if not missing:
+            return existing
+
+        self.bulk_create([OptionRanking(topicoption_id=topicoption_id,
+                                        user_id=user_id)
+                          for topicoption_id in missing])
+        existing.update(self.filter(topicoption_id__in=missing,
+                                    user_id=user_id)
+                        .values_list('topicoption_id', 'id'))
+
+        # bulk_create skips the save signals, so update the ballots here
+        default_score = self.model._meta.get_field('score').default
+        PairwiseTally.objects.record_ballot(
+            topic_id, user_id,
+            {topicoption_id: (None, default_score)
+             for topicoption_id in missing})
+        if user_id is not None:
+            OptionAggregate.objects.record(
+                [(topicoption_id, None, default_score)
+                 for topicoption_id in missing])
+        RankingJob.objects.mark_dirty(topic_id)
+        invalidate_rankings(topic_id)
+        return existing
+
+
 class OptionRanking(models.Model):
     topicoption = models.ForeignKey(TopicOption, on_delete=models.CASCADE,
                                     related_name='rankings')
     user = models.ForeignKey(User, blank=True, null=True,
                              on_delete=models.SET_NULL)
     score = models.FloatField(default=1000)
+    games = models.IntegerField(default=0)
+
+    objects = OptionRankingManager()
 
     class Meta:
         unique_together = (("topicoption", "user"),)
@@ -74,43 +326,696 @@ class Contest(models.Model):
     contestants = models.ManyToManyField(OptionRanking)
     winner = models.ForeignKey(OptionRanking, on_delete=models.CASCADE,
                                null=True, related_name='wins')
+    # True for the contest currently shown to the user, and None for queued
+    # or decided contests. A user can only have one current contest per
+    # topic, which the unique constraint enforces even across requests.
+    current = models.NullBooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    decided_at = models.DateTimeField(null=True, blank=True)
 
-    def set_winner(self, winner):
-        def elo_expected_score(contestant, opponent):
-            score_range = opponent.score - contestant.score
-            return 1.0 / (1 + pow(10, score_range / 400))
+    class Meta:
+        unique_together = (("topic", "user", "current"),)
+        index_together = (("topic", "user", "winner"),
+                          ("topic", "decided_at"))
 
-        assert(self.winner is None)
-        assert(winner in self.contestants.all())
+    def save(self, *args, **kwargs):
+        if self.winner_id is not None:
+            self.current = None
+            if self.decided_at is None:
+                self.decided_at = timezone.now()
+        super(Contest, self).save(*args, **kwargs)
 
-        results = [(contestant,
-                    contestant == winner,
-                    elo_expected_score(contestant, opponent))
-                   for contestant, opponent in
-                   itertools.permutations(self.contestants.all(), 2)]
+    def set_winner(self, winner):
+        """ Records the winner and adjusts the contestants' Elo scores.
+        Returns a dict of the score change applied to each OptionRanking id.
+        """
+        assert(self.winner_id is None)
+
+        with transaction.atomic():
+            # Claiming the contest first also takes the write lock, so
+            # concurrent votes on the same contest can't both be applied
+            decided_at = timezone.now()
+            claimed = (Contest.objects
+                       .filter(pk=self.pk, winner__isnull=True)
+                       .update(winner=winner, current=None,
+                               decided_at=decided_at))
+            assert(claimed == 1)
 
-        for contestant, is_winner, expected_score in results:
-            score = 1 if is_winner else 0
-            adjustment = 16 * (score - expected_score)
+            if self.current:
+                Contest.promote_queued(self.topic_id, self.user_id)
 
-            contestant.score = models.F('score') + adjustment
-            contestant.save()
+            contestants = Contest.contestant_scores([self.id])
+            assert(winner.id in [c[1] for c in contestants])
+            deltas = Contest.apply_results(self.topic, contestants,
+                                           [(self.id, winner.id)])
+            RankingJob.objects.mark_dirty(self.topic_id)
 
         self.winner = winner
-        self.save()
+        self.current = None
+        self.decided_at = decided_at
+        invalidate_rankings(self.topic_id)
+        return deltas
 
     @classmethod
-    def create_random(cls, topic, user):
-        import random
-        all_ids = (TopicOption.objects.filter(topic=topic)
-                   .values_list('id', flat=True))
-
-        assert(all_ids.count() >= 2)
-        contest = Contest.objects.create(topic=topic, user=user)
-        for topicoption_id in random.sample(all_ids, 2):
-            ranking = (OptionRanking.objects
-                       .get_or_create(topicoption_id=topicoption_id,
-                                      user=user)[0])
-            contest.contestants.add(ranking)
+    def set_winners(cls, topic, user, votes):
+        """ Decides several of the user's contests at once. votes is a list
+        of (contest id, winning Option id) pairs, applied in order. Returns a
+        list with None for each vote that was applied, or the reason it was
+        rejected.
+        """
+        contest_ids = set(contest_id for contest_id, _ in votes)
+        errors = [None] * len(votes)
+        with transaction.atomic():
+            # Lock the undecided contests before reading their contestants
+            open_contests = dict(
+                cls.objects.select_for_update()
+                .filter(id__in=contest_ids, topic=topic, user=user,
+                        winner__isnull=True)
+                .values_list('id', 'current'))
+            contestants = cls.contestant_scores(open_contests.keys())
+            rankings = {(contest_id, option_id): ranking_id
+                        for contest_id, ranking_id, _, option_id, _, _, _
+                        in contestants}
+
+            results = []
+            decided = set()
+            for i, (contest_id, option_id) in enumerate(votes):
+                if contest_id in decided:
+                    errors[i] = 'Contest already decided'
+                elif contest_id not in open_contests:
+                    errors[i] = 'Unknown contest'
+                elif (contest_id, option_id) not in rankings:
+                    errors[i] = 'Unknown winner'
+                else:
+                    decided.add(contest_id)
+                    results.append((contest_id,
+                                    rankings[(contest_id, option_id)]))
+            if not results:
+                return errors
+
+            # Each result is stamped a microsecond after the one before, so
+            # replaying contests in decided_at order matches the order the
+            # Elo adjustments were applied in
+            now = timezone.now()
+            cls.objects.filter(id__in=decided).update(
+                current=None,
+                decided_at=Case(*[
+                    When(id=contest_id,
+                         then=models.Value(now + timedelta(microseconds=i)))
+                    for i, (contest_id, _) in enumerate(results)],
+                    output_field=models.DateTimeField()),
+                winner=Case(*[When(id=contest_id, then=ranking_id)
+                              for contest_id, ranking_id in results],
+                            output_field=models.IntegerField()))
+            if any(open_contests[contest_id] for contest_id in decided):
+                cls.promote_queued(topic.id, user.id)
+
+            cls.apply_results(topic, contestants, results)
+            RankingJob.objects.mark_dirty(topic.id)
+
+        invalidate_rankings(topic.id)
+        return errors
+
+    @classmethod
+    def promote_queued(cls, topic_id, user_id):
+        """ Makes the user's next queued contest the current one
+        """
+        next_contest = (cls.queued(topic_id, user_id)
+                        .values_list('id', flat=True)[:1])
+        cls.objects.filter(id__in=next_contest).update(current=True)
+
+    @staticmethod
+    def contestant_scores(contest_ids):
+        """ Reads and locks the contestants of several contests, as rows of
+        (contest id, OptionRanking id, TopicOption id, Option id, user id,
+        score, games)
+        """
+        return list(OptionRanking.objects.select_for_update()
+                    .filter(contest__in=contest_ids)
+                    .order_by('contest', 'id')
+                    .values_list('contest', 'id', 'topicoption_id',
+                                 'topicoption__option_id', 'user_id',
+                                 'score', 'games'))
+
+    @staticmethod
+    def apply_results(topic, contestants, results):
+        """ Replays the Elo adjustments for each (contest id, winning
+        OptionRanking id) in order, then writes every changed score in a
+        single statement. Returns the total change for each OptionRanking.
+        """
+        index = {}
+        by_contest = defaultdict(list)
+        for row in contestants:
+            contest_id, id = row[:2]
+            index.setdefault(id, (len(index), row))
+            by_contest[contest_id].append(id)
+
+        rows = [row for _, row in sorted(index.values())]
+        scores = numpy.array([row[5] for row in rows], dtype=numpy.float64)
+        games = numpy.array([row[6] for row in rows], dtype=numpy.float64)
+        initial_scores = scores.copy()
+        initial_games = games.copy()
+
+        contests = []
+        for contest_id, winner_id in results:
+            ids = by_contest[contest_id]
+            contests.append(([index[id][0] for id in ids],
+                             elo.winner_results(len(ids),
+                                                ids.index(winner_id))))
+        elo.replay(scores, games, contests, topic.elo_k_factor,
+                   topic.elo_k_decay)
+
+        changed = numpy.flatnonzero(games != initial_games)
+        deltas = {rows[i][1]: float(scores[i] - initial_scores[i])
+                  for i in changed}
+        if deltas:
+            OptionRanking.objects.filter(id__in=deltas.keys()).update(
+                score=Case(*[When(id=id, then=F('score') + delta)
+                             for id, delta in deltas.items()],
+                           output_field=models.FloatField()),
+                games=Case(*[When(id=rows[i][1],
+                                  then=F('games') +
+                                  int(games[i] - initial_games[i]))
+                             for i in changed],
+                           output_field=models.IntegerField()))
+
+        ballots = defaultdict(dict)
+        compared = defaultdict(dict)
+        for i in changed:
+            topicoption_id, user_id = rows[i][2], rows[i][4]
+            ballots[user_id][topicoption_id] = (float(initial_scores[i]),
+                                                float(scores[i]))
+            compared[user_id][topicoption_id] = int(games[i] -
+                                                    initial_games[i])
+        winners = [index[winner_id][1][2] for _, winner_id in results]
+        losers = [index[id][1][2] for contest_id, winner_id in results
+                  for id in by_contest[contest_id] if id != winner_id]
+        OptionAggregate.objects.record(
+            [(topicoption_id, previous, new)
+             for user_id, changed_scores in ballots.items()
+             if user_id is not None
+             for topicoption_id, (previous, new) in changed_scores.items()],
+            winners, losers)
+        for user_id, changed_scores in ballots.items():
+            PairwiseTally.objects.record_ballot(topic.id, user_id,
+                                                changed_scores)
+            matchups.record_contest(
+                topic.id, user_id,
+                {topicoption_id: new for topicoption_id, (_, new)
+                 in changed_scores.items()},
+                compared[user_id])
+        return deltas
 
+    @classmethod
+    def create_random(cls, topic, user, rng=random):
+        topicoption_ids = matchups.choose_pair(topic, user, rng)
+
+        # Like fill_queue, the rankings and contestants are created in bulk
+        with transaction.atomic():
+            rankings = OptionRanking.objects.ensure(topic.id, user.id,
+                                                    topicoption_ids)
+            contest = Contest.objects.create(topic=topic, user=user)
+            through = Contest.contestants.through
+            through.objects.bulk_create([
+                through(contest_id=contest.id,
+                        optionranking_id=rankings[topicoption_id])
+                for topicoption_id in topicoption_ids])
         return contest
+
+    @classmethod
+    def queued(cls, topic_id, user_id):
+        return cls.objects.filter(topic_id=topic_id, user_id=user_id,
+                                  winner__isnull=True,
+                                  current__isnull=True).order_by('id')
+
+    @classmethod
+    def current_for(cls, topic, user):
+        """ Returns the user's current contest in the topic, moving up the
+        next queued contest or creating a new one if there isn't one
+        """
+        try:
+            return topic.contests.get(user=user, current=True)
+        except Contest.DoesNotExist:
+            pass
+
+        try:
+            with transaction.atomic():
+                next_contest = (cls.queued(topic.id, user.id)
+                                .values_list('id', flat=True)[:1])
+                promoted = cls.objects.filter(id__in=next_contest).update(
+                    current=True)
+                if not promoted:
+                    return cls.create_random(topic, user)
+        except IntegrityError:
+            # Another request already made a contest current
+            pass
+        return topic.contests.get(user=user, current=True)
+
+    @classmethod
+    def fill_queue(cls, topic, user, size, rng=random):
+        """ Tops up the user's queue of pending contests to the given size,
+        creating the contests in bulk. Returns how many were created. rng
+        picks the pairs, and can be seeded for repeatable queues.
+        """
+        needed = size - cls.queued(topic.id, user.id).count()
+        if needed <= 0:
+            return 0
+        pairs = matchups.choose_pairs(topic, user, needed, rng)
+
+        with transaction.atomic():
+            topicoption_ids = set(itertools.chain.from_iterable(pairs))
+            rankings = OptionRanking.objects.ensure(topic.id, user.id,
+                                                    topicoption_ids)
+
+            contests = [Contest(topic=topic, user=user, current=None)
+                        for _ in pairs]
+            if connection.features.can_return_ids_from_bulk_insert:
+                contests = Contest.objects.bulk_create(contests)
+            else:
+                for contest in contests:
+                    contest.save()
+
+            through = Contest.contestants.through
+            through.objects.bulk_create([
+                through(contest_id=contest.id,
+                        optionranking_id=rankings[topicoption_id])
+                for contest, pair in zip(contests, pairs)
+                for topicoption_id in pair
+            ])
+        return len(contests)
+
+
+def ballot_key(topicoption_id, score):
+    """ Sort key placing a user's preferred options first. Ties in score are
+    broken by id so that every ballot has a single, stable ordering.
+    """
+    return (-score, topicoption_id)
+
+
+class PairwiseTallyManager(models.Manager):
+    def matrix(self, topic, topicoption_ids):
+        """ Builds the pairwise preference matrix for the given TopicOption
+        ids from the stored tallies
+        """
+        index = {v: i for i, v in enumerate(topicoption_ids)}
+        size = len(topicoption_ids)
+
+        ranked = numpy.zeros(size, dtype=numpy.int64)
+        counts = (OptionRanking.objects
+                  .filter(topicoption__topic=topic, user__isnull=False)
+                  .values_list('topicoption_id')
+                  .annotate(Count('id')).order_by())
+        for topicoption_id, count in counts:
+            if topicoption_id in index:
+                ranked[index[topicoption_id]] = count
+
+        ordered = numpy.zeros((size, size), dtype=numpy.int64)
+        tallies = self.filter(topic=topic).values_list(
+            'topicoption_a_id', 'topicoption_b_id', 'wins_a', 'wins_b')
+        for a, b, wins_a, wins_b in tallies:
+            if a in index and b in index:
+                ordered[index[a], index[b]] = wins_a
+                ordered[index[b], index[a]] = wins_b
+
+        return tally_matrix(ranked, ordered)
+
+    def record_ballot(self, topic_id, user_id, changed):
+        """ Updates the tallies after some of a user's rankings changed.
+        changed maps TopicOption ids to (old score, new score), where None
+        means the option was not ranked by the user.
+        """
+        if user_id is None or not changed:
+            return
+
+        others = OptionRanking.objects.filter(
+            topicoption__topic_id=topic_id, user_id=user_id).exclude(
+            topicoption_id__in=changed.keys())
+        if all(old is not None and new is not None
+               for old, new in changed.values()):
+            # Pure score changes can only reorder the options whose score
+            # lies between the old and new scores
+            low = min(min(scores) for scores in changed.values())
+            high = max(max(scores) for scores in changed.values())
+            others = others.filter(score__gte=low, score__lte=high)
+        others = dict(others.values_list('topicoption_id', 'score'))
+
+        ballots = []
+        for side in (0, 1):
+            ballot = dict(others)
+            ballot.update((topicoption_id, scores[side])
+                          for topicoption_id, scores in changed.items()
+                          if scores[side] is not None)
+            ballots.append(ballot)
+
+        changes = defaultdict(lambda: [0, 0])
+        for x in changed:
+            for y in set(ballots[0]) | set(ballots[1]):
+                if y == x or (y in changed and y < x):
+                    continue
+                a, b = min(x, y), max(x, y)
+                for ballot, sign in zip(ballots, (-1, 1)):
+                    if a in ballot and b in ballot:
+                        a_wins = (ballot_key(a, ballot[a]) <
+                                  ballot_key(b, ballot[b]))
+                        changes[(a, b)][0 if a_wins else 1] += sign
+
+        self.apply_changes(topic_id, changes)
+
+    def apply_changes(self, topic_id, changes):
+        """ Adds the given (wins_a, wins_b) deltas to each (a, b) pair
+        """
+        changes = {pair: tuple(delta) for pair, delta in changes.items()
+                   if any(delta)}
+        if not changes:
+            return
+
+        with transaction.atomic(savepoint=False):
+            first_ids = set(a for a, _ in changes)
+            second_ids = set(b for _, b in changes)
+            existing = set(self.filter(topicoption_a_id__in=first_ids,
+                                       topicoption_b_id__in=second_ids)
+                           .values_list('topicoption_a_id',
+                                        'topicoption_b_id'))
+            missing = [PairwiseTally(topic_id=topic_id,
+                                     topicoption_a_id=a, topicoption_b_id=b,
+                                     wins_a=delta[0], wins_b=delta[1])
+                       for (a, b), delta in changes.items()
+                       if (a, b) not in existing]
+            try:
+                if missing:
+                    with transaction.atomic():
+                        self.bulk_create(missing)
+            except IntegrityError:
+                # Another writer created some of these pairs first
+                for tally in missing:
+                    pair = (tally.topicoption_a_id, tally.topicoption_b_id)
+                    created = self.get_or_create(
+                        topicoption_a_id=pair[0], topicoption_b_id=pair[1],
+                        defaults={'topic_id': topic_id,
+                                  'wins_a': tally.wins_a,
+                                  'wins_b': tally.wins_b})[1]
+                    if not created:
+                        existing.add(pair)
+
+            grouped = defaultdict(list)
+            for (a, b), delta in changes.items():
+                if (a, b) in existing:
+                    grouped[(delta, a)].append(b)
+            for ((wins_a, wins_b), a), second_ids in grouped.items():
+                self.filter(topicoption_a_id=a,
+                            topicoption_b_id__in=second_ids).update(
+                    wins_a=F('wins_a') + wins_a,
+                    wins_b=F('wins_b') + wins_b)
+
+    def rebuild(self, topic):
+        """ Replaces the tallies for a topic with ones counted from scratch
+        """
+        topicoption_ids = list(topic.topicoption.order_by('id')
+                               .values_list('id', flat=True))
+        _, ordered = ballot_tallies(topicoption_ids,
+                                    topic.ballots(topicoption_ids))
+
+        tallies = []
+        for i, j in zip(*numpy.nonzero(numpy.triu(ordered + ordered.T))):
+            tallies.append(PairwiseTally(
+                topic=topic,
+                topicoption_a_id=topicoption_ids[i],
+                topicoption_b_id=topicoption_ids[j],
+                wins_a=ordered[i, j], wins_b=ordered[j, i]))
+
+        with transaction.atomic():
+            self.filter(topic=topic).delete()
+            self.bulk_create(tallies, batch_size=500)
+        return len(tallies)
+
+
+class PairwiseTally(models.Model):
+    """ Counts the ballots that rank both options, split by which of the two
+    was preferred. Each pair is stored once, with the lower id as option a.
+    """
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE,
+                              related_name='tallies')
+    topicoption_a = models.ForeignKey(TopicOption, on_delete=models.CASCADE,
+                                      related_name='+')
+    topicoption_b = models.ForeignKey(TopicOption, on_delete=models.CASCADE,
+                                      related_name='+')
+    wins_a = models.IntegerField(default=0)
+    wins_b = models.IntegerField(default=0)
+
+    objects = PairwiseTallyManager()
+
+    class Meta:
+        unique_together = (("topicoption_a", "topicoption_b"),)
+
+
+class OptionAggregateManager(models.Manager):
+    def ensure(self, topic_id, topicoption_ids):
+        """ Creates empty aggregates for TopicOptions that don't have one,
+        such as ones added with bulk_create
+        """
+        existing = set(self.filter(topicoption_id__in=topicoption_ids)
+                       .values_list('topicoption_id', flat=True))
+        default_score = OptionRanking._meta.get_field('score').default
+        self.bulk_create([OptionAggregate(topicoption_id=topicoption_id,
+                                          topic_id=topic_id,
+                                          mean_score=default_score)
+                          for topicoption_id in topicoption_ids
+                          if topicoption_id not in existing],
+                         batch_size=500)
+
+    def record(self, scores=(), wins=(), losses=()):
+        """ Updates the aggregates after users' scores changed or contests
+        were decided. scores lists (TopicOption id, previous score, new
+        score) for each changed ranking, with None for a ranking that was
+        added or removed. wins and losses hold a TopicOption id for every
+        contest it won or lost.
+        """
+        changes = defaultdict(lambda: [0.0, 0, 0, 0])
+        for topicoption_id, previous, new in scores:
+            change = changes[topicoption_id]
+            if previous is not None:
+                change[0] -= previous
+                change[1] -= 1
+            if new is not None:
+                change[0] += new
+                change[1] += 1
+        for topicoption_id in wins:
+            changes[topicoption_id][2] += 1
+        for topicoption_id in losses:
+            changes[topicoption_id][3] += 1
+        self.apply_changes(changes)
+
+    def remove_contests(self, contests):
+        """ Takes the results of a queryset of contests, which are about to
+        be deleted, out of the wins and losses
+        """
+        changes = defaultdict(lambda: [0.0, 0, 0, 0])
+        for ranking_id, topicoption_id, winner_id in (
+                Contest.contestants.through.objects
+                .filter(contest__in=contests.filter(winner__isnull=False))
+                .values_list('optionranking_id',
+                             'optionranking__topicoption_id',
+                             'contest__winner_id')):
+            changes[topicoption_id][2 if ranking_id == winner_id else 3] -= 1
+        self.apply_changes(changes)
+
+    def apply_changes(self, changes):
+        """ Adds (total score, votes, wins, losses) deltas to the aggregate
+        of each TopicOption id, in a single statement
+        """
+        changes = {topicoption_id: tuple(change)
+                   for topicoption_id, change in changes.items()
+                   if any(change)}
+        if not changes:
+            return
+
+        def added(field, i):
+            return Case(*[When(topicoption_id=topicoption_id,
+                               then=F(field) + change[i])
+                          for topicoption_id, change in changes.items()
+                          if change[i]],
+                        default=F(field), output_field=models.IntegerField())
+
+        # The new mean is computed from the stored one, so that only the
+        # options that changed are read
+        default_score = OptionRanking._meta.get_field('score').default
+        means = []
+        for topicoption_id, (total, votes, _, _) in changes.items():
+            if total or votes:
+                means.append(When(topicoption_id=topicoption_id,
+                                  votes=-votes, then=default_score))
+                means.append(When(topicoption_id=topicoption_id,
+                                  then=(F('mean_score') * F('votes') + total)
+                                  / (F('votes') + votes)))
+
+        self.filter(topicoption_id__in=changes.keys()).update(
+            mean_score=Case(*means, default=F('mean_score'),
+                            output_field=models.FloatField()),
+            votes=added('votes', 1), wins=added('wins', 2),
+            losses=added('losses', 3))
+
+    def rebuild(self, topic):
+        """ Replaces the aggregates for a topic with ones counted from the
+        option rankings and decided contests
+        """
+        means = dict(
+            (topicoption_id, (mean, votes)) for topicoption_id, mean, votes in
+            OptionRanking.objects
+            .filter(topicoption__topic=topic, user__isnull=False)
+            .order_by().values('topicoption')
+            .annotate(mean=Avg('score'), votes=Count('id'))
+            .values_list('topicoption', 'mean', 'votes'))
+        wins = dict(Contest.objects
+                    .filter(topic=topic, winner__isnull=False)
+                    .order_by().values('winner__topicoption')
+                    .annotate(wins=Count('id'))
+                    .values_list('winner__topicoption', 'wins'))
+        contests = dict(Contest.contestants.through.objects
+                        .filter(contest__topic=topic,
+                                contest__winner__isnull=False)
+                        .order_by().values('optionranking__topicoption')
+                        .annotate(contests=Count('id'))
+                        .values_list('optionranking__topicoption',
+                                     'contests'))
+
+        default_score = OptionRanking._meta.get_field('score').default
+        aggregates = []
+        for topicoption_id in topic.topicoption.values_list('id', flat=True):
+            mean, votes = means.get(topicoption_id, (default_score, 0))
+            won = wins.get(topicoption_id, 0)
+            aggregates.append(OptionAggregate(
+                topicoption_id=topicoption_id, topic=topic, mean_score=mean,
+                votes=votes, wins=won,
+                losses=contests.get(topicoption_id, 0) - won))
+
+        with transaction.atomic():
+            self.filter(topic=topic).delete()
+            self.bulk_create(aggregates, batch_size=500)
+        return len(aggregates)
+
+
+class OptionAggregate(models.Model):
+    """ Every user's rankings of a TopicOption combined: the mean of their
+    scores, how many users ranked it, and how many contests it has won and
+    lost. Kept up to date as contests are decided, so the topic's
+    leaderboard can be read straight from the index.
+    """
+    topicoption = models.OneToOneField(TopicOption, on_delete=models.CASCADE,
+                                       primary_key=True,
+                                       related_name='aggregate')
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE,
+                              related_name='aggregates')
+    mean_score = models.FloatField()
+    votes = models.IntegerField(default=0)
+    wins = models.IntegerField(default=0)
+    losses = models.IntegerField(default=0)
+
+    objects = OptionAggregateManager()
+
+    class Meta:
+        index_together = (("topic", "mean_score"),)
+
+
+class RankingJobManager(models.Manager):
+    def mark_dirty(self, topic_id):
+        """ Queues the topic's rankings to be recomputed. A topic is only
+        queued once, however often it changes before a worker gets to it.
+        Inside a transaction, the topic is queued once it commits, so that
+        concurrent votes don't wait on the lock of the topic's job.
+        """
+        transaction.on_commit(lambda: self._queue(topic_id))
+
+    def _queue(self, topic_id):
+        now = timezone.now()
+        if self.filter(topic_id=topic_id).update(requested_at=now):
+            return
+        try:
+            with transaction.atomic():
+                self.create(topic_id=topic_id, requested_at=now)
+        except IntegrityError:
+            # Queued by a concurrent request
+            self.filter(topic_id=topic_id).update(requested_at=now)
+
+    def claim(self, limit, timeout):
+        """ Claims up to limit of the longest waiting jobs, including ones
+        whose worker claimed them more than timeout seconds ago without
+        finishing. Returns (topic id, requested at) for each job claimed.
+        """
+        now = timezone.now()
+        expired = now - timedelta(seconds=timeout)
+        waiting = (self.filter(models.Q(claimed_at__isnull=True) |
+                               models.Q(claimed_at__lt=expired))
+                   .order_by('requested_at')
+                   .values_list('topic_id', 'requested_at', 'claimed_at')
+                   [:limit])
+
+        claimed = []
+        for topic_id, requested_at, claimed_at in waiting:
+            # Another worker may have claimed it since it was read
+            if self.filter(topic_id=topic_id,
+                           claimed_at=claimed_at).update(claimed_at=now):
+                claimed.append((topic_id, requested_at))
+        return claimed
+
+    def finish(self, topic_id, requested_at):
+        """ Removes a finished job. If the topic changed again while it was
+        being worked on, the job is left queued instead.
+        """
+        finished, _ = self.filter(topic_id=topic_id,
+                                  requested_at=requested_at).delete()
+        if not finished:
+            self.filter(topic_id=topic_id).update(claimed_at=None)
+
+
+class RankingJob(models.Model):
+    """ A topic whose rankings have changed since its snapshots were
+    computed, waiting for a worker to recompute them
+    """
+    topic = models.OneToOneField(Topic, on_delete=models.CASCADE,
+                                 primary_key=True,
+                                 related_name='ranking_job')
+    requested_at = models.DateTimeField()
+    claimed_at = models.DateTimeField(null=True)
+
+    objects = RankingJobManager()
+
+
+class TopicRankingSnapshotManager(models.Manager):
+    def store(self, topic_id, method, option_ids):
+        """ Replaces the topic's snapshot for a ranking method
+        """
+        self.update_or_create(
+            topic_id=topic_id, method=method,
+            defaults={'option_ids': json.dumps(list(option_ids)),
+                      'created_at': timezone.now()})
+
+    def discard(self, topic_id):
+        """ Deletes the topic's snapshots, such as when its options change
+        and the snapshots would list the wrong ones
+        """
+        self.filter(topic_id=topic_id).delete()
+
+
+class TopicRankingSnapshot(models.Model):
+    """ The full ordering of a topic's option ids for one ranking method,
+    as computed by the ranking worker
+    """
+    topic = models.ForeignKey(Topic, on_delete=models.CASCADE,
+                              related_name='ranking_snapshots')
+    method = models.CharField(max_length=32)
+    # A JSON list of option ids, best first
+    option_ids = models.TextField()
+    created_at = models.DateTimeField()
+
+    objects = TopicRankingSnapshotManager()
+
+    class Meta:
+        unique_together = (("topic", "method"),)
+
+    def ranked_option_ids(self):
+        return json.loads(self.option_ids)
+
+    def age(self):
+        """ Returns how many seconds ago the snapshot was computed
+        """
+        return (timezone.now() - self.created_at).total_seconds()
@@ -0,0 +1,24 @@
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    """ Pages through a list in id order. Each page continues after the last
+    id of the previous one, so it is read from the primary key index
+    however deep into the list it is.
+    """
+    ordering = 'id'
+    page_size = 100
+    page_size_query_param = 'count'
+    max_page_size = 1000
+
+    def get_page_size(self, request):
+        # CursorPagination has a fixed page size, so it is read from the
+        # query here, clamped to between 1 and max_page_size
+        count = request.query_params.get(self.page_size_query_param)
+        if count is None:
+            return self.page_size
+        try:
+            return min(max(int(count), 1), self.max_page_size)
+        except ValueError:
+            raise ParseError('Invalid count')
@@ -1,8 +1,14 @@
+import ctypes
 import itertools
-from collections import Counter
+import multiprocessing
+from array import array
+from collections import Counter, OrderedDict
+from multiprocessing import sharedctypes
 from operator import itemgetter
 import functools
 
+import numpy
+
 
 def inlist(l):
     """ Creates a callable that returns true if the value is in l
@@ -128,3 +134,518 @@ def full_ranked_preference(candidates, preferences):
             candidates.remove(v)
         except ValueError:
             candidates = list(itertools.ifilterfalse(inlist(v), candidates))
+
+
+class BallotStore(object):
+    """ Ballots packed into flat integer arrays rather than lists. votes holds
+    the candidate index of every vote, and ballot n is
+    votes[offsets[n]:offsets[n + 1]]. Iterating a store yields each ballot as
+    a list of candidates, so it can be read any number of times.
+    """
+    def __init__(self, candidates):
+        self.candidates = list(candidates)
+        self.index = {c: i for i, c in enumerate(self.candidates)}
+        self.votes = array('i')
+        self.offsets = array('l', [0])
+
+    def add(self, ballot):
+        """ Appends a ballot of candidates, in order of preference. Unknown
+        and repeated candidates are dropped.
+        """
+        start = self.offsets[-1]
+        seen = set()
+        for v in ballot:
+            i = self.index.get(v)
+            if i is not None and i not in seen:
+                seen.add(i)
+                self.votes.append(i)
+        self.offsets.append(start + len(seen))
+
+    def positions(self):
+        """ Generates each ballot as an array of candidate indexes
+        """
+        votes = numpy.frombuffer(self.votes, dtype=numpy.intc)
+        for n in range(len(self)):
+            yield votes[self.offsets[n]:self.offsets[n + 1]].astype(
+                numpy.intp)
+
+    def __iter__(self):
+        for n in range(len(self)):
+            yield [self.candidates[i] for i in
+                   self.votes[self.offsets[n]:self.offsets[n + 1]]]
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+
+def ballot_indexes(candidates, preferences):
+    """ Converts each ballot into an array of candidate indexes, in order of
+    preference. Unknown and repeated candidates are dropped.
+    """
+    if (isinstance(preferences, BallotStore) and
+            preferences.candidates == list(candidates)):
+        for positions in preferences.positions():
+            yield positions
+        return
+
+    index = {c: i for i, c in enumerate(candidates)}
+    for ballot in preferences:
+        seen = set()
+        positions = []
+        for v in ballot:
+            i = index.get(v)
+            if i is not None and i not in seen:
+                seen.add(i)
+                positions.append(i)
+        yield numpy.array(positions, dtype=numpy.intp)
+
+
+def as_ballot_store(candidates, preferences):
+    """ Returns the preferences as a BallotStore for the candidates, reusing
+    them if they already are one
+    """
+    candidates = list(candidates)
+    if (isinstance(preferences, BallotStore) and
+            preferences.candidates == candidates):
+        return preferences
+    store = BallotStore(candidates)
+    for ballot in preferences:
+        store.add(ballot)
+    return store
+
+
+class Runoff(object):
+    """ Instant runoff over a BallotStore. Every ballot keeps a pointer to its
+    highest ranked candidate that is still standing. Each candidate's votes
+    are indexed up front, so eliminating a candidate only looks at the
+    ballots that rank it, and only moves those currently pointing at it.
+
+    The standing state is shared by each election, which works on a copy of
+    it. Taking a winner out with remove() only moves the winner's ballots.
+    """
+    def __init__(self, store):
+        self.size = len(store.candidates)
+        # Each ballot ends with an extra candidate, which is always standing
+        # and stands for the ballot being exhausted
+        offsets = numpy.frombuffer(store.offsets, dtype=numpy.int_)
+        lengths = numpy.diff(offsets) + 1
+        votes = numpy.insert(
+            numpy.frombuffer(store.votes, dtype=numpy.intc), offsets[1:],
+            self.size).astype(numpy.intp)
+
+        # Each candidate's votes, as their positions in votes and the ballots
+        # they are on, grouped by candidate
+        self.positions = numpy.argsort(votes, kind='mergesort')
+        self.ballots = numpy.repeat(numpy.arange(len(store)),
+                                    lengths)[self.positions]
+        self.starts = numpy.searchsorted(votes[self.positions],
+                                         numpy.arange(self.size + 1))
+
+        # Ballots are scanned a few votes at a time, so pad the end to keep
+        # the last ballot's window in bounds
+        self.window = numpy.arange(16)
+        self.votes = numpy.append(votes, [self.size] * len(self.window))
+
+        self.pointers = offsets[:-1] + numpy.arange(len(store))
+        self.standing = numpy.ones(self.size + 1, dtype=bool)
+        # The last count is of exhausted ballots
+        self.counts = numpy.zeros(self.size + 1, dtype=numpy.int64)
+        self._assign(numpy.arange(len(store)), self.pointers, self.standing,
+                     self.counts)
+
+    def remaining(self):
+        """ Returns the number of candidates still standing
+        """
+        return int(self.standing[:self.size].sum())
+
+    def _assign(self, ballots, pointers, standing, counts):
+        """ Moves each ballot's pointer on to its first standing candidate,
+        and adds it to that candidate's count
+        """
+        # Most ballots find a standing candidate within their next few votes,
+        # so the first scan is narrower than the rest
+        width = len(self.window) // 2
+        while len(ballots):
+            votes = self.votes[pointers[ballots, numpy.newaxis] +
+                               self.window[:width]]
+            votes_standing = standing[votes]
+            first = votes_standing.argmax(axis=1)
+            rows = numpy.arange(len(ballots))
+            placed = votes_standing[rows, first]
+            pointers[ballots] += numpy.where(placed, first, width)
+            counts += numpy.bincount(votes[rows[placed], first[placed]],
+                                     minlength=self.size + 1)
+            ballots = ballots[~placed]
+            width = len(self.window)
+
+    def _pointing_at(self, candidates, pointers):
+        """ Returns the ballots whose pointer is at one of the candidates
+        """
+        if len(candidates) == 1:
+            votes = slice(self.starts[candidates[0]],
+                          self.starts[candidates[0] + 1])
+            positions = self.positions[votes]
+            ballots = self.ballots[votes]
+        else:
+            votes = [slice(self.starts[c], self.starts[c + 1])
+                     for c in candidates]
+            positions = numpy.concatenate([self.positions[v] for v in votes])
+            ballots = numpy.concatenate([self.ballots[v] for v in votes])
+        return ballots[pointers[ballots] == positions]
+
+    def _eliminate(self, candidates, pointers, standing, counts):
+        standing[candidates] = False
+        counts[candidates] = 0
+        ballots = self._pointing_at(candidates, pointers)
+        pointers[ballots] += 1
+        self._assign(ballots, pointers, standing, counts)
+
+    def election(self):
+        """ Runs an instant runoff between the standing candidates. Returns
+        the winner's index, a list of indexes if the last candidates tie, or
+        None if no ballot ranks a standing candidate.
+        """
+        pointers = self.pointers.copy()
+        standing = self.standing.copy()
+        counts = self.counts.copy()
+
+        # Only the standing candidates' counts are looked at in each round
+        candidates = numpy.flatnonzero(standing[:self.size])
+        while True:
+            current = counts[candidates]
+            total = current.sum()
+            if not total:
+                return None
+            high = current.max()
+            if high * 2 > total:
+                return int(candidates[current.argmax()])
+
+            # Every candidate whose votes, added to those of everyone below
+            # it, can't catch the next candidate up is certain to go out
+            # before it, so they are all eliminated at once
+            ordered = numpy.sort(current)
+            behind = numpy.cumsum(ordered[:-1]) < ordered[1:]
+            if behind.any():
+                cutoff = len(behind) - numpy.argmax(behind[::-1])
+                out = current <= ordered[cutoff - 1]
+            elif ordered[0] == high:
+                # The last remaining candidates are tied
+                return candidates.tolist()
+            else:
+                out = current == ordered[0]
+
+            self._eliminate(candidates[out], pointers, standing, counts)
+            candidates = candidates[~out]
+
+    def remove(self, candidates):
+        """ Takes candidates out of every following election
+        """
+        self._eliminate(numpy.atleast_1d(candidates), self.pointers,
+                        self.standing, self.counts)
+
+
+def fast_instant_runoff(candidates, preferences):
+    """ Equivalent to instant_runoff, using a Runoff to only move the
+    ballots of eliminated candidates between rounds
+    """
+    candidates = list(candidates)
+    if not candidates:
+        return None
+    winner = Runoff(as_ballot_store(candidates, preferences)).election()
+    assert(winner is not None)
+    if isinstance(winner, list):
+        return set(candidates[i] for i in winner)
+    return candidates[winner]
+
+
+def fast_full_ranked_preference(candidates, preferences):
+    """ Equivalent to full_ranked_preference. Each place is an instant runoff
+    between the candidates not yet placed, and the Runoff state for the next
+    election is kept by moving only the placed candidates' ballots.
+    """
+    candidates = list(candidates)
+    runoff = Runoff(as_ballot_store(candidates, preferences))
+    while runoff.remaining():
+        winner = runoff.election()
+        if winner is None:
+            return
+        if isinstance(winner, list):
+            yield set(candidates[i] for i in winner)
+        else:
+            yield candidates[winner]
+        runoff.remove(winner)
+
+
+# Ballot stores with at least this many ballots are tallied on several
+# processes, each taking at least PARALLEL_SHARD_BALLOTS of them. Every
+# process holds its own CxC matrix, so topics with more than
+# PARALLEL_MAX_CANDIDATES candidates are always tallied serially.
+PARALLEL_MIN_BALLOTS = 200000
+PARALLEL_SHARD_BALLOTS = 50000
+PARALLEL_MAX_CANDIDATES = 2000
+
+
+def tally_processes(ballots, candidates):
+    """ Picks how many processes ballot_tallies should use for a number of
+    ballots and candidates, where 0 means tallying them serially
+    """
+    if (ballots < PARALLEL_MIN_BALLOTS or
+            candidates > PARALLEL_MAX_CANDIDATES or
+            multiprocessing.current_process().daemon):
+        # Pool workers can't start processes of their own
+        return 0
+    processes = min(multiprocessing.cpu_count(),
+                    ballots // PARALLEL_SHARD_BALLOTS)
+    return processes if processes >= 2 else 0
+
+
+def _count_ballots(ballots, size, ranked, ordered, chunk_size):
+    # Adds each ballot, an array of candidate indexes, to the counts in place
+    pending = []
+    pending_size = 0
+    for positions in ballots:
+        ranked[positions] += 1
+        if len(positions) < 2:
+            continue
+        first, second = numpy.triu_indices(len(positions), 1)
+        pending.append(positions[first] * size + positions[second])
+        pending_size += len(first)
+        if pending_size >= chunk_size:
+            ordered += numpy.bincount(numpy.concatenate(pending),
+                                      minlength=size * size)
+            pending = []
+            pending_size = 0
+    if pending:
+        ordered += numpy.bincount(numpy.concatenate(pending),
+                                  minlength=size * size)
+
+
+# The arrays shared with the processes of a parallel tally, which inherit
+# them when the pool is started
+_shared = {}
+
+
+def _start_shard_worker(votes, offsets, partials, size, chunk_size):
+    _shared.update(votes=votes, offsets=offsets, partials=partials,
+                   size=size, chunk_size=chunk_size)
+
+
+def _tally_shard(shard):
+    # Counts ballots start to stop into the shard's own slot of partials
+    slot, start, stop = shard
+    size = _shared['size']
+    votes = numpy.ctypeslib.as_array(_shared['votes'])
+    offsets = numpy.ctypeslib.as_array(_shared['offsets'])
+    partial = numpy.ctypeslib.as_array(_shared['partials']).reshape(
+        -1, size + size * size)[slot]
+
+    ballots = (votes[offsets[n]:offsets[n + 1]].astype(numpy.intp)
+               for n in range(start, stop))
+    _count_ballots(ballots, size, partial[:size], partial[size:],
+                   _shared['chunk_size'])
+
+
+def _parallel_tallies(store, processes, chunk_size):
+    # Each process tallies a contiguous shard of the ballots into its own
+    # partial counts in shared memory, which are then summed. Integer sums
+    # don't depend on the order they are added in, so the result is the
+    # same as tallying serially.
+    size = len(store.candidates)
+    votes = sharedctypes.RawArray(ctypes.c_int, len(store.votes))
+    numpy.ctypeslib.as_array(votes)[:] = numpy.frombuffer(
+        store.votes, dtype=numpy.intc)
+    offsets = sharedctypes.RawArray(ctypes.c_int64, len(store.offsets))
+    numpy.ctypeslib.as_array(offsets)[:] = store.offsets
+    partials = sharedctypes.RawArray(ctypes.c_int64,
+                                     processes * (size + size * size))
+
+    bounds = numpy.linspace(0, len(store), processes + 1).astype(int)
+    pool = multiprocessing.Pool(processes, _start_shard_worker,
+                                (votes, offsets, partials, size, chunk_size))
+    try:
+        pool.map(_tally_shard, [(slot, bounds[slot], bounds[slot + 1])
+                                for slot in range(processes)])
+    finally:
+        pool.close()
+        pool.join()
+
+    totals = numpy.ctypeslib.as_array(partials).reshape(
+        processes, size + size * size).sum(axis=0)
+    return totals[:size], totals[size:].reshape(size, size)
+
+
+def ballot_tallies(candidates, preferences, chunk_size=1 << 20,
+                   processes=None):
+    """ Counts how many ballots rank each candidate, and a CxC matrix where
+    [a, b] is the number of ballots ranking both a and b with a ahead of b.
+    With processes, the ballots are split between that many processes.
+    Otherwise a BallotStore is split between as many as tally_processes
+    picks for its size, and other ballots are tallied serially.
+    """
+    if processes is None and isinstance(preferences, BallotStore):
+        processes = tally_processes(len(preferences), len(candidates))
+    if processes:
+        return _parallel_tallies(as_ballot_store(candidates, preferences),
+                                 processes, chunk_size)
+
+    size = len(candidates)
+    ranked = numpy.zeros(size, dtype=numpy.int64)
+    ordered = numpy.zeros(size * size, dtype=numpy.int64)
+    _count_ballots(ballot_indexes(candidates, preferences), size, ranked,
+                   ordered, chunk_size)
+    return ranked, ordered.reshape(size, size)
+
+
+def tally_matrix(ranked, ordered):
+    """ Combines the output of ballot_tallies into a pairwise matrix.
+    A ranked candidate beats every candidate missing from the ballot, so
+    [a, b] is every ballot ranking a, less those that put b ahead of a.
+    """
+    matrix = ranked[:, numpy.newaxis] - ordered.T
+    numpy.fill_diagonal(matrix, 0)
+    return matrix
+
+
+def pairwise_matrix(candidates, preferences):
+    """ Builds a CxC matrix where [a, b] is the number of ballots that prefer
+    candidate a over candidate b. A ranked candidate is preferred over every
+    candidate missing from the ballot.
+    """
+    return tally_matrix(*ballot_tallies(candidates, preferences))
+
+
+def top_rankings(rankings, limit=None):
+    """ Passes on ranks from the start of rankings until they cover at least
+    limit candidates. The last tie group is kept whole, and nothing after it
+    is computed.
+    """
+    if limit is None:
+        for rank in rankings:
+            yield rank
+        return
+
+    ranked = 0
+    for rank in rankings:
+        if ranked >= limit:
+            return
+        yield rank
+        ranked += len(rank) if isinstance(rank, set) else 1
+
+
+def score_rankings(candidates, scores, limit=None):
+    """ Ranks candidates from the highest score to the lowest, yielding a set
+    for each group of tied candidates. With a limit, only the tie groups
+    covering the best limit candidates are sorted and yielded.
+    """
+    scores = numpy.asarray(scores)
+    order = numpy.arange(len(candidates))
+    if limit is not None and limit < len(candidates):
+        if limit <= 0:
+            return
+        # Every candidate scoring at least as well as the limit-th best
+        # belongs to one of the first tie groups. Selecting them is linear,
+        # and leaves only those to be sorted.
+        threshold = numpy.partition(scores, len(scores) - limit)[-limit]
+        order = numpy.flatnonzero(scores >= threshold)
+    order = sorted(order, key=lambda i: scores[i], reverse=True)
+    for k, group in itertools.groupby(order, lambda i: scores[i]):
+        group = [candidates[i] for i in group]
+        if len(group) == 1:
+            yield group[0]
+        else:
+            yield set(group)
+
+
+def matrix_rankings(candidates, matrix, limit=None):
+    """ Ranks candidates by the number of pairwise contests they won in the
+    matrix (Copeland's method), yielding a set for each group of tied
+    candidates
+    """
+    return score_rankings(candidates, (matrix > matrix.T).sum(axis=1), limit)
+
+
+def condorcet_rankings(candidates, matrix, limit=None):
+    """ Repeatedly takes the candidate that beats every other remaining
+    candidate. Once there is no Condorcet winner, the rest are ranked by
+    Copeland's method among themselves.
+    """
+    matrix = numpy.asarray(matrix)
+    remaining = numpy.arange(len(candidates))
+    if limit is None:
+        limit = len(candidates)
+    while len(remaining) and limit > 0:
+        contests = matrix[numpy.ix_(remaining, remaining)]
+        wins = (contests > contests.T).sum(axis=1)
+        winners = numpy.flatnonzero(wins == len(remaining) - 1)
+        if not len(winners):
+            break
+        yield candidates[remaining[winners[0]]]
+        remaining = numpy.delete(remaining, winners[0])
+        limit -= 1
+
+    for rank in matrix_rankings([candidates[i] for i in remaining],
+                                matrix[numpy.ix_(remaining, remaining)],
+                                limit):
+        yield rank
+
+
+def strongest_paths(matrix):
+    """ Computes the strength of the strongest path from each candidate to
+    every other, where a path is as strong as its weakest pairwise victory.
+    This is the Floyd-Warshall algorithm, with each pass over an
+    intermediate candidate done as one array operation.
+    """
+    matrix = numpy.asarray(matrix)
+    paths = numpy.where(matrix > matrix.T, matrix, 0)
+    for k in range(len(paths)):
+        paths = numpy.maximum(paths, numpy.minimum(paths[:, k, numpy.newaxis],
+                                                   paths[numpy.newaxis, k]))
+    return paths
+
+
+def schulze_rankings(candidates, matrix, limit=None):
+    """ Ranks candidates by the Schulze method, where a beats b if a's
+    strongest path to b is stronger than b's path to a
+    """
+    paths = strongest_paths(matrix)
+    return score_rankings(candidates, (paths > paths.T).sum(axis=1), limit)
+
+
+def ranked_pairs_rankings(candidates, matrix, limit=None):
+    """ Ranks candidates by Tideman's ranked pairs. Victories are locked in
+    from the strongest down, skipping any that would create a cycle, and
+    candidates are ranked by how many others they are locked in above.
+    """
+    matrix = numpy.asarray(matrix)
+    winners, losers = numpy.nonzero(matrix > matrix.T)
+    votes = matrix[winners, losers]
+    margins = votes - matrix[losers, winners]
+    # Strongest victory first, then the widest margin, then candidate order
+    order = numpy.lexsort((losers, winners, -margins, -votes))
+
+    # reach[a, b] is whether a is locked in above b, directly or not
+    reach = numpy.eye(len(candidates), dtype=bool)
+    for a, b in zip(winners[order], losers[order]):
+        if reach[a, b] or reach[b, a]:
+            # Either already implied, or would create a cycle
+            continue
+        above = reach[:, a].copy()
+        reach[above] |= reach[b]
+    return score_rankings(candidates, reach.sum(axis=1), limit)
+
+
+# Ranking methods which only need the pairwise matrix
+MATRIX_METHODS = OrderedDict([
+    ('copeland', matrix_rankings),
+    ('condorcet', condorcet_rankings),
+    ('schulze', schulze_rankings),
+    ('ranked-pairs', ranked_pairs_rankings),
+])
+
+
+def fast_pairwise_rankings(candidates, preferences):
+    """ Equivalent to pairwise_rankings, but reads each ballot only once
+    """
+    candidates = list(candidates)
+    matrix = pairwise_matrix(candidates, preferences)
+    return matrix_rankings(candidates, matrix)
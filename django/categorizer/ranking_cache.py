@@ -0,0 +1,121 @@
+""" Caches the ordering of each topic's options.
+
+Entries are keyed by topic and a per-topic version counter. Anything that
+changes a topic's rankings calls invalidate_rankings, which bumps the
+counter so that readers recompute the ordering on their next request.
+"""
+import logging
+import threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import connection, transaction
+
+from categorizer import timing
+from categorizer.db import primary_reads
+
+logger = logging.getLogger(__name__)
+
+
+def _cache():
+    return caches[getattr(settings, 'RANKINGS_CACHE', 'default')]
+
+
+def _version_key(topic_id):
+    return 'rankings:{}:version'.format(topic_id)
+
+
+def _rankings_key(topic_id, method):
+    return 'rankings:{}:{}'.format(topic_id, method)
+
+
+def _lock_key(topic_id, method):
+    return 'rankings:{}:{}:refresh'.format(topic_id, method)
+
+
+def ranking_version(topic_id):
+    from categorizer.models import Topic
+
+    cache = _cache()
+    version = cache.get(_version_key(topic_id))
+    if version is None:
+        # The counter was evicted, so any cached rankings can't be trusted
+        cache.delete_many([_rankings_key(topic_id, method)
+                           for method in Topic.RANKING_METHODS])
+        cache.add(_version_key(topic_id), 1, None)
+        version = cache.get(_version_key(topic_id), 1)
+    return version
+
+
+def _bump_version(topic_id):
+    cache = _cache()
+    try:
+        cache.incr(_version_key(topic_id))
+    except ValueError:
+        # Nothing has been cached for this topic yet
+        cache.add(_version_key(topic_id), 1, None)
+
+
+def invalidate_rankings(topic_id):
+    """ Marks the cached rankings for a topic as out of date
+    """
+    _bump_version(topic_id)
+    if connection.in_atomic_block:
+        # A reader may recompute the rankings before this transaction is
+        # committed, so bump the version again once the changes are visible
+        transaction.on_commit(lambda: _bump_version(topic_id))
+
+
+def _store_rankings(topic, method, version, count=None):
+    # The result is cached until the next invalidation, so it mustn't be
+    # computed from a replica that is behind the changes up to version
+    with primary_reads(), timing.span('ranking'):
+        option_ids = list(topic.ranked_option_ids(method, limit=count))
+    # A partial ordering can only answer requests for up to as many options
+    complete = count is None or len(option_ids) < count
+    _cache().set(_rankings_key(topic.id, method),
+                 (version, option_ids, complete),
+                 getattr(settings, 'RANKINGS_CACHE_TIMEOUT', 60))
+    return option_ids
+
+
+def _refresh_rankings(topic, method, version, count):
+    try:
+        _store_rankings(topic, method, version, count)
+    except Exception:
+        logger.exception('Failed to refresh %s rankings for topic %d',
+                         method, topic.id)
+    finally:
+        _cache().delete(_lock_key(topic.id, method))
+        connection.close()
+
+
+def _schedule_refresh(topic, method, version, count):
+    # Only one reader needs to recompute a stale ordering
+    if _cache().add(_lock_key(topic.id, method), version, 60):
+        thread = threading.Thread(target=_refresh_rankings,
+                                  args=(topic, method, version, count))
+        thread.daemon = True
+        thread.start()
+
+
+def get_ranked_option_ids(topic, method='copeland', count=None):
+    """ Returns the id of every option in the topic, best first. With a
+    count, only the best options are ranked, and at least that many are
+    returned unless the topic has fewer. Each ranking method is cached
+    separately. With RANKINGS_STALE_WHILE_REVALIDATE enabled, out of date
+    rankings are served while they are recomputed in the background.
+    """
+    version = ranking_version(topic.id)
+    cached = _cache().get(_rankings_key(topic.id, method))
+    if cached is not None:
+        cached_version, option_ids, complete = cached
+        if complete or (count is not None and len(option_ids) >= count):
+            if cached_version == version:
+                return option_ids
+            if getattr(settings, 'RANKINGS_STALE_WHILE_REVALIDATE', False):
+                _schedule_refresh(topic, method, version,
+                                  None if complete else len(option_ids))
+                return option_ids
+
+    return _store_rankings(topic, method, version, count)
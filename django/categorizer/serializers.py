@@ -3,13 +3,25 @@ from rest_framework import serializers
 from categorizer.models import Topic, Option, Contest
 
 
-class TopicSerializer(serializers.ModelSerializer):
+class SparseFieldsMixin(object):
+    """ Lets a serializer be limited to some of its fields, given as a
+    fields argument
+    """
+    def __init__(self, *args, **kwargs):
+        fields = kwargs.pop('fields', None)
+        super(SparseFieldsMixin, self).__init__(*args, **kwargs)
+        if fields is not None:
+            for name in set(self.fields) - set(fields):
+                self.fields.pop(name)
+
+
+class TopicSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Topic
         fields = ('id', 'label')
 
 
-class OptionSerializer(serializers.ModelSerializer):
+class OptionSerializer(SparseFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = Option
         fields = ('id', 'label')
@@ -19,3 +31,15 @@ class ContestSerializer(serializers.ModelSerializer):
     class Meta:
         model = Contest
         fields = ('contestants', )
+
+
+class VoteSerializer(serializers.Serializer):
+    contest = serializers.IntegerField()
+    winner = serializers.IntegerField()
+
+
+class TopicOptionsSerializer(serializers.Serializer):
+    ids = serializers.ListField(child=serializers.IntegerField(),
+                                required=False)
+    labels = serializers.ListField(
+        child=serializers.CharField(max_length=128), required=False)
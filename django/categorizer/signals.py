@@ -1,10 +1,85 @@
-from django.db.models.signals import pre_delete
+from django.db.models.signals import (pre_delete, pre_save, post_save,
+                                      post_delete)
 from django.dispatch import receiver
-from categorizer.models import OptionRanking, Contest
+from categorizer.deletion import delete_contests
+from categorizer.matchups import invalidate_candidates
+from categorizer.models import (OptionRanking, Contest, PairwiseTally,
+                                TopicOption, OptionAggregate, RankingJob,
+                                TopicRankingSnapshot)
+from categorizer.ranking_cache import invalidate_rankings
 
 
 @receiver(pre_delete, sender=OptionRanking)
 def on_option_ranking_delete(sender, instance, **kwargs):
+    # Rankings deleted one at a time, or by a cascade. Deleting many at once
+    # should go through categorizer.deletion, which doesn't send this.
+
     # If an OptionRanking is deleted for whatever reason, delete any contests
     # that it belonged to since they are no longer meaningful.
-    Contest.objects.filter(contestants=instance).delete()
+    delete_contests(Contest.contestants.through.objects
+                    .filter(optionranking=instance)
+                    .values_list('contest_id', flat=True))
+
+    # The option also drops off of the user's ballot
+    topic_id = instance.topicoption.topic_id
+    PairwiseTally.objects.record_ballot(
+        topic_id, instance.user_id,
+        {instance.topicoption_id: (instance.score, None)})
+    if instance.user_id is not None:
+        OptionAggregate.objects.record(
+            [(instance.topicoption_id, instance.score, None)])
+    invalidate_rankings(topic_id)
+    # Deleting a topic cascades to its rankings, so a job can't be queued
+    TopicRankingSnapshot.objects.discard(topic_id)
+
+
+@receiver(pre_save, sender=OptionRanking)
+def on_option_ranking_pre_save(sender, instance, **kwargs):
+    # Remember the stored score so the tallies can be adjusted after saving
+    instance._previous = None
+    if instance.pk is not None:
+        instance._previous = (OptionRanking.objects.filter(pk=instance.pk)
+                              .values_list('user_id', 'score').first())
+
+
+@receiver(post_save, sender=OptionRanking)
+def on_option_ranking_save(sender, instance, **kwargs):
+    previous_user, previous_score = instance._previous or (None, None)
+    current_user, current_score = (OptionRanking.objects
+                                   .filter(pk=instance.pk)
+                                   .values_list('user_id', 'score').get())
+    if previous_user == current_user and previous_score == current_score:
+        return
+
+    topic_id = instance.topicoption.topic_id
+    topicoption_id = instance.topicoption_id
+    OptionAggregate.objects.record(
+        [(topicoption_id,
+          previous_score if previous_user is not None else None,
+          current_score if current_user is not None else None)])
+    if previous_user == current_user:
+        PairwiseTally.objects.record_ballot(
+            topic_id, current_user,
+            {topicoption_id: (previous_score, current_score)})
+    else:
+        PairwiseTally.objects.record_ballot(
+            topic_id, previous_user, {topicoption_id: (previous_score, None)})
+        PairwiseTally.objects.record_ballot(
+            topic_id, current_user, {topicoption_id: (None, current_score)})
+    RankingJob.objects.mark_dirty(topic_id)
+    invalidate_rankings(topic_id)
+
+
+@receiver(post_save, sender=TopicOption)
+def on_topic_option_save(sender, instance, created, **kwargs):
+    if created:
+        OptionAggregate.objects.ensure(instance.topic_id, [instance.id])
+
+
+@receiver(post_save, sender=TopicOption)
+@receiver(post_delete, sender=TopicOption)
+def on_topic_option_change(sender, instance, **kwargs):
+    invalidate_candidates(instance.topic_id)
+    invalidate_rankings(instance.topic_id)
+    # The snapshots would list the wrong options until they are recomputed
+    TopicRankingSnapshot.objects.discard(instance.topic_id)
@@ -0,0 +1,150 @@
+import json
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from categorizer import matchups
+from categorizer.benchmarks import electorates
+from categorizer.benchmarks.algorithms import time_algorithms
+from categorizer.benchmarks.endpoints import seed_topic, time_endpoints
+from categorizer.benchmarks.load import contest_clients, serve, stop
+from categorizer.benchmarks.report import compare_results
+from categorizer.models import PairwiseTally
+from categorizer.ranked_preference import pairwise_matrix
+
+
+class ElectorateTestCase(TestCase):
+    def test_deterministic(self):
+        for generate in electorates.ELECTORATES.values():
+            ballots = generate(range(6), 20, seed=5)
+            self.assertEqual(ballots, generate(range(6), 20, seed=5))
+            self.assertEqual(len(ballots), 20)
+            for ballot in ballots:
+                self.assertEqual(sorted(ballot), range(6))
+
+    def test_truncated(self):
+        for generate in [electorates.uniform, electorates.mallows]:
+            ballots = generate(range(6), 50, seed=1, min_length=2)
+            lengths = set(len(ballot) for ballot in ballots)
+            self.assertTrue(min(lengths) >= 2)
+            self.assertTrue(len(lengths) > 1)
+            for ballot in ballots:
+                self.assertEqual(len(set(ballot)), len(ballot))
+
+    def test_mallows_dispersion(self):
+        ballots = electorates.mallows(range(8), 10, seed=2, dispersion=0)
+        self.assertEqual(len(set(map(tuple, ballots))), 1)
+
+    def test_heavy_tie(self):
+        ballots = electorates.heavy_tie(range(6), 40, seed=3)
+        matrix = pairwise_matrix(range(6), ballots)
+        self.assertEqual(matrix.tolist(), matrix.T.tolist())
+
+
+class AlgorithmBenchmarkTestCase(TestCase):
+    def test_grid(self):
+        results = time_algorithms([3, 4], [10], ['uniform'],
+                                  ['fast_pairwise_rankings', 'instant_runoff'],
+                                  repeat=1)
+        self.assertEqual(
+            [(r['algorithm'], r['candidates']) for r in results],
+            [('fast_pairwise_rankings', 3), ('instant_runoff', 3),
+             ('fast_pairwise_rankings', 4), ('instant_runoff', 4)])
+        for result in results:
+            self.assertTrue(result['seconds'] >= 0)
+
+    def test_time_limit(self):
+        results = time_algorithms([3, 4], [10], ['heavy-tie'],
+                                  ['pairwise_rankings'], repeat=1,
+                                  time_limit=0)
+        self.assertEqual([r['seconds'] is None for r in results],
+                         [False, True])
+
+    def test_command(self):
+        out = StringIO()
+        call_command('benchmark_rankings', '--candidates', '3',
+                     '--voters', '5', '--repeat', '1',
+                     '--algorithms', 'schulze_rankings', stdout=out)
+        document = json.loads(out.getvalue())
+        self.assertEqual(document['parameters']['repeat'], 1)
+        self.assertEqual(len(document['results']), 3)
+
+        comparison = list(compare_results(document, document,
+                                          ['algorithm', 'electorate'],
+                                          'seconds'))
+        self.assertEqual(len(comparison), 3)
+        for _, old, new, ratio in comparison:
+            self.assertEqual(old, new)
+
+
+class EndpointBenchmarkTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        matchups._candidates.entries.clear()
+
+    def tearDown(self):
+        # The requests leave the user's candidates cached in this process
+        cache.clear()
+        matchups._candidates.entries.clear()
+
+    def test_seed_topic(self):
+        topic, users = seed_topic(10, 3, 4, seed=1)
+        self.assertEqual(topic.topicoption.count(), 10)
+        self.assertEqual(len(users), 3)
+        for user in users:
+            self.assertEqual(user.optionranking_set.count(), 4)
+        self.assertTrue(PairwiseTally.objects.filter(topic=topic).exists())
+
+    def test_time_endpoints(self):
+        topic, users = seed_topic(6, 2, 3)
+        results = time_endpoints(topic, users, 2)
+        self.assertEqual([result['endpoint'] for result in results],
+                         ['calculate_top_options', 'rankings (cold)',
+                          'rankings (cached)', 'contest', 'vote'])
+        for result in results:
+            self.assertEqual(result['requests'], 2)
+            self.assertTrue(result['queries'] > 0)
+
+
+def contest_application(environ, start_response):
+    """ Answers like the contest endpoint, without a database
+    """
+    if environ['HTTP_AUTHORIZATION'] != 'Token valid':
+        start_response('401 Unauthorized', [])
+        return [b'']
+    start_response('200 OK', [('Content-Type', 'application/json')])
+    if environ['REQUEST_METHOD'] == 'GET':
+        return [json.dumps([{'id': 1, 'label': 'A'},
+                            {'id': 2, 'label': 'B'}]).encode()]
+    return [json.dumps({'status': 'OK'}).encode()]
+
+
+class LoadTestTestCase(TestCase):
+    def test_contest_clients(self):
+        for threads in [0, 2]:
+            server = serve(contest_application, threads)
+            try:
+                url = 'http://127.0.0.1:{}/'.format(server.server_port)
+                result = contest_clients(url, ['valid'] * 3, 2)
+            finally:
+                stop(server)
+
+            self.assertEqual(result['clients'], 3)
+            self.assertEqual(result['requests'], 12)
+            self.assertEqual(result['errors'], 0)
+            self.assertTrue(result['throughput'] > 0)
+            self.assertTrue(result['vote_p95'] >= result['vote_p50'])
+
+    def test_errors(self):
+        server = serve(contest_application)
+        try:
+            url = 'http://127.0.0.1:{}/'.format(server.server_port)
+            result = contest_clients(url, ['invalid'], 2)
+        finally:
+            stop(server)
+
+        self.assertEqual(result['requests'], 0)
+        self.assertEqual(result['errors'], 2)
+        self.assertIsNone(result['contest_p50'])
@@ -1,5 +1,14 @@
+import itertools
+import random
+
+import numpy
+from django.core.management import call_command
+from django.db import IntegrityError, transaction
 from django.test import TestCase
-from categorizer.models import Topic, Option, TopicOption, Contest
+from django.utils.six import StringIO
+from categorizer import elo
+from categorizer.models import (Topic, Option, TopicOption, Contest,
+                                OptionRanking, OptionAggregate)
 from django.contrib.auth.models import User
 
 
@@ -56,3 +65,195 @@ class ContestTestCase(TestCase):
         # Check that red is ranked above blue
         top_options = list(self.topic.calculate_top_options(2))
         self.assertEqual(top_options, [self.red, self.blue])
+
+    def test_top_options(self):
+        green = Option.objects.create(label='Green')
+        TopicOption.objects.create(topic=self.topic, option=green)
+        other = User.objects.create_user('other')
+        for user, red_score, blue_score in [(self.user, 1100, 900),
+                                            (other, 1000, 950)]:
+            OptionRanking.objects.create(topicoption=self.red_map,
+                                         user=user, score=red_score)
+            OptionRanking.objects.create(topicoption=self.blue_map,
+                                         user=user, score=blue_score)
+
+        for method in Topic.RANKING_METHODS:
+            ranked = list(self.topic.ranked_option_ids(method))
+            for count in range(4):
+                self.assertEqual(
+                    [option.id for option in
+                     self.topic.calculate_top_options(count, method)],
+                    ranked[:count])
+
+        # Green hasn't been ranked, so has the default score
+        self.assertEqual(self.topic.calculate_top_options(3, 'elo-mean'),
+                         [self.red, green, self.blue])
+
+        # Ties are only broken by the count
+        OptionRanking.objects.filter(topicoption=self.red_map).update(
+            score=1000)
+        OptionAggregate.objects.rebuild(self.topic)
+        self.assertIn(self.topic.calculate_top_options(1, 'elo-mean'),
+                      [[self.red], [green]])
+        self.assertItemsEqual(
+            self.topic.calculate_top_options(2, 'elo-mean'),
+            [self.red, green])
+
+        # The whole tie group the limit falls in is read, not just the first
+        # of it
+        with self.assertNumQueries(2):
+            self.assertEqual(list(self.topic.mean_rankings(1)),
+                             [{self.red.id, green.id}])
+
+    def test_create_random_queries(self):
+        contest = Contest.create_random(self.topic, self.user)
+        contest.set_winner(contest.contestants.all()[0])
+
+        # The user already ranks both options, so only their ids are read
+        # before the contest and its contestants are inserted. The
+        # transaction adds a savepoint and its release.
+        with self.assertNumQueries(5):
+            contest = Contest.create_random(self.topic, self.user)
+        self.assertEqual(contest.contestants.count(), 2)
+
+    def test_set_winner_queries(self):
+        contest = Contest.create_random(self.topic, self.user)
+        red = contest.contestants.get(topicoption=self.red_map)
+        blue = contest.contestants.get(topicoption=self.blue_map)
+
+        # Claim the contest, promote the next queued one, read the scores
+        # and update them in a single statement, update both options'
+        # aggregates, and read and update the pairwise tally that flipped.
+        # The transaction adds a savepoint and its release. The topic is
+        # queued for the ranking worker once the transaction commits.
+        with self.assertNumQueries(10):
+            deltas = contest.set_winner(red)
+
+        self.assertEqual(deltas, {red.id: 8, blue.id: -8})
+        red.refresh_from_db()
+        blue.refresh_from_db()
+        self.assertEqual((red.score, blue.score), (1008, 992))
+        self.assertEqual(Contest.objects.get(id=contest.id).winner, red)
+
+    def test_set_winner_claimed(self):
+        contest = Contest.create_random(self.topic, self.user)
+        winner = contest.contestants.get(topicoption=self.red_map)
+        Contest.objects.get(id=contest.id).set_winner(winner)
+
+        # A stale copy of the contest can't apply a second vote
+        self.assertRaises(AssertionError, contest.set_winner, winner)
+        winner.refresh_from_db()
+        self.assertEqual(winner.score, 1008)
+
+
+class ContestQueueTestCase(TestCase):
+    def setUp(self):
+        self.topic = Topic.objects.create(label='Favorite color')
+        for label in ['Blue', 'Red', 'Green', 'Yellow']:
+            TopicOption.objects.create(
+                topic=self.topic, option=Option.objects.create(label=label))
+        self.user = User.objects.create_user('user')
+
+    def test_fill_queue(self):
+        rng = random.Random(0)
+        self.assertEqual(
+            Contest.fill_queue(self.topic, self.user, 5, rng), 5)
+        self.assertEqual(
+            Contest.fill_queue(self.topic, self.user, 5, rng), 0)
+
+        queued = Contest.queued(self.topic.id, self.user.id)
+        self.assertEqual(queued.count(), 5)
+        for contest in queued:
+            self.assertEqual(contest.contestants.distinct().count(), 2)
+        # Each of the user's options only has a single ranking
+        self.assertEqual(OptionRanking.objects.count(), 4)
+
+    def test_pop_queue(self):
+        Contest.fill_queue(self.topic, self.user, 3)
+        first = Contest.queued(self.topic.id, self.user.id)[0]
+
+        contest = Contest.current_for(self.topic, self.user)
+        self.assertEqual(contest, first)
+        with self.assertNumQueries(1):
+            self.assertEqual(Contest.current_for(self.topic, self.user),
+                             first)
+
+        # Deciding the contest moves up the next one in the same transaction
+        contest.set_winner(contest.contestants.all()[0])
+        with self.assertNumQueries(1):
+            contest = Contest.current_for(self.topic, self.user)
+        self.assertNotEqual(contest, first)
+        self.assertEqual(Contest.queued(self.topic.id, self.user.id).count(),
+                         1)
+
+    def test_single_current_contest(self):
+        Contest.fill_queue(self.topic, self.user, 2)
+        contest = Contest.current_for(self.topic, self.user)
+
+        # A second request can't make another queued contest current
+        queued = Contest.queued(self.topic.id, self.user.id)[0]
+        queued.current = True
+        with transaction.atomic():
+            self.assertRaises(IntegrityError, queued.save)
+        self.assertEqual(Contest.current_for(self.topic, self.user), contest)
+
+    def test_fill_command(self):
+        Contest.create_random(self.topic, self.user)
+        call_command('fill_contest_queues', size=3, stdout=StringIO())
+        self.assertEqual(Contest.queued(self.topic.id, self.user.id).count(),
+                         3)
+
+
+class EloTestCase(TestCase):
+    def test_matches_pairwise_loop(self):
+        # The original Elo update, one pair of contestants at a time
+        def pairwise_deltas(scores, winner, k_factor):
+            deltas = [0] * len(scores)
+            for i, j in itertools.permutations(range(len(scores)), 2):
+                expected = 1.0 / (1 + pow(10, (scores[j] - scores[i]) / 400.0))
+                deltas[i] += k_factor * ((1 if i == winner else 0) - expected)
+            return deltas
+
+        scores = [1000, 1100, 950, 1320]
+        for winner in range(len(scores)):
+            deltas = elo.contest_deltas(
+                scores, elo.winner_results(len(scores), winner), 24)
+            for actual, expected in zip(deltas,
+                                        pairwise_deltas(scores, winner, 24)):
+                self.assertAlmostEqual(actual, expected)
+
+    def test_draw(self):
+        deltas = elo.contest_deltas([1100, 1000], [0.5, 0.5])
+        self.assertAlmostEqual(deltas[0], -deltas[1])
+        self.assertLess(deltas[0], 0)
+        self.assertEqual(list(elo.contest_deltas([1000, 1000], [0.5, 0.5])),
+                         [0, 0])
+
+    def test_k_decay(self):
+        deltas = elo.contest_deltas([1000, 1000], [1, 0], 16,
+                                    games=[0, 10], decay=10)
+        self.assertEqual(list(deltas), [8, -4])
+
+    def test_replay(self):
+        scores = numpy.array([1000.0, 1000.0, 1000.0])
+        games = numpy.zeros(3)
+        elo.replay(scores, games, [([0, 1], [1, 0]), ([1, 2], [0, 1])])
+        # The second contest starts from the scores left by the first
+        second = 16 * (1 - 1.0 / (1 + pow(10, -8 / 400.0)))
+        self.assertEqual(list(scores), [1008, 992 - second, 1000 + second])
+        self.assertEqual(list(games), [1, 2, 1])
+
+
+class TopicEloSettingsTestCase(ContestTestCase):
+    def test_topic_k_factor(self):
+        self.topic.elo_k_factor = 32
+        self.topic.elo_k_decay = 1
+        self.topic.save()
+
+        for expected in [16, 8]:
+            contest = Contest.create_random(self.topic, self.user)
+            winner = contest.contestants.get(topicoption=self.red_map)
+            deltas = contest.set_winner(winner)
+            self.assertAlmostEqual(deltas[winner.id], expected, delta=1)
+        winner.refresh_from_db()
+        self.assertEqual(winner.games, 2)
@@ -0,0 +1,116 @@
+from django.contrib.auth.models import User
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from categorizer import db
+from categorizer.models import Topic, Option, TopicOption, OptionRanking
+
+
+class ReplicaRouterTestCase(TestCase):
+    def setUp(self):
+        self.router = db.ReplicaRouter()
+
+    def test_default(self):
+        with db.replica_reads():
+            self.assertIsNone(self.router.db_for_read(Topic))
+        self.assertEqual(self.router.db_for_write(Topic), 'default')
+        self.assertTrue(self.router.allow_migrate('replica', 'categorizer'))
+
+    @override_settings(DATABASE_REPLICAS=['replica'])
+    def test_replica_reads(self):
+        self.assertIsNone(self.router.db_for_read(Topic))
+        with db.replica_reads():
+            # Test cases run in a transaction, like a view that writes
+            self.assertIsNone(self.router.db_for_read(Topic))
+
+        self.assertFalse(self.router.allow_migrate('replica', 'categorizer'))
+        self.assertTrue(self.router.allow_migrate('default', 'categorizer'))
+
+
+@override_settings(DATABASE_REPLICAS=['replica'])
+class ReplicaViewsTestCase(TransactionTestCase):
+    multi_db = True
+
+    def setUp(self):
+        default = connections['default']
+        if default.is_in_memory_db(default.settings_dict['NAME']):
+            # Each connection to an in-memory SQLite database opens a new
+            # database, so have the replica alias share the default one
+            default.ensure_connection()
+            connections['replica'].connection = default.connection
+            self.addCleanup(setattr, connections['replica'], 'connection',
+                            None)
+
+        self.user = User.objects.create_user('user')
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.user)
+
+        self.topic = Topic.objects.create(label='Favorite color')
+        for label, score in [('Blue', 1000), ('Red', 1100)]:
+            topicoption = TopicOption.objects.create(
+                topic=self.topic, option=Option.objects.create(label=label))
+            OptionRanking.objects.create(topicoption=topicoption,
+                                         user=self.user, score=score)
+
+    def replica_queries(self, url):
+        with CaptureQueriesContext(connections['replica']) as queries:
+            response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        return response, len(queries)
+
+    def test_rankings(self):
+        url = reverse('ranker-topics-rankings',
+                      kwargs={'topic_id': self.topic.id})
+        response, queries = self.replica_queries(url)
+        self.assertEqual([option['label'] for option in response.json()],
+                         ['Red', 'Blue'])
+        self.assertGreater(queries, 0)
+
+    def test_rankings_computed_on_primary(self):
+        # Orderings are cached, so a cache miss doesn't read the rankings
+        # from a replica
+        url = reverse('ranker-topics-rankings',
+                      kwargs={'topic_id': self.topic.id})
+        with CaptureQueriesContext(connections['replica']) as queries:
+            self.assertEqual(self.client.get(url).status_code, 200)
+        self.assertFalse([query for query in queries
+                          if 'categorizer_optionranking' in query['sql']])
+
+    def test_option_list(self):
+        response, queries = self.replica_queries(
+            reverse('ranker-options-list'))
+        self.assertEqual(len(response.json()['results']), 2)
+        self.assertGreater(queries, 0)
+
+    def test_writes(self):
+        url = reverse('ranker-topics-contest',
+                      kwargs={'topic_id': self.topic.id})
+        response, queries = self.replica_queries(url)
+        self.assertEqual(queries, 0)
+
+
+class ConnectionTestCase(TestCase):
+    def test_sqlite_pragmas(self):
+        if connection.vendor != 'sqlite':
+            self.skipTest('SQLite only')
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA synchronous')
+            # NORMAL
+            self.assertEqual(cursor.fetchone()[0], 1)
+
+    def test_close_unusable_connections(self):
+        connection.ensure_connection()
+        connection.settings_dict['CONN_HEALTH_CHECKS'] = True
+        connection.is_usable = lambda: False
+        closed = []
+        connection.close = lambda: closed.append(connection.alias)
+        try:
+            db.close_unusable_connections()
+        finally:
+            del connection.settings_dict['CONN_HEALTH_CHECKS']
+            del connection.is_usable
+            del connection.close
+        self.assertEqual(closed, ['default'])
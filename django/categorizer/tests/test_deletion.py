@@ -0,0 +1,85 @@
+import random
+
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+
+from categorizer.deletion import delete_rankings, delete_topic_options
+from categorizer.models import (Contest, Option, OptionRanking,
+                                TopicOption)
+from categorizer.tests.test_tallies import TallyTestCase
+
+
+class DeletionTestCase(TallyTestCase):
+    def setUp(self):
+        super(DeletionTestCase, self).setUp()
+        rng = random.Random(13)
+        for _ in range(20):
+            contest = Contest.create_random(self.topic, rng.choice(self.users))
+            contest.set_winner(rng.choice(list(contest.contestants.all())))
+        for user in self.users:
+            Contest.create_random(self.topic, user)
+
+    def test_delete_rankings(self):
+        rankings = OptionRanking.objects.filter(user=self.users[0])
+        count = rankings.count()
+        contests = Contest.objects.filter(user=self.users[0]).count()
+
+        total, counts = delete_rankings(rankings)
+        self.assertEqual(counts['categorizer.OptionRanking'], count)
+        self.assertEqual(counts['categorizer.Contest'], contests)
+        self.assertEqual(total, sum(counts.values()))
+        self.assertFalse(Contest.objects.filter(user=self.users[0]).exists())
+
+        self.assertTalliesMatch()
+        self.assertAggregatesMatch()
+
+    def test_delete_topic_options(self):
+        topicoptions = TopicOption.objects.filter(
+            id__in=[self.topicoptions[0].id, self.topicoptions[2].id])
+        rankings = OptionRanking.objects.filter(
+            topicoption__in=topicoptions).count()
+
+        total, counts = delete_topic_options(topicoptions)
+        self.assertEqual(counts['categorizer.TopicOption'], 2)
+        self.assertEqual(counts['categorizer.OptionRanking'], rankings)
+        self.assertEqual(counts['categorizer.OptionAggregate'], 2)
+        self.assertFalse(Contest.objects.filter(
+            contestants__topicoption__in=self.topicoptions[0:3:2]).exists())
+
+        self.assertTalliesMatch()
+        self.assertAggregatesMatch()
+
+    def decide(self, topicoption, other, count):
+        # Decides count contests between the two options, alternating users
+        for n in range(count):
+            user = self.users[n % len(self.users)]
+            rankings = [OptionRanking.objects.get_or_create(
+                topicoption=t, user=user)[0] for t in (topicoption, other)]
+            contest = Contest.objects.create(topic=self.topic, user=user,
+                                             current=None)
+            contest.contestants.add(*rankings)
+            contest.set_winner(rankings[n % 2])
+
+    def deletion_queries(self, topicoption):
+        with CaptureQueriesContext(connection) as queries:
+            delete_topic_options(
+                TopicOption.objects.filter(id=topicoption.id))
+        return len(queries)
+
+    def test_queries_independent_of_rows(self):
+        # Removing an option costs the same number of queries however many
+        # rankings and contests it has
+        small, large = [
+            TopicOption.objects.create(
+                topic=self.topic, option=Option.objects.create(label=label))
+            for label in ['Small', 'Large']]
+        self.decide(small, self.topicoptions[0], 1)
+        self.decide(large, self.topicoptions[0], 12)
+        self.assertEqual(self.deletion_queries(large),
+                         self.deletion_queries(small))
+
+    def test_nothing_to_delete(self):
+        self.assertEqual(delete_topic_options(TopicOption.objects.none()),
+                         (0, {}))
+        self.assertEqual(delete_rankings(OptionRanking.objects.none()),
+                         (0, {}))
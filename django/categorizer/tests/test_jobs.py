@@ -0,0 +1,207 @@
+import logging
+import random
+
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import transaction
+from django.test import TransactionTestCase
+from django.urls import reverse
+from django.utils.six import StringIO
+from rest_framework.test import APIClient
+
+from categorizer import jobs, matchups
+from categorizer.deletion import delete_rankings
+from categorizer.models import (Option, TopicOption, Contest, OptionRanking,
+                                RankingJob, TopicRankingSnapshot)
+from categorizer.tests.test_tallies import TallyTestMixin
+
+
+class JobTestCase(TallyTestMixin, TransactionTestCase):
+    # Topics are queued once each transaction commits
+    def setUp(self):
+        super(JobTestCase, self).setUp()
+        cache.clear()
+        matchups._candidates.entries.clear()
+
+    def decide_contests(self, count, seed=0):
+        rng = random.Random(seed)
+        for _ in range(count):
+            contest = Contest.create_random(self.topic, rng.choice(self.users))
+            contest.set_winner(rng.choice(list(contest.contestants.all())))
+
+
+class _ListHandler(logging.Handler):
+    def __init__(self):
+        logging.Handler.__init__(self)
+        self.records = []
+
+    def emit(self, record):
+        self.records.append(record)
+
+
+class RankingJobTestCase(JobTestCase):
+    def test_mark_dirty(self):
+        self.assertFalse(RankingJob.objects.exists())
+        self.decide_contests(3)
+        self.assertEqual(
+            list(RankingJob.objects.values_list('topic_id', flat=True)),
+            [self.topic.id])
+
+        contest = Contest.create_random(self.topic, self.users[0])
+        winner = contest.contestants.all()[0].topicoption.option_id
+        requested_at = RankingJob.objects.get().requested_at
+        self.assertEqual(Contest.set_winners(self.topic, self.users[0],
+                                             [(contest.id, winner)]),
+                         [None])
+        self.assertGreater(RankingJob.objects.get().requested_at,
+                           requested_at)
+
+    def test_mark_dirty_on_commit(self):
+        # Concurrent votes don't wait on the job's row lock
+        with transaction.atomic():
+            RankingJob.objects.mark_dirty(self.topic.id)
+            self.assertFalse(RankingJob.objects.exists())
+        self.assertTrue(RankingJob.objects.exists())
+
+    def test_mark_dirty_rankings(self):
+        # Creating a user's rankings changes their ballot
+        OptionRanking.objects.ensure(self.topic.id, self.users[0].id,
+                                     [self.topicoptions[0].id])
+        self.assertTrue(RankingJob.objects.filter(topic=self.topic).exists())
+
+        RankingJob.objects.all().delete()
+        ranking = OptionRanking.objects.get()
+        ranking.score += 10
+        ranking.save()
+        self.assertTrue(RankingJob.objects.filter(topic=self.topic).exists())
+
+    def test_rankings_deleted(self):
+        self.decide_contests(3)
+        jobs.run_jobs()
+        self.assertTrue(self.topic.ranking_snapshots.exists())
+        OptionRanking.objects.filter(user=self.users[1]).delete()
+        self.assertFalse(self.topic.ranking_snapshots.exists())
+
+        RankingJob.objects.mark_dirty(self.topic.id)
+        jobs.run_jobs()
+        self.assertTrue(self.topic.ranking_snapshots.exists())
+        delete_rankings(OptionRanking.objects.filter(user=self.users[2]))
+        self.assertFalse(self.topic.ranking_snapshots.exists())
+
+    def test_claim(self):
+        self.decide_contests(1)
+        job = RankingJob.objects.get()
+        self.assertEqual(RankingJob.objects.claim(10, 600),
+                         [(self.topic.id, job.requested_at)])
+        self.assertEqual(RankingJob.objects.claim(10, 600), [])
+
+        # An abandoned claim is retried
+        self.assertEqual(RankingJob.objects.claim(10, 0),
+                         [(self.topic.id, job.requested_at)])
+
+    def test_finish(self):
+        self.decide_contests(1)
+        [(topic_id, requested_at)] = RankingJob.objects.claim(10, 600)
+        RankingJob.objects.finish(topic_id, requested_at)
+        self.assertFalse(RankingJob.objects.exists())
+
+    def test_finish_changed(self):
+        self.decide_contests(1)
+        [(topic_id, requested_at)] = RankingJob.objects.claim(10, 600)
+
+        # Decided while the worker was computing the rankings
+        self.decide_contests(1, seed=1)
+        RankingJob.objects.finish(topic_id, requested_at)
+        self.assertIsNone(RankingJob.objects.get().claimed_at)
+
+    def test_run_jobs(self):
+        self.decide_contests(10)
+        self.assertEqual(jobs.run_jobs(), (1, 1))
+        self.assertFalse(RankingJob.objects.exists())
+
+        snapshots = {snapshot.method: snapshot.ranked_option_ids()
+                     for snapshot in self.topic.ranking_snapshots.all()}
+        self.assertEqual(
+            snapshots,
+            {method: list(self.topic.ranked_option_ids(method))
+             for method in self.topic.RANKING_METHODS})
+
+        self.assertEqual(jobs.run_jobs(), (0, 0))
+
+    def test_run_jobs_failure(self):
+        self.decide_contests(1)
+        handler = _ListHandler()
+        logger = logging.getLogger('categorizer.jobs')
+        logger.addHandler(handler)
+        try:
+            with self.settings(RANKING_SNAPSHOT_METHODS=['unknown']):
+                self.assertEqual(jobs.run_jobs(), (1, 0))
+        finally:
+            logger.removeHandler(handler)
+        self.assertIsNotNone(RankingJob.objects.get().claimed_at)
+
+        [record] = handler.records
+        self.assertEqual(record.levelno, logging.ERROR)
+        self.assertEqual(record.getMessage(),
+                         'Failed to compute rankings for topic {}'
+                         .format(self.topic.id))
+        self.assertIsNotNone(record.exc_info)
+
+    def test_command(self):
+        self.decide_contests(2)
+        out = StringIO()
+        call_command('process_ranking_jobs', '--processes', '0', '--once',
+                     stdout=out)
+        self.assertIn('Computed rankings for 1 of 1 topics', out.getvalue())
+        self.assertEqual(self.topic.ranking_snapshots.count(),
+                         len(self.topic.RANKING_METHODS))
+
+    def test_options_changed(self):
+        self.decide_contests(2)
+        jobs.run_jobs()
+
+        option = Option.objects.create(label='Orange')
+        TopicOption.objects.create(topic=self.topic, option=option)
+        self.assertFalse(self.topic.ranking_snapshots.exists())
+
+        jobs.run_jobs()
+        TopicOption.objects.add_options(
+            self.topic, [Option.objects.create(label='Pink').id])
+        self.assertFalse(self.topic.ranking_snapshots.exists())
+
+        jobs.run_jobs()
+        TopicOption.objects.remove_options(self.topic, [option.id])
+        self.assertFalse(self.topic.ranking_snapshots.exists())
+
+
+class SnapshotViewTestCase(JobTestCase):
+    def setUp(self):
+        super(SnapshotViewTestCase, self).setUp()
+        self.client = APIClient()
+        self.client.force_authenticate(user=self.users[0])
+        self.url = reverse('ranker-topics-rankings',
+                           kwargs={'topic_id': self.topic.id})
+
+    def test_without_snapshot(self):
+        self.decide_contests(5)
+        response = self.client.get(self.url, {'count': 3})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()), 3)
+        self.assertNotIn('X-Rankings-Age', response)
+
+    def test_snapshot(self):
+        TopicRankingSnapshot.objects.store(
+            self.topic.id, 'schulze',
+            [topicoption.option_id for topicoption in self.topicoptions])
+
+        response = self.client.get(self.url,
+                                   {'method': 'schulze', 'count': 2})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([option['id'] for option in response.json()],
+                         [topicoption.option_id
+                          for topicoption in self.topicoptions[:2]])
+        self.assertEqual(response['X-Rankings-Age'], '0')
+
+        # Other methods are still computed inline
+        response = self.client.get(self.url, {'method': 'copeland'})
+        self.assertNotIn('X-Rankings-Age', response)
@@ -0,0 +1,97 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase
+
+from categorizer import matchups
+from categorizer.models import (Topic, Option, TopicOption, Contest,
+                                OptionRanking)
+
+
+class MatchupTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+        matchups._candidates.entries.clear()
+
+        self.user = User.objects.create_user('user')
+        self.topic = Topic.objects.create(label='Favorite color')
+        self.topicoptions = [
+            TopicOption.objects.create(
+                topic=self.topic,
+                option=Option.objects.create(label='Option {}'.format(i)))
+            for i in range(6)
+        ]
+        self.ids = [topicoption.id for topicoption in self.topicoptions]
+
+    def rank(self, index, score, comparisons=0):
+        return OptionRanking.objects.create(
+            topicoption=self.topicoptions[index], user=self.user, score=score,
+            games=comparisons)
+
+    def choose_pair(self, strategy):
+        self.topic.pairing_strategy = strategy
+        return matchups.choose_pair(self.topic, self.user,
+                                    rng=random.Random(3))
+
+    def test_strategies_pick_two_options(self):
+        for strategy in matchups.STRATEGIES:
+            for _ in range(20):
+                first, second = self.choose_pair(strategy)
+                self.assertNotEqual(first, second)
+                self.assertIn(first, self.ids)
+                self.assertIn(second, self.ids)
+
+    def test_least_compared(self):
+        for i in range(4):
+            self.rank(i, 1000, comparisons=i + 1)
+        self.assertItemsEqual(self.choose_pair('least-compared'),
+                              self.ids[4:])
+
+    def test_closest_elo(self):
+        for i, score in enumerate([1000, 1200, 1400, 1210, 800, 600]):
+            self.rank(i, score)
+        first, second = self.choose_pair('closest-elo')
+        closest = {self.ids[1]: self.ids[3], self.ids[3]: self.ids[1]}
+        if first in closest:
+            self.assertEqual(second, closest[first])
+
+    def test_uncertainty(self):
+        for i, score in enumerate([1000, 1300, 1400, 900, 1100]):
+            self.rank(i, score, comparisons=5)
+        # The only uncompared option is matched with an option of equal
+        # score, which has the least predictable result
+        self.assertItemsEqual(self.choose_pair('uncertainty'),
+                              [self.ids[5], self.ids[0]])
+
+    def test_cached_candidates(self):
+        matchups.choose_pair(self.topic, self.user)
+        # Only the version counters are read once the candidates are loaded
+        with self.assertNumQueries(0):
+            matchups.choose_pair(self.topic, self.user)
+
+        third = Option.objects.create(label='Added')
+        added = TopicOption.objects.create(topic=self.topic, option=third)
+        candidates = matchups._candidates.get(self.topic.id, self.user)
+        self.assertIn(added.id, candidates.topicoption_ids)
+
+    def test_contest_updates_candidates(self):
+        self.topic.pairing_strategy = 'least-compared'
+        self.topic.save()
+        matchups.choose_pair(self.topic, self.user)
+
+        contest = Contest.create_random(self.topic, self.user)
+        winner = contest.contestants.all()[0]
+        contest.set_winner(winner)
+
+        with self.assertNumQueries(0):
+            candidates = matchups._candidates.get(self.topic.id, self.user)
+        index = candidates.index[winner.topicoption_id]
+        self.assertEqual(candidates.scores[index], 1008)
+        self.assertEqual(candidates.comparisons.sum(), 2)
+
+        # The least compared strategy moves on to options not yet compared
+        contest = Contest.create_random(self.topic, self.user)
+        for contestant in contest.contestants.all():
+            self.assertEqual(candidates.comparisons[
+                candidates.index[contestant.topicoption_id]], 0)
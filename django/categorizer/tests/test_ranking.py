@@ -1,7 +1,21 @@
+import multiprocessing
+import random
+
 from django.test import TestCase
+from categorizer import ranked_preference
 from categorizer.ranked_preference import (instant_runoff, pairwise_rankings,
                                            full_ranked_preference,
-                                           condorcet_winner)
+                                           condorcet_winner,
+                                           fast_pairwise_rankings,
+                                           pairwise_matrix, BallotStore,
+                                           condorcet_rankings,
+                                           schulze_rankings,
+                                           ranked_pairs_rankings,
+                                           fast_instant_runoff,
+                                           fast_full_ranked_preference,
+                                           score_rankings, top_rankings,
+                                           ballot_tallies, tally_processes,
+                                           MATRIX_METHODS)
 
 
 class RankedPreferenceTestCase(TestCase):
@@ -200,3 +214,300 @@ class PairwiseRankingsTestCase(RankedPreferenceTestCase):
         # In a circular loop, all candidates beat one and lose to the other
         winner = list(pairwise_rankings(self.candidates, self.circular_loop))
         self.assertEqual(winner, [set(['Red', 'Blue', 'Green']), 'Yellow'])
+
+
+class FastPairwiseRankingsTestCase(RankedPreferenceTestCase):
+    def assertMatchesPairwise(self, candidates, preferences):
+        self.assertEqual(list(fast_pairwise_rankings(candidates, preferences)),
+                         list(pairwise_rankings(candidates, preferences)))
+
+    def test_examples(self):
+        for election in [self.simple_election, self.tied_plurality,
+                         self.spoiler_effect, self.partisan_split,
+                         self.simple_tie, self.circular_loop,
+                         [self.candidates]]:
+            self.assertMatchesPairwise(self.candidates, election)
+
+    def test_single_pass(self):
+        # Ballots may be generators, which can only be read once
+        preferences = (iter(ballot) for ballot in self.partisan_split)
+        winners = list(fast_pairwise_rankings(self.candidates, preferences))
+        self.assertEqual(winners, ['Yellow', 'Red', 'Blue', 'Green'])
+
+    def test_unknown_and_repeated_votes(self):
+        preferences = [['Purple', 'Red', 'Blue', 'Red'], ['Blue', 'Blue']]
+        self.assertMatchesPairwise(self.candidates, preferences)
+
+    def test_no_candidates(self):
+        self.assertEqual(list(fast_pairwise_rankings([], [['Red']])), [])
+
+    def test_random_elections(self):
+        rng = random.Random(42)
+        candidates = range(12)
+        for _ in range(25):
+            preferences = [rng.sample(candidates, rng.randint(0, 12))
+                           for _ in range(rng.randint(1, 30))]
+            self.assertMatchesPairwise(candidates, preferences)
+
+    def test_pairwise_matrix(self):
+        matrix = pairwise_matrix(['Red', 'Blue', 'Green'],
+                                 [['Red', 'Blue'], ['Blue'], ['Green', 'Red']])
+        # Red: beats Blue twice, Green once
+        # Blue: beats Red once, Green twice
+        # Green: beats Red once, Blue once
+        self.assertEqual(matrix.tolist(), [[0, 2, 1],
+                                           [1, 0, 2],
+                                           [1, 1, 0]])
+
+
+class BallotStoreTestCase(RankedPreferenceTestCase):
+    def test_round_trip(self):
+        store = BallotStore(self.candidates)
+        for ballot in self.partisan_split:
+            store.add(ballot)
+        self.assertEqual(len(store), len(self.partisan_split))
+        self.assertEqual(list(store), self.partisan_split)
+        # A store can be read as many times as needed
+        self.assertEqual(list(store), self.partisan_split)
+
+    def test_unknown_and_repeated_votes(self):
+        store = BallotStore(self.candidates)
+        store.add(['Purple', 'Red', 'Blue', 'Red'])
+        store.add([])
+        store.add(iter(['Green']))
+        self.assertEqual(list(store), [['Red', 'Blue'], [], ['Green']])
+        self.assertEqual([p.tolist() for p in store.positions()],
+                         [[1, 0], [], [2]])
+
+    def test_rankings(self):
+        for election in [self.simple_election, self.spoiler_effect,
+                         self.circular_loop]:
+            store = BallotStore(self.candidates)
+            for ballot in election:
+                store.add(ballot)
+            self.assertEqual(
+                list(fast_pairwise_rankings(self.candidates, store)),
+                list(pairwise_rankings(self.candidates, election)))
+            self.assertEqual(list(pairwise_rankings(self.candidates, store)),
+                             list(pairwise_rankings(self.candidates,
+                                                    election)))
+
+
+class ParallelTallyTestCase(RankedPreferenceTestCase):
+    def random_store(self, candidates, ballots, seed=0):
+        rng = random.Random(seed)
+        store = BallotStore(candidates)
+        for _ in range(ballots):
+            store.add(rng.sample(candidates, rng.randint(0, len(candidates))))
+        return store
+
+    def assertTalliesEqual(self, first, second):
+        self.assertEqual([counts.tolist() for counts in first],
+                         [counts.tolist() for counts in second])
+
+    def test_matches_serial(self):
+        candidates = range(15)
+        store = self.random_store(candidates, 500)
+        serial = ballot_tallies(candidates, store, processes=0)
+        for processes in [1, 2, 3]:
+            self.assertTalliesEqual(
+                ballot_tallies(candidates, store, processes=processes),
+                serial)
+
+        # Other ballots are packed into a store first
+        self.assertTalliesEqual(
+            ballot_tallies(candidates, list(store), processes=2), serial)
+
+    def test_more_processes_than_ballots(self):
+        self.assertTalliesEqual(
+            ballot_tallies(self.candidates, self.partisan_split,
+                           processes=20),
+            ballot_tallies(self.candidates, self.partisan_split))
+
+    def test_small_chunks(self):
+        candidates = range(8)
+        store = self.random_store(candidates, 100, seed=1)
+        self.assertTalliesEqual(
+            ballot_tallies(candidates, store, chunk_size=10, processes=2),
+            ballot_tallies(candidates, store))
+
+    def test_thresholds(self):
+        self.assertEqual(tally_processes(10, 5), 0)
+        self.assertEqual(tally_processes(10 ** 7, 10 ** 4), 0)
+        cpus = multiprocessing.cpu_count()
+        self.assertEqual(tally_processes(10 ** 7, 10),
+                         min(cpus, 200) if cpus > 1 else 0)
+
+    def test_automatic(self):
+        candidates = range(6)
+        store = self.random_store(candidates, 50, seed=2)
+        serial = ballot_tallies(candidates, store, processes=0)
+
+        minimum = ranked_preference.PARALLEL_MIN_BALLOTS
+        shard = ranked_preference.PARALLEL_SHARD_BALLOTS
+        ranked_preference.PARALLEL_MIN_BALLOTS = 20
+        ranked_preference.PARALLEL_SHARD_BALLOTS = 10
+        try:
+            self.assertTalliesEqual(ballot_tallies(candidates, store),
+                                    serial)
+        finally:
+            ranked_preference.PARALLEL_MIN_BALLOTS = minimum
+            ranked_preference.PARALLEL_SHARD_BALLOTS = shard
+
+
+class MatrixMethodsTestCase(RankedPreferenceTestCase):
+    def setUp(self):
+        super(MatrixMethodsTestCase, self).setUp()
+        # Where to put the capital of Tennessee, with each city's voters
+        # preferring the closest cities
+        self.cities = ['Memphis', 'Nashville', 'Chattanooga', 'Knoxville']
+        self.tennessee = (
+            [['Memphis', 'Nashville', 'Chattanooga', 'Knoxville']] * 42 +
+            [['Nashville', 'Chattanooga', 'Knoxville', 'Memphis']] * 26 +
+            [['Chattanooga', 'Knoxville', 'Nashville', 'Memphis']] * 15 +
+            [['Knoxville', 'Chattanooga', 'Nashville', 'Memphis']] * 17)
+
+        # Schulze's own example, where the Schulze and Copeland orders differ
+        self.letters = ['A', 'B', 'C', 'D', 'E']
+        self.schulze_example = (
+            [list('ACBED')] * 5 + [list('ADECB')] * 5 +
+            [list('BEDAC')] * 8 + [list('CABED')] * 3 +
+            [list('CAEBD')] * 7 + [list('CBADE')] * 2 +
+            [list('DCEBA')] * 7 + [list('EBADC')] * 8)
+
+    def rank(self, method, candidates, preferences):
+        return list(method(candidates,
+                           pairwise_matrix(candidates, preferences)))
+
+    def test_condorcet(self):
+        for election in [self.simple_election, self.spoiler_effect,
+                         self.partisan_split, self.circular_loop]:
+            rankings = self.rank(condorcet_rankings, self.candidates,
+                                 election)
+            winner = condorcet_winner(self.candidates, election)
+            if winner is not None:
+                self.assertEqual(rankings[0], winner)
+        self.assertEqual(
+            self.rank(condorcet_rankings, self.cities, self.tennessee),
+            ['Nashville', 'Chattanooga', 'Knoxville', 'Memphis'])
+
+    def test_condorcet_cycle(self):
+        rankings = self.rank(condorcet_rankings, self.candidates,
+                             self.circular_loop)
+        self.assertEqual(rankings, list(pairwise_rankings(
+            self.candidates, self.circular_loop)))
+
+    def test_schulze(self):
+        self.assertEqual(
+            self.rank(schulze_rankings, self.letters, self.schulze_example),
+            ['E', 'A', 'C', 'B', 'D'])
+        self.assertEqual(
+            self.rank(schulze_rankings, self.cities, self.tennessee),
+            ['Nashville', 'Chattanooga', 'Knoxville', 'Memphis'])
+
+    def test_ranked_pairs(self):
+        self.assertEqual(
+            self.rank(ranked_pairs_rankings, self.letters,
+                      self.schulze_example),
+            ['A', 'C', 'E', 'B', 'D'])
+        self.assertEqual(
+            self.rank(ranked_pairs_rankings, self.cities, self.tennessee),
+            ['Nashville', 'Chattanooga', 'Knoxville', 'Memphis'])
+
+    def test_tie(self):
+        for method in [condorcet_rankings, schulze_rankings,
+                       ranked_pairs_rankings]:
+            self.assertEqual(
+                self.rank(method, self.candidates, self.simple_tie),
+                list(pairwise_rankings(self.candidates, self.simple_tie)))
+
+    def test_condorcet_winner_first(self):
+        rng = random.Random(3)
+        candidates = range(8)
+        for _ in range(25):
+            preferences = [rng.sample(candidates, rng.randint(1, 8))
+                           for _ in range(rng.randint(1, 30))]
+            winner = condorcet_winner(candidates, preferences)
+            if winner is None:
+                continue
+            for method in [condorcet_rankings, schulze_rankings,
+                           ranked_pairs_rankings]:
+                self.assertEqual(
+                    self.rank(method, candidates, preferences)[0], winner)
+
+
+class FastInstantRunoffTestCase(RankedPreferenceTestCase):
+    def elections(self):
+        return [self.simple_election, self.tied_plurality,
+                self.spoiler_effect, self.partisan_split, self.simple_tie,
+                self.circular_loop, [self.candidates]]
+
+    def test_examples(self):
+        for election in self.elections():
+            self.assertEqual(
+                fast_instant_runoff(self.candidates, election),
+                instant_runoff(self.candidates, election))
+            self.assertEqual(
+                list(fast_full_ranked_preference(self.candidates, election)),
+                list(full_ranked_preference(self.candidates, election)))
+
+    def test_ballot_store(self):
+        store = BallotStore(self.candidates)
+        for ballot in self.partisan_split:
+            store.add(ballot)
+        self.assertEqual(list(fast_full_ranked_preference(self.candidates,
+                                                          store)),
+                         ['Yellow', 'Red', 'Blue', 'Green'])
+
+    def test_no_votes(self):
+        with self.assertRaises(AssertionError):
+            fast_instant_runoff(self.candidates, [[], ['Purple']])
+        self.assertEqual(
+            list(fast_full_ranked_preference(self.candidates, [])), [])
+        self.assertIsNone(fast_instant_runoff([], [['Red']]))
+
+    def test_random_elections(self):
+        rng = random.Random(11)
+        candidates = range(9)
+        for _ in range(100):
+            preferences = [rng.sample(candidates, rng.randint(0, 9))
+                           for _ in range(rng.randint(1, 25))]
+            self.assertEqual(
+                list(fast_full_ranked_preference(candidates, preferences)),
+                list(full_ranked_preference(candidates, preferences)))
+
+
+class TopRankingsTestCase(RankedPreferenceTestCase):
+    def test_top_rankings(self):
+        rankings = ['Red', set(['Blue', 'Green']), 'Yellow']
+        self.assertEqual(list(top_rankings(rankings, 1)), ['Red'])
+        self.assertEqual(list(top_rankings(rankings, 2)), rankings[:2])
+        self.assertEqual(list(top_rankings(rankings, 3)), rankings[:2])
+        self.assertEqual(list(top_rankings(rankings, 4)), rankings)
+        self.assertEqual(list(top_rankings(rankings)), rankings)
+        self.assertEqual(list(top_rankings(rankings, 0)), [])
+
+    def test_score_rankings(self):
+        rng = random.Random(5)
+        candidates = range(40)
+        for _ in range(50):
+            scores = [rng.randint(0, 10) for _ in candidates]
+            rankings = list(score_rankings(candidates, scores))
+            for limit in [0, 1, 3, 10, 39, 40, 100]:
+                self.assertEqual(
+                    list(score_rankings(candidates, scores, limit)),
+                    list(top_rankings(rankings, limit)))
+
+    def test_matrix_methods(self):
+        rng = random.Random(7)
+        candidates = range(8)
+        for _ in range(25):
+            preferences = [rng.sample(candidates, rng.randint(1, 8))
+                           for _ in range(rng.randint(1, 30))]
+            matrix = pairwise_matrix(candidates, preferences)
+            for method in MATRIX_METHODS.values():
+                rankings = list(method(candidates, matrix))
+                for limit in [1, 2, 5]:
+                    self.assertEqual(
+                        list(method(candidates, matrix, limit)),
+                        list(top_rankings(rankings, limit)))
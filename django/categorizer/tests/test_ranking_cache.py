@@ -0,0 +1,148 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APIClient
+
+from categorizer import ranking_cache
+from categorizer.models import (Topic, Option, TopicOption, Contest,
+                                OptionRanking)
+
+
+class RankingCacheTestCase(TestCase):
+    def setUp(self):
+        cache.clear()
+
+        self.topic = Topic.objects.create(label='Favorite color')
+        self.user = User.objects.create_user('user')
+        self.rankings = {}
+        for label, score in [('Blue', 1100), ('Red', 1000)]:
+            option = Option.objects.create(label=label)
+            topicoption = TopicOption.objects.create(topic=self.topic,
+                                                     option=option)
+            self.rankings[label] = OptionRanking.objects.create(
+                topicoption=topicoption, user=self.user, score=score)
+        self.blue = self.rankings['Blue'].topicoption.option_id
+        self.red = self.rankings['Red'].topicoption.option_id
+
+    def reverse_tallies(self):
+        # Edits the tallies directly, which bypasses invalidation
+        self.topic.tallies.update(wins_a=0, wins_b=1)
+
+    def test_cached(self):
+        self.assertEqual(ranking_cache.get_ranked_option_ids(self.topic),
+                         [self.blue, self.red])
+
+        self.reverse_tallies()
+        self.assertEqual(ranking_cache.get_ranked_option_ids(self.topic),
+                         [self.blue, self.red])
+
+        ranking_cache.invalidate_rankings(self.topic.id)
+        self.assertEqual(ranking_cache.get_ranked_option_ids(self.topic),
+                         [self.red, self.blue])
+
+    def test_methods_cached_separately(self):
+        self.assertEqual(ranking_cache.get_ranked_option_ids(self.topic),
+                         [self.blue, self.red])
+
+        # The mean scores don't depend on the tallies
+        self.reverse_tallies()
+        self.assertEqual(
+            ranking_cache.get_ranked_option_ids(self.topic, 'elo-mean'),
+            [self.blue, self.red])
+        self.assertEqual(
+            ranking_cache.get_ranked_option_ids(self.topic, 'schulze'),
+            [self.red, self.blue])
+        self.assertEqual(ranking_cache.get_ranked_option_ids(self.topic),
+                         [self.blue, self.red])
+
+    def test_partial_orderings(self):
+        self.assertEqual(
+            ranking_cache.get_ranked_option_ids(self.topic, count=1),
+            [self.blue])
+
+        # Smaller counts are served from the partial ordering, but larger
+        # ones need the ranking to be recomputed
+        self.reverse_tallies()
+        self.assertEqual(
+            ranking_cache.get_ranked_option_ids(self.topic, count=1),
+            [self.blue])
+        self.assertEqual(
+            ranking_cache.get_ranked_option_ids(self.topic, count=2),
+            [self.red, self.blue])
+        self.assertEqual(
+            ranking_cache.get_ranked_option_ids(self.topic, count=1),
+            [self.red, self.blue])
+
+    def test_set_winner_invalidates(self):
+        contest = Contest.objects.create(topic=self.topic, user=self.user)
+        contest.contestants = self.rankings.values()
+        self.rankings['Red'].score = 1090
+        self.rankings['Red'].save()
+
+        self.assertEqual(ranking_cache.get_ranked_option_ids(self.topic),
+                         [self.blue, self.red])
+        contest.set_winner(self.rankings['Red'])
+        self.assertEqual(ranking_cache.get_ranked_option_ids(self.topic),
+                         [self.red, self.blue])
+
+    def test_ranking_delete_invalidates(self):
+        ranking_cache.get_ranked_option_ids(self.topic)
+        self.rankings['Blue'].delete()
+        self.assertEqual(ranking_cache.get_ranked_option_ids(self.topic),
+                         [self.red, self.blue])
+
+    @override_settings(RANKINGS_STALE_WHILE_REVALIDATE=True)
+    def test_stale_while_revalidate(self):
+        scheduled = []
+        schedule_refresh = ranking_cache._schedule_refresh
+        ranking_cache._schedule_refresh = (
+            lambda topic, method, version, count: scheduled.append(version))
+        try:
+            version = ranking_cache.ranking_version(self.topic.id)
+            ranking_cache.get_ranked_option_ids(self.topic)
+
+            self.reverse_tallies()
+            ranking_cache.invalidate_rankings(self.topic.id)
+
+            # The stale ordering is served while it is refreshed
+            self.assertEqual(
+                ranking_cache.get_ranked_option_ids(self.topic),
+                [self.blue, self.red])
+            self.assertEqual(scheduled, [version + 1])
+        finally:
+            ranking_cache._schedule_refresh = schedule_refresh
+
+        ranking_cache._store_rankings(self.topic, 'copeland', version + 1)
+        self.assertEqual(ranking_cache.get_ranked_option_ids(self.topic),
+                         [self.red, self.blue])
+
+    @override_settings(RANKINGS_STALE_WHILE_REVALIDATE=True)
+    def test_stale_ordering_with_deleted_option(self):
+        green = Option.objects.create(label='Green')
+        TopicOption.objects.create(topic=self.topic, option=green)
+        client = APIClient()
+        client.force_authenticate(user=self.user)
+        url = reverse('ranker-topics-rankings',
+                      kwargs={'topic_id': self.topic.id})
+
+        schedule_refresh = ranking_cache._schedule_refresh
+        ranking_cache._schedule_refresh = lambda *args: None
+        try:
+            response = client.get(url)
+            self.assertEqual([option['id'] for option in response.json()],
+                             [self.blue, self.red, green.id])
+
+            # Nobody ranked it, so deleting it only cascades to its
+            # TopicOption. The stale ordering still lists it.
+            green_id = green.id
+            green.delete()
+            self.assertEqual(ranking_cache.get_ranked_option_ids(self.topic),
+                             [self.blue, self.red, green_id])
+
+            response = client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([option['id'] for option in response.json()],
+                             [self.blue, self.red])
+        finally:
+            ranking_cache._schedule_refresh = schedule_refresh
@@ -0,0 +1,280 @@
+import random
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.core.management.base import CommandError
+from django.test import TestCase
+from django.utils.six import StringIO
+
+from categorizer.models import (Topic, Option, TopicOption, Contest,
+                                OptionRanking, PairwiseTally, OptionAggregate)
+from categorizer.ranked_preference import pairwise_matrix
+
+
+class TallyTestMixin(object):
+    def setUp(self):
+        self.topic = Topic.objects.create(label='Favorite color')
+        self.topicoptions = [
+            TopicOption.objects.create(
+                topic=self.topic,
+                option=Option.objects.create(label=label))
+            for label in ['Blue', 'Red', 'Green', 'Yellow', 'Purple']
+        ]
+        self.users = [User.objects.create_user(name, password='password')
+                      for name in ['first', 'second', 'third']]
+
+    def assertTalliesMatch(self):
+        topicoption_ids = list(self.topic.topicoption.order_by('id')
+                               .values_list('id', flat=True))
+        stored = PairwiseTally.objects.matrix(self.topic, topicoption_ids)
+        counted = pairwise_matrix(topicoption_ids, self.topic.ballots())
+        self.assertEqual(stored.tolist(), counted.tolist())
+
+    def stored_aggregates(self):
+        return {aggregate.topicoption_id: (round(aggregate.mean_score, 6),
+                                           aggregate.votes, aggregate.wins,
+                                           aggregate.losses)
+                for aggregate in OptionAggregate.objects.filter(
+                    topic=self.topic)}
+
+    def assertAggregatesMatch(self):
+        expected = {}
+        for topicoption in self.topic.topicoption.all():
+            scores = [ranking.score for ranking in
+                      topicoption.rankings.filter(user__isnull=False)]
+            contests = Contest.objects.filter(
+                contestants__topicoption=topicoption, winner__isnull=False)
+            wins = contests.filter(winner__topicoption=topicoption).count()
+            expected[topicoption.id] = (
+                round(sum(scores) / len(scores), 6) if scores else 1000,
+                len(scores), wins, contests.count() - wins)
+        self.assertEqual(self.stored_aggregates(), expected)
+
+
+class TallyTestCase(TallyTestMixin, TestCase):
+    pass
+
+
+class PairwiseTallyTestCase(TallyTestCase):
+    def test_contests(self):
+        rng = random.Random(7)
+        for _ in range(30):
+            user = rng.choice(self.users)
+            contest = Contest.create_random(self.topic, user)
+            contest.set_winner(rng.choice(list(contest.contestants.all())))
+            self.assertTalliesMatch()
+
+    def test_score_change(self):
+        first = OptionRanking.objects.create(
+            topicoption=self.topicoptions[0], user=self.users[0])
+        second = OptionRanking.objects.create(
+            topicoption=self.topicoptions[1], user=self.users[0])
+        self.assertTalliesMatch()
+
+        first.score = 900
+        first.save()
+        self.assertTalliesMatch()
+
+        second.user = self.users[1]
+        second.save()
+        self.assertTalliesMatch()
+
+    def test_ranking_delete(self):
+        for topicoption in self.topicoptions:
+            OptionRanking.objects.create(topicoption=topicoption,
+                                         user=self.users[0],
+                                         score=topicoption.id)
+        OptionRanking.objects.filter(
+            topicoption=self.topicoptions[2]).delete()
+        self.assertTalliesMatch()
+
+        self.topicoptions[3].delete()
+        self.assertTalliesMatch()
+
+    def test_remove_options(self):
+        rng = random.Random(9)
+        for _ in range(15):
+            contest = Contest.create_random(self.topic, rng.choice(self.users))
+            contest.set_winner(rng.choice(list(contest.contestants.all())))
+
+        self.assertEqual(TopicOption.objects.remove_options(
+            self.topic, [self.topicoptions[1].option_id,
+                         self.topicoptions[3].option_id]), 2)
+        self.assertTalliesMatch()
+
+    def test_rankings_read_tallies(self):
+        for user in self.users:
+            OptionRanking.objects.create(topicoption=self.topicoptions[1],
+                                         user=user, score=1100)
+        OptionRanking.objects.create(topicoption=self.topicoptions[0],
+                                     user=self.users[0], score=1200)
+
+        top_options = self.topic.calculate_top_options(2)
+        self.assertEqual(top_options, [self.topicoptions[1].option,
+                                       self.topicoptions[0].option])
+
+
+class OptionAggregateTestCase(TallyTestCase):
+    def test_contests(self):
+        rng = random.Random(3)
+        for _ in range(20):
+            user = rng.choice(self.users)
+            contest = Contest.create_random(self.topic, user)
+            contest.set_winner(rng.choice(list(contest.contestants.all())))
+            self.assertAggregatesMatch()
+
+    def test_set_winners(self):
+        rng = random.Random(4)
+        for _ in range(5):
+            for user in self.users:
+                contest = Contest.create_random(self.topic, user)
+                option_ids = list(contest.contestants.values_list(
+                    'topicoption__option_id', flat=True))
+                Contest.set_winners(self.topic, user,
+                                    [(contest.id, rng.choice(option_ids))])
+        self.assertAggregatesMatch()
+
+    def test_ranking_changes(self):
+        rng = random.Random(5)
+        for _ in range(10):
+            contest = Contest.create_random(self.topic,
+                                            rng.choice(self.users))
+            contest.set_winner(rng.choice(list(contest.contestants.all())))
+
+        ranking = OptionRanking.objects.filter(user=self.users[0]).first()
+        ranking.score = 1234
+        ranking.save()
+        self.assertAggregatesMatch()
+
+        OptionRanking.objects.filter(user=self.users[1]).first().delete()
+        self.assertAggregatesMatch()
+
+        self.topicoptions[0].delete()
+        self.assertAggregatesMatch()
+
+        TopicOption.objects.remove_options(
+            self.topic, [self.topicoptions[2].option_id])
+        self.assertAggregatesMatch()
+
+    def test_rebuild(self):
+        rng = random.Random(6)
+        for _ in range(10):
+            contest = Contest.create_random(self.topic,
+                                            rng.choice(self.users))
+            contest.set_winner(rng.choice(list(contest.contestants.all())))
+        stored = self.stored_aggregates()
+
+        OptionAggregate.objects.all().delete()
+        self.assertEqual(OptionAggregate.objects.rebuild(self.topic),
+                         len(self.topicoptions))
+        self.assertEqual(self.stored_aggregates(), stored)
+
+
+class BallotLoaderTestCase(TallyTestCase):
+    def test_ballots(self):
+        scores = [[1600, 1500, 1550], [1400, None, 1400], [None, 1500, None]]
+        for user, user_scores in zip(self.users, scores):
+            for topicoption, score in zip(self.topicoptions, user_scores):
+                if score is not None:
+                    OptionRanking.objects.create(topicoption=topicoption,
+                                                 user=user, score=score)
+        OptionRanking.objects.create(topicoption=self.topicoptions[3])
+
+        ballots = self.topic.ballots()
+        ids = [topicoption.id for topicoption in self.topicoptions]
+        self.assertEqual(ballots.candidates, ids)
+        # Highest score first, with ties in TopicOption order
+        self.assertEqual(list(ballots), [[ids[0], ids[2], ids[1]],
+                                         [ids[0], ids[2]],
+                                         [ids[1]]])
+
+    def test_single_query(self):
+        OptionRanking.objects.create(topicoption=self.topicoptions[0],
+                                     user=self.users[0])
+        topicoption_ids = [topicoption.id for topicoption in self.topicoptions]
+        with self.assertNumQueries(1):
+            self.assertEqual(list(self.topic.ballots(topicoption_ids)),
+                             [[topicoption_ids[0]]])
+
+
+class RebuildTalliesCommandTestCase(TallyTestCase):
+    def test_rebuild(self):
+        rng = random.Random(11)
+        for _ in range(10):
+            contest = Contest.create_random(self.topic, rng.choice(self.users))
+            contest.set_winner(rng.choice(list(contest.contestants.all())))
+
+        PairwiseTally.objects.all().update(wins_a=0, wins_b=0)
+        self.assertRaises(CommandError, call_command, 'rebuild_tallies',
+                          check=True, stdout=StringIO(), stderr=StringIO())
+
+        call_command('rebuild_tallies', stdout=StringIO())
+        self.assertTalliesMatch()
+        call_command('rebuild_tallies', self.topic.id, check=True,
+                     stdout=StringIO())
+
+
+class ReplayRatingsCommandTestCase(TallyTestCase):
+    def play(self, count):
+        rng = random.Random(5)
+        for _ in range(count):
+            contest = Contest.create_random(self.topic, rng.choice(self.users))
+            contest.set_winner(rng.choice(list(contest.contestants.all())))
+
+    def scores(self):
+        return list(OptionRanking.objects.order_by('id')
+                    .values_list('score', 'games'))
+
+    def test_replay_unchanged(self):
+        self.play(20)
+        scores = self.scores()
+
+        stdout = StringIO()
+        call_command('replay_ratings', self.topic.id, chunk_size=3,
+                     stdout=stdout)
+        self.assertIn('Replayed 20/20 contests', stdout.getvalue())
+        self.assertIn('No scores changed', stdout.getvalue())
+        self.assertEqual(self.scores(), scores)
+
+    def test_replay_set_winners(self):
+        # A batch decided against contest id order is replayed in the order
+        # it was applied
+        user = self.users[0]
+        Contest.fill_queue(self.topic, user, 6, random.Random(6))
+        contests = list(Contest.queued(self.topic.id, user.id))
+        votes = [(contest.id,
+                  contest.contestants.all()[0].topicoption.option_id)
+                 for contest in reversed(contests)]
+        self.assertEqual(Contest.set_winners(self.topic, user, votes),
+                         [None] * len(votes))
+
+        stdout = StringIO()
+        call_command('replay_ratings', self.topic.id, dry_run=True,
+                     stdout=stdout)
+        self.assertIn('No scores changed', stdout.getvalue())
+
+    def test_replay_new_k_factor(self):
+        self.play(20)
+        self.topic.elo_k_factor = 32
+        self.topic.save()
+
+        OptionRanking.objects.update(score=1234)
+        stdout = StringIO()
+        call_command('replay_ratings', self.topic.id, dry_run=True,
+                     stdout=stdout)
+        self.assertIn('rankings changed', stdout.getvalue())
+        self.assertEqual(set(score for score, _ in self.scores()), {1234})
+
+        call_command('replay_ratings', self.topic.id, batch_size=2,
+                     stdout=StringIO())
+        scores = self.scores()
+        self.assertEqual(sum(games for _, games in scores), 40)
+        # Every contest is zero sum
+        self.assertAlmostEqual(sum(score for score, _ in scores),
+                               1000 * len(scores))
+        self.assertTalliesMatch()
+
+        # Replaying again with the same settings changes nothing
+        stdout = StringIO()
+        call_command('replay_ratings', self.topic.id, stdout=stdout)
+        self.assertIn('No scores changed', stdout.getvalue())
@@ -0,0 +1,114 @@
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.db import connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from categorizer import timing
+from categorizer.models import Topic, Option, TopicOption, OptionRanking
+
+
+class RequestTimingTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        timing.histograms.clear()
+        self.user = User.objects.create_user('user')
+        self.client.force_authenticate(user=self.user)
+
+        self.topic = Topic.objects.create(label='Favorite color')
+        for label in ['Blue', 'Red']:
+            topicoption = TopicOption.objects.create(
+                topic=self.topic, option=Option.objects.create(label=label))
+            OptionRanking.objects.create(topicoption=topicoption,
+                                         user=self.user)
+        self.url = reverse('ranker-topics-rankings',
+                           kwargs={'topic_id': self.topic.id})
+
+    def tearDown(self):
+        timing.histograms.clear()
+
+    def server_timing(self, response):
+        metrics = {}
+        for metric in response['Server-Timing'].split(', '):
+            parts = metric.split(';')
+            metrics[parts[0]] = dict(part.split('=', 1) for part in parts[1:])
+        return metrics
+
+    def test_server_timing(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+        metrics = self.server_timing(response)
+        self.assertEqual(sorted(metrics), ['db', 'ranking', 'total'])
+        self.assertEqual(metrics['db']['desc'],
+                         '"{} queries"'.format(len(queries)))
+        self.assertTrue(float(metrics['total']['dur']) >=
+                        float(metrics['db']['dur']))
+
+    def test_cursors_restored(self):
+        self.client.get(self.url)
+        self.assertNotIn('make_cursor', connection.__dict__)
+        self.assertIsNone(timing.current())
+
+    @override_settings(REQUEST_TIMING_SAMPLE_RATE=0)
+    def test_sampling(self):
+        response = self.client.get(self.url)
+        self.assertNotIn('Server-Timing', response)
+        self.assertEqual(timing.histograms.as_dict(), {})
+
+    def test_histograms(self):
+        self.client.get(self.url)
+        self.client.get(self.url)
+        self.client.get(reverse('ranker-topics-list'))
+
+        self.user.is_staff = True
+        self.user.save()
+        response = self.client.get(reverse('ranker-timings'))
+        self.assertEqual(response.status_code, 200)
+
+        views = response.json()
+        self.assertEqual(sorted(views), ['TopicViewSet.list',
+                                         'topic_rankings'])
+        rankings = views['topic_rankings']
+        self.assertEqual(rankings['requests'], 2)
+        self.assertEqual(sum(rankings['buckets'].values()), 2)
+        self.assertEqual(sorted(rankings['mean']),
+                         ['db', 'queries', 'ranking', 'total'])
+
+        # Only the request that cleared them is left
+        self.client.delete(reverse('ranker-timings'))
+        self.assertEqual(list(timing.histograms.as_dict()),
+                         ['request_timings'])
+
+    def test_histograms_staff_only(self):
+        response = self.client.get(reverse('ranker-timings'))
+        self.assertEqual(response.status_code, 403)
+
+
+class SpanTestCase(TestCase):
+    def tearDown(self):
+        timing.stop()
+
+    def test_no_request(self):
+        with timing.span('ranking'):
+            pass
+        self.assertIsNone(timing.current())
+
+    def test_excludes_queries(self):
+        request_timing = timing.start()
+        with timing.span('ranking'):
+            # A query slow enough to dwarf the rest of the span
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    'WITH RECURSIVE c(x) AS (SELECT 1 UNION ALL '
+                    'SELECT x + 1 FROM c WHERE x < 1000000) '
+                    'SELECT count(*) FROM c')
+                self.assertEqual(cursor.fetchone()[0], 1000000)
+        self.assertEqual(request_timing.queries, 1)
+        self.assertGreater(request_timing.db_time, 0.01)
+        self.assertGreaterEqual(request_timing.spans['ranking'], 0)
+        self.assertLess(request_timing.spans['ranking'],
+                        request_timing.db_time / 2)
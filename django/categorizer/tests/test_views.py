@@ -1,11 +1,14 @@
+from unittest import skipUnless
+
 from django.contrib.auth.models import User
+from django.db import connection
 from django.urls import reverse
 
 from rest_framework.authtoken.models import Token
 from rest_framework.test import APITestCase
 
 from categorizer.models import (Topic, Option, TopicOption, Contest,
-                                OptionRanking)
+                                OptionRanking, OptionAggregate)
 
 
 class TopicApiTestCase(APITestCase):
@@ -18,7 +21,7 @@ class TopicApiTestCase(APITestCase):
     def test_topic_list_empty(self):
         url = reverse('ranker-topics-list')
         response = self.client.get(url)
-        self.assertEqual(response.json(), [])
+        self.assertEqual(response.json()['results'], [])
         self.assertEqual(response.status_code, 200)
 
     def test_topic_list_noauth(self):
@@ -42,8 +45,8 @@ class TopicApiTestCase(APITestCase):
         topic = Topic.objects.create(label='Testing 123')
         url = reverse('ranker-topics-list')
         response = self.client.get(url)
-        self.assertEqual(response.json(), [{'id': topic.id,
-                                            'label': topic.label}])
+        self.assertEqual(response.json()['results'],
+                         [{'id': topic.id, 'label': topic.label}])
         self.assertEqual(response.status_code, 200)
 
     def test_topic_detail(self):
@@ -144,7 +147,7 @@ class OptionApiTestCase(APITestCase):
     def test_option_list_empty(self):
         url = reverse('ranker-options-list')
         response = self.client.get(url)
-        self.assertEqual(response.json(), [])
+        self.assertEqual(response.json()['results'], [])
         self.assertEqual(response.status_code, 200)
 
     def test_option_list_noauth(self):
@@ -167,8 +170,8 @@ class OptionApiTestCase(APITestCase):
         option = Option.objects.create(label='Testing 123')
         url = reverse('ranker-options-list')
         response = self.client.get(url)
-        self.assertEqual(response.json(), [{'id': option.id,
-                                            'label': 'Testing 123'}])
+        self.assertEqual(response.json()['results'],
+                         [{'id': option.id, 'label': 'Testing 123'}])
         self.assertEqual(response.status_code, 200)
 
     def test_option_detail(self):
@@ -228,8 +231,8 @@ class OptionApiTestCase(APITestCase):
             topic.id
         )
         response = self.client.get(url)
-        self.assertEqual(response.json(), [{'id': option.id,
-                                            'label': option.label}])
+        self.assertEqual(response.json()['results'],
+                         [{'id': option.id, 'label': option.label}])
         self.assertEqual(response.status_code, 200)
 
     def test_option_for_topic__no_mapping__empty(self):
@@ -240,9 +243,62 @@ class OptionApiTestCase(APITestCase):
             topic.id
         )
         response = self.client.get(url)
-        self.assertEqual(response.json(), [])
+        self.assertEqual(response.json()['results'], [])
         self.assertEqual(response.status_code, 200)
 
+    def test_option_list_pages(self):
+        options = [Option.objects.create(label='Option {}'.format(n))
+                   for n in range(5)]
+        url = '{}?count=2'.format(reverse('ranker-options-list'))
+        ids = []
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()['results']), 2)
+            ids.extend(option['id'] for option in response.json()['results'])
+            url = response.json()['next']
+        self.assertEqual(ids, [option.id for option in options])
+
+    def test_option_list_count(self):
+        for n in range(3):
+            Option.objects.create(label='Option {}'.format(n))
+        url = reverse('ranker-options-list')
+        response = self.client.get(url, {'count': 0})
+        self.assertEqual(len(response.json()['results']), 1)
+        response = self.client.get(url, {'count': 'many'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_option_list_fields(self):
+        option = Option.objects.create(label='Testing 123')
+        url = reverse('ranker-options-list')
+        response = self.client.get('{}?fields=label'.format(url))
+        self.assertEqual(response.json()['results'],
+                         [{'label': 'Testing 123'}])
+
+        url = reverse('ranker-options-detail', kwargs={'pk': option.id})
+        response = self.client.get('{}?fields=id'.format(url))
+        self.assertEqual(response.json(), {'id': option.id})
+
+    def test_option_list_unknown_field(self):
+        url = reverse('ranker-options-list')
+        response = self.client.get('{}?fields=label,score'.format(url))
+        self.assertEqual(response.status_code, 400)
+
+    def test_option_for_topic__other_topics(self):
+        option = Option.objects.create(label='Testing 123')
+        for label in ['First topic', 'Second topic']:
+            topic = Topic.objects.create(label=label)
+            TopicOption.objects.create(topic=topic, option=option)
+        url = '{}?topic={}'.format(reverse('ranker-options-list'), topic.id)
+        response = self.client.get(url)
+        self.assertEqual(response.json()['results'],
+                         [{'id': option.id, 'label': option.label}])
+
+    def test_option_for_topic__invalid(self):
+        url = '{}?topic=abc'.format(reverse('ranker-options-list'))
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 400)
+
 
 class TopicOptionMapTestCase(APITestCase):
     def setUp(self):
@@ -298,6 +354,85 @@ class TopicOptionMapTestCase(APITestCase):
         self.assertEqual(response.status_code, 200)
 
 
+class TopicOptionsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user')
+        self.client.force_authenticate(user=self.user)
+
+        self.topic = Topic.objects.create(label='Favorite color')
+        self.options = [Option.objects.create(label=label)
+                        for label in ['Blue', 'Red', 'Green']]
+        self.url = reverse('ranker-topics-options',
+                           kwargs={'topic_id': self.topic.id})
+
+    def option_labels(self):
+        return set(TopicOption.objects.filter(topic=self.topic)
+                   .values_list('option__label', flat=True))
+
+    def test_add(self):
+        response = self.client.put(self.url, {
+            'ids': [option.id for option in self.options[:2]],
+            'labels': ['Red', 'Yellow'],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'OK', 'added': 3})
+        self.assertEqual(self.option_labels(), {'Blue', 'Red', 'Yellow'})
+        self.assertEqual(OptionAggregate.objects.filter(
+            topic=self.topic).count(), 3)
+
+        # Options already in the topic are skipped
+        response = self.client.put(self.url, {'labels': ['Blue', 'Green']},
+                                   format='json')
+        self.assertEqual(response.json(), {'status': 'OK', 'added': 1})
+        self.assertEqual(self.option_labels(),
+                         {'Blue', 'Red', 'Green', 'Yellow'})
+
+    def test_add_unknown(self):
+        response = self.client.put(self.url, {
+            'ids': [self.options[0].id, self.options[-1].id + 1],
+            'labels': ['Yellow'],
+        }, format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.option_labels(), set())
+        # The labels didn't get options either
+        self.assertFalse(Option.objects.filter(label='Yellow').exists())
+
+    def test_add_invalid(self):
+        response = self.client.put(self.url, {'ids': ['Blue']},
+                                   format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_remove(self):
+        TopicOption.objects.add_options(
+            self.topic, [option.id for option in self.options])
+        for _ in range(3):
+            contest = Contest.create_random(self.topic, self.user)
+            contest.set_winner(contest.contestants.all()[0])
+        Contest.create_random(self.topic, self.user)
+
+        response = self.client.delete(self.url, {
+            'ids': [self.options[0].id], 'labels': ['Red', 'Purple'],
+        }, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), {'status': 'OK', 'removed': 2})
+        self.assertEqual(self.option_labels(), {'Green'})
+
+        # Every contest had one of the removed options
+        self.assertFalse(Contest.objects.exists())
+        self.assertEqual(
+            set(OptionRanking.objects.values_list('topicoption__option__label',
+                                                  flat=True)),
+            {'Green'})
+        aggregate = OptionAggregate.objects.get(topic=self.topic)
+        self.assertEqual((aggregate.wins, aggregate.losses), (0, 0))
+
+    def test_missing(self):
+        url = reverse('ranker-topics-options',
+                      kwargs={'topic_id': self.topic.id + 1})
+        response = self.client.put(url, {'ids': []}, format='json')
+        self.assertEqual(response.status_code, 404)
+
+
 class TopicContestTestCase(APITestCase):
     def setUp(self):
         self.user = User.objects.create_user('user', 'user@example.com',
@@ -477,6 +612,27 @@ class TopicContestTestCase(APITestCase):
         ])
         self.assertEqual(response.status_code, 200)
 
+    def test_topic_rankings_methods(self):
+        ranking = self.contest.contestants.get(topicoption__option=self.second)
+        ranking.score = 1600
+        ranking.save()
+
+        url = reverse('ranker-topics-rankings',
+                      kwargs={'topic_id': self.topic.id})
+        for method in Topic.RANKING_METHODS:
+            response = self.client.get('{}?method={}'.format(url, method))
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual(response.json(), [
+                {'id': self.second.id, 'label': self.second.label},
+                {'id': self.first.id, 'label': self.first.label}
+            ])
+
+    def test_topic_rankings_unknown_method(self):
+        url = reverse('ranker-topics-rankings',
+                      kwargs={'topic_id': self.topic.id})
+        response = self.client.get('{}?method=borda'.format(url))
+        self.assertEqual(response.status_code, 400)
+
     def test_topic_rankings_noauth(self):
         self.client.logout()
         url = reverse('ranker-topics-rankings',
@@ -489,3 +645,226 @@ class TopicContestTestCase(APITestCase):
         url = reverse('ranker-topics-rankings', kwargs={'topic_id': 1})
         response = self.client.get(url)
         self.assertEqual(response.status_code, 404)
+
+
+class TopicLeaderboardTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user')
+        self.client.force_authenticate(user=self.user)
+
+        self.topic = Topic.objects.create(label='Favorite color')
+        self.options = []
+        for label, score in [('Blue', 1100), ('Red', 1000), ('Green', 1200),
+                             ('Yellow', 1000), ('Purple', None)]:
+            option = Option.objects.create(label=label)
+            topicoption = TopicOption.objects.create(topic=self.topic,
+                                                     option=option)
+            if score is not None:
+                OptionRanking.objects.create(topicoption=topicoption,
+                                             user=self.user, score=score)
+            self.options.append(option)
+        self.url = reverse('ranker-topics-leaderboard',
+                           kwargs={'topic_id': self.topic.id})
+
+    def test_leaderboard(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNone(response.json()['next'])
+
+        # Ties are kept in the order the options were added
+        results = response.json()['results']
+        self.assertEqual([entry['label'] for entry in results],
+                         ['Green', 'Blue', 'Red', 'Yellow', 'Purple'])
+        self.assertEqual(results[0], {
+            'id': self.options[2].id, 'label': 'Green', 'score': 1200,
+            'votes': 1, 'wins': 0, 'losses': 0})
+        self.assertEqual(results[-1]['votes'], 0)
+
+    def test_pages(self):
+        labels = []
+        url = '{}?count=2'.format(self.url)
+        while url is not None:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.json()['results']), 2)
+            labels.extend(entry['label']
+                          for entry in response.json()['results'])
+            url = response.json()['next']
+        self.assertEqual(labels,
+                         ['Green', 'Blue', 'Red', 'Yellow', 'Purple'])
+
+    def test_contest(self):
+        contest = Contest.objects.create(topic=self.topic, user=self.user)
+        contest.contestants = OptionRanking.objects.filter(
+            topicoption__option__in=self.options[:2])
+        contest.set_winner(contest.contestants.get(
+            topicoption__option=self.options[1]))
+
+        results = self.client.get(self.url).json()['results']
+        self.assertEqual(
+            [(entry['label'], entry['wins'], entry['losses'])
+             for entry in results[1:3]],
+            [('Blue', 0, 1), ('Red', 1, 0)])
+        self.assertGreater(results[2]['score'], 1000)
+
+    def test_invalid_cursor(self):
+        response = self.client.get('{}?cursor=abc'.format(self.url))
+        self.assertEqual(response.status_code, 400)
+
+    def test_invalid_count(self):
+        response = self.client.get('{}?count=abc'.format(self.url))
+        self.assertEqual(response.status_code, 400)
+
+    def test_missing(self):
+        url = reverse('ranker-topics-leaderboard',
+                      kwargs={'topic_id': self.topic.id + 1})
+        self.assertEqual(self.client.get(url).status_code, 404)
+
+
+class TopicContestBatchTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user', 'user@example.com',
+                                             'password')
+        self.client.force_authenticate(user=self.user)
+
+        self.topic = Topic.objects.create(label="Test Topic")
+        self.options = [Option.objects.create(label="Test Option %d" % i)
+                        for i in range(3)]
+        for option in self.options:
+            TopicOption.objects.create(topic=self.topic, option=option)
+
+        self.url = reverse('ranker-topics-contest-batch',
+                           kwargs={'topic_id': self.topic.id})
+
+    def scores(self):
+        return list(OptionRanking.objects.filter(user=self.user)
+                    .order_by('id').values_list('score', flat=True))
+
+    def test_batch_get(self):
+        response = self.client.get('{}?count=4'.format(self.url))
+        self.assertEqual(response.status_code, 200)
+
+        contests = response.json()
+        self.assertEqual(len(contests), 4)
+        self.assertEqual(Contest.objects.get(current=True).id,
+                         contests[0]['id'])
+        for contest in contests:
+            self.assertEqual(len(contest['options']), 2)
+
+    def test_batch_get_count(self):
+        response = self.client.get(self.url, {'count': 0})
+        self.assertEqual(len(response.json()), 1)
+        response = self.client.get(self.url, {'count': 'all'})
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_vote(self):
+        contests = self.client.get('{}?count=3'.format(self.url)).json()
+        votes = [{'contest': contest['id'],
+                  'winner': contest['options'][0]['id']}
+                 for contest in contests]
+        votes.append({'contest': contests[0]['id'],
+                      'winner': contests[0]['options'][1]['id']})
+        votes.append({'contest': -1, 'winner': self.options[0].id})
+
+        response = self.client.post(self.url, votes, format='json')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), [
+            {'contest': contests[0]['id'], 'status': 'OK'},
+            {'contest': contests[1]['id'], 'status': 'OK'},
+            {'contest': contests[2]['id'], 'status': 'OK'},
+            {'contest': contests[0]['id'], 'status': 'error',
+             'error': 'Contest already decided'},
+            {'contest': -1, 'status': 'error', 'error': 'Unknown contest'},
+        ])
+        self.assertFalse(Contest.objects.filter(
+            id__in=[c['id'] for c in contests], winner__isnull=True).exists())
+
+        # The adjustments are the same as voting one contest at a time
+        batch_scores = self.scores()
+        self.assertAlmostEqual(sum(batch_scores), 1000 * len(batch_scores))
+        OptionRanking.objects.update(score=1000)
+        Contest.objects.update(winner=None)
+        for contest in contests:
+            Contest.objects.get(id=contest['id']).set_winner(
+                OptionRanking.objects.get(
+                    contest=contest['id'],
+                    topicoption__option=contest['options'][0]['id']))
+        self.assertEqual(self.scores(), batch_scores)
+
+    def test_batch_invalid_winner(self):
+        contest = self.client.get(self.url).json()[0]
+        response = self.client.post(self.url, [
+            {'contest': contest['id'], 'winner': -1}
+        ], format='json')
+        self.assertEqual(response.json(), [
+            {'contest': contest['id'], 'status': 'error',
+             'error': 'Unknown winner'}
+        ])
+        self.assertTrue(Contest.objects.filter(id=contest['id'],
+                                               winner__isnull=True).exists())
+
+    def test_batch_malformed(self):
+        response = self.client.post(self.url, [{'contest': 'abc'}],
+                                    format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_batch_noauth(self):
+        self.client.logout()
+        response = self.client.post(self.url, [], format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+class ContestQueryTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user('user')
+        self.client.force_authenticate(user=self.user)
+
+        self.topic = Topic.objects.create(label="Test Topic")
+        for i in range(2):
+            TopicOption.objects.create(
+                topic=self.topic,
+                option=Option.objects.create(label="Option %d" % i))
+        self.url = reverse('ranker-topics-contest',
+                           kwargs={'topic_id': self.topic.id})
+
+    def test_contest_timestamps(self):
+        contest = Contest.create_random(self.topic, self.user)
+        self.assertIsNotNone(contest.created_at)
+        self.assertIsNone(contest.decided_at)
+
+        contest.set_winner(contest.contestants.all()[0])
+        contest.refresh_from_db()
+        self.assertGreaterEqual(contest.decided_at, contest.created_at)
+
+    def test_contest_get_queries(self):
+        self.client.get(self.url)
+        # Topic, current contest and its options, inside a savepoint and its
+        # release
+        with self.assertNumQueries(5):
+            response = self.client.get(self.url)
+        self.assertEqual(response.status_code, 200)
+
+    @skipUnless(connection.vendor == 'sqlite', 'Uses SQLite query plans')
+    def test_current_contest_uses_index(self):
+        query = self.topic.contests.filter(user=self.user, current=True)
+        sql, params = query.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+
+        self.assertIn('USING INDEX', plan)
+        self.assertNotRegexpMatches(plan, r'SCAN (TABLE )?categorizer_contest')
+
+    @skipUnless(connection.vendor == 'sqlite', 'Uses SQLite query plans')
+    def test_decided_contests_use_index(self):
+        query = (self.topic.contests.filter(winner__isnull=False)
+                 .order_by('decided_at', 'id'))
+        sql, params = query.query.sql_with_params()
+        with connection.cursor() as cursor:
+            cursor.execute('EXPLAIN QUERY PLAN ' + sql, params)
+            plan = ' '.join(str(row[-1]) for row in cursor.fetchall())
+
+        # Sorting needs a temporary b-tree unless the (topic, decided_at)
+        # index is used
+        self.assertIn('USING INDEX', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
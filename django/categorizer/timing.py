@@ -0,0 +1,187 @@
+""" Lightweight per-request timing.
+
+RequestTimingMiddleware starts a RequestTiming for a sample of requests. While
+it is active, database cursors count their queries and time, and span()
+records time spent in named sections such as the ranking engine. Finished
+requests are added to an in-process histogram for each view.
+"""
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+from contextlib import contextmanager
+from timeit import default_timer
+
+from django.db import connections
+from django.db.backends.utils import CursorDebugWrapper, CursorWrapper
+
+_local = threading.local()
+
+
+def current():
+    """ Returns the RequestTiming for the request being handled by this
+    thread, or None if it isn't being timed
+    """
+    return getattr(_local, 'timing', None)
+
+
+class RequestTiming(object):
+    def __init__(self):
+        self.start = default_timer()
+        self.duration = None
+        self.queries = 0
+        self.db_time = 0.0
+        self.spans = OrderedDict()
+
+    def add_query(self, duration):
+        self.queries += 1
+        self.db_time += duration
+
+    def finish(self):
+        self.duration = default_timer() - self.start
+
+    def server_timing(self):
+        """ Formats the timings as a Server-Timing header, in milliseconds
+        """
+        metrics = ['total;dur={:.1f}'.format(self.duration * 1000),
+                   'db;dur={:.1f};desc="{} queries"'.format(
+                       self.db_time * 1000, self.queries)]
+        metrics.extend('{};dur={:.1f}'.format(name, duration * 1000)
+                       for name, duration in self.spans.items())
+        return ', '.join(metrics)
+
+
+@contextmanager
+def span(name):
+    """ Adds the time spent inside the block to the current request's timing,
+    leaving out the time spent on database queries
+    """
+    timing = current()
+    if timing is None:
+        yield
+        return
+
+    start = default_timer()
+    db_time = timing.db_time
+    try:
+        yield
+    finally:
+        elapsed = default_timer() - start - (timing.db_time - db_time)
+        timing.spans[name] = timing.spans.get(name, 0.0) + elapsed
+
+
+class _TimedCursor(object):
+    def __init__(self, cursor, db, timing):
+        super(_TimedCursor, self).__init__(cursor, db)
+        self.timing = timing
+
+    def execute(self, *args, **kwargs):
+        start = default_timer()
+        try:
+            return super(_TimedCursor, self).execute(*args, **kwargs)
+        finally:
+            self.timing.add_query(default_timer() - start)
+
+    def executemany(self, *args, **kwargs):
+        start = default_timer()
+        try:
+            return super(_TimedCursor, self).executemany(*args, **kwargs)
+        finally:
+            self.timing.add_query(default_timer() - start)
+
+
+class TimedCursorWrapper(_TimedCursor, CursorWrapper):
+    pass
+
+
+class TimedCursorDebugWrapper(_TimedCursor, CursorDebugWrapper):
+    pass
+
+
+def _instrument(connection, timing):
+    # Shadow the connection's cursor factories for the rest of the request.
+    # Connections belong to a single thread, so this only affects the
+    # request being timed.
+    connection.make_cursor = (
+        lambda cursor: TimedCursorWrapper(cursor, connection, timing))
+    connection.make_debug_cursor = (
+        lambda cursor: TimedCursorDebugWrapper(cursor, connection, timing))
+
+
+def _uninstrument(connection):
+    connection.__dict__.pop('make_cursor', None)
+    connection.__dict__.pop('make_debug_cursor', None)
+
+
+def start():
+    timing = RequestTiming()
+    _local.timing = timing
+    for connection in connections.all():
+        _instrument(connection, timing)
+    return timing
+
+
+def stop():
+    timing = current()
+    _local.timing = None
+    for connection in connections.all():
+        _uninstrument(connection)
+    if timing is not None:
+        timing.finish()
+    return timing
+
+
+class Histogram(object):
+    """ Counts request durations into fixed buckets, along with running
+    totals of each timing
+    """
+    # Upper bounds of each bucket in milliseconds, the last being unbounded
+    BOUNDS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000)
+
+    def __init__(self):
+        self.counts = [0] * (len(self.BOUNDS) + 1)
+        self.requests = 0
+        self.totals = OrderedDict([('total', 0.0), ('db', 0.0),
+                                   ('queries', 0)])
+
+    def add(self, timing):
+        self.counts[bisect_left(self.BOUNDS, timing.duration * 1000)] += 1
+        self.requests += 1
+        self.totals['total'] += timing.duration
+        self.totals['db'] += timing.db_time
+        self.totals['queries'] += timing.queries
+        for name, duration in timing.spans.items():
+            self.totals[name] = self.totals.get(name, 0.0) + duration
+
+    def as_dict(self):
+        buckets = OrderedDict(
+            ('<={}ms'.format(bound), count)
+            for bound, count in zip(self.BOUNDS, self.counts))
+        buckets['>{}ms'.format(self.BOUNDS[-1])] = self.counts[-1]
+        return OrderedDict([
+            ('requests', self.requests),
+            ('buckets', buckets),
+            ('mean', OrderedDict((name, float(total) / self.requests)
+                                 for name, total in self.totals.items())),
+        ])
+
+
+class _Histograms(object):
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.views = {}
+
+    def add(self, view, timing):
+        with self.lock:
+            self.views.setdefault(view, Histogram()).add(timing)
+
+    def as_dict(self):
+        with self.lock:
+            return OrderedDict((view, self.views[view].as_dict())
+                               for view in sorted(self.views))
+
+    def clear(self):
+        with self.lock:
+            self.views.clear()
+
+
+histograms = _Histograms()
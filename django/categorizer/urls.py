@@ -9,10 +9,17 @@ router.register(r'topics', views.TopicViewSet, 'ranker-topics')
 
 urlpatterns = [
     url(r'^', include(router.urls)),
+    url(r'^topics/(?P<topic_id>[1-9][0-9]*)/options/?$', views.topic_options,
+        name='ranker-topics-options'),
     url(r'^topics/(?P<topic_id>[1-9][0-9]*)/options/(?P<option_id>[1-9][0-9]*)/?$',
         views.topic_option_detail, name='ranker-topics-option-detail'),
     url(r'^topics/(?P<topic_id>[1-9][0-9]*)/contests/?$', views.contest_manager,
         name='ranker-topics-contest'),
+    url(r'^topics/(?P<topic_id>[1-9][0-9]*)/contests/batch/?$',
+        views.contest_batch, name='ranker-topics-contest-batch'),
     url(r'^topics/(?P<topic_id>[1-9][0-9]*)/rankings/?$', views.topic_rankings,
         name='ranker-topics-rankings'),
+    url(r'^topics/(?P<topic_id>[1-9][0-9]*)/leaderboard/?$',
+        views.topic_leaderboard, name='ranker-topics-leaderboard'),
+    url(r'^timings/?$', views.request_timings, name='ranker-timings'),
 ]
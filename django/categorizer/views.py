@@ -1,34 +1,130 @@
+from django.db import transaction
+from django.db.models import Q
 from django.shortcuts import get_object_or_404
-from rest_framework.decorators import api_view
+from rest_framework.decorators import api_view, permission_classes
 from rest_framework.exceptions import ParseError
+from rest_framework.permissions import IsAdminUser
 from rest_framework.response import Response
 from rest_framework.status import HTTP_201_CREATED
+from rest_framework.utils.urls import replace_query_param
 from rest_framework import viewsets
 
+from categorizer import contests, timing
+from categorizer.db import reads_from_replica, replica_reads
+from categorizer.deletion import delete_topic_options
+from categorizer.pagination import KeysetPagination
 from categorizer.models import (Topic, Option, TopicOption, Contest,
-                                OptionRanking)
-from categorizer.serializers import TopicSerializer, OptionSerializer
+                                OptionRanking, OptionAggregate, chunked)
+from categorizer.ranking_cache import (get_ranked_option_ids,
+                                       invalidate_rankings)
+from categorizer.serializers import (TopicSerializer, OptionSerializer,
+                                     TopicOptionsSerializer, VoteSerializer)
 
 
-class TopicViewSet(viewsets.ModelViewSet):
+class SparseListMixin(object):
+    """ Pages through the list by id, and lets GET requests pick the fields
+    they need with ?fields=. Lists are read from a replica and serialized
+    from plain rows, without creating model instances.
+    """
+    pagination_class = KeysetPagination
+
+    def requested_fields(self):
+        fields = self.request.query_params.get('fields')
+        if fields is None or self.request.method != 'GET':
+            return None
+        fields = [name for name in fields.split(',') if name]
+        if not fields or set(fields) - set(self.serializer_class.Meta.fields):
+            raise ParseError('Unknown field')
+        return fields
+
+    def get_queryset(self):
+        queryset = super(SparseListMixin, self).get_queryset()
+        fields = self.requested_fields()
+        if fields is not None:
+            queryset = queryset.only('id', *fields)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        kwargs.setdefault('fields', self.requested_fields())
+        return super(SparseListMixin, self).get_serializer(*args, **kwargs)
+
+    def list(self, request, *args, **kwargs):
+        fields = self.requested_fields() or self.serializer_class.Meta.fields
+        with replica_reads():
+            # The id is always needed for the cursor
+            rows = self.filter_queryset(self.get_queryset()).values(
+                *set(['id']).union(fields))
+            page = self.paginate_queryset(rows)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+
+class TopicViewSet(SparseListMixin, viewsets.ModelViewSet):
     serializer_class = TopicSerializer
     queryset = Topic.objects.all()
 
+    def perform_destroy(self, instance):
+        # Remove the options first, so their rankings aren't deleted one at
+        # a time by the cascade
+        with transaction.atomic():
+            delete_topic_options(instance.topicoption.all())
+            instance.delete()
+
 
-class OptionViewSet(viewsets.ModelViewSet):
+class OptionViewSet(SparseListMixin, viewsets.ModelViewSet):
     serializer_class = OptionSerializer
     queryset = Option.objects.all()
 
     def get_queryset(self):
-        queryset = Option.objects.all()
-        try:
-            topic_id = self.request.query_params['topic']
-            queryset = queryset.filter(topics__id=topic_id)
-        except KeyError:
-            pass
-
+        queryset = super(OptionViewSet, self).get_queryset()
+        topic_id = self.request.query_params.get('topic')
+        if topic_id is not None:
+            try:
+                topic_id = int(topic_id)
+            except ValueError:
+                raise ParseError('Invalid topic')
+            # A semi-join lists each option once, and doesn't need to sort
+            # away the duplicates a join could produce
+            queryset = queryset.filter(id__in=TopicOption.objects.filter(
+                topic_id=topic_id).values('option_id'))
         return queryset
 
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            delete_topic_options(instance.topicoption.all())
+            instance.delete()
+
+
+@api_view(['PUT', 'DELETE'])
+def topic_options(request, topic_id):
+    topic = get_object_or_404(Topic, id=topic_id)
+    serialized = TopicOptionsSerializer(data=request.data)
+    serialized.is_valid(raise_exception=True)
+    option_ids = set(serialized.validated_data.get('ids', []))
+    labels = serialized.validated_data.get('labels', [])
+
+    if request.method == 'PUT':
+        # The ids are checked before any labels get options, so a rejected
+        # request doesn't leave new options behind
+        known = set()
+        for chunk in chunked(option_ids):
+            known.update(Option.objects.filter(id__in=chunk)
+                         .values_list('id', flat=True))
+        if known != option_ids:
+            raise ParseError('Unknown option')
+
+        with transaction.atomic():
+            # Labels which don't have an option yet get one
+            option_ids.update(Option.objects.ensure_labels(labels).values())
+            added = TopicOption.objects.add_options(topic, option_ids)
+        return Response({'status': 'OK', 'added': added})
+
+    for chunk in chunked(labels):
+        option_ids.update(Option.objects.filter(label__in=chunk)
+                          .values_list('id', flat=True))
+    removed = TopicOption.objects.remove_options(topic, option_ids)
+    return Response({'status': 'OK', 'removed': removed})
+
 
 @api_view(['GET', 'DELETE', 'PUT'])
 def topic_option_detail(request, topic_id, option_id):
@@ -39,6 +135,7 @@ def topic_option_detail(request, topic_id, option_id):
             topic=topic,
             option=option
         )
+        invalidate_rankings(topic.id)
         return Response({
             'status': 'created'
         }, status=HTTP_201_CREATED)
@@ -51,7 +148,7 @@ def topic_option_detail(request, topic_id, option_id):
             'status': 'OK'
         })
     elif request.method == 'DELETE':
-        mapping.delete()
+        TopicOption.objects.remove_options(mapping.topic, [mapping.option_id])
         return Response({
             'status': 'deleted'
         })
@@ -59,46 +156,142 @@ def topic_option_detail(request, topic_id, option_id):
 
 @api_view(['GET', 'POST', 'DELETE'])
 def contest_manager(request, topic_id):
-    topic = get_object_or_404(Topic, id=topic_id)
-    try:
-        contest = topic.contests.distinct().get(
-            user=request.user,
-            winner__isnull=True
-        )
-    except Contest.DoesNotExist:
-        if request.method == 'GET':
-            contest = Contest.create_random(topic=topic, user=request.user)
-        else:
-            raise
-
     if request.method == 'GET':
-        contestants = Option.objects.filter(
-            topicoption__rankings__in=contest.contestants.all())
-        serialized = OptionSerializer(contestants, many=True)
-        return Response(serialized.data)
+        return Response(contests.current_contestants(topic_id, request.user))
 
     if request.method == 'POST':
-        winning_id = request.POST['winner']
         try:
-            winner = contest.contestants.get(topicoption__option_id=winning_id)
+            contests.vote(topic_id, request.user, request.POST['winner'])
         except OptionRanking.DoesNotExist:
             raise ParseError('Unknown winner')
-
-        contest.set_winner(winner)
     elif request.method == 'DELETE':
-        contest.delete()
+        contests.skip(topic_id, request.user)
 
     return Response({
         'status': 'OK'
     })
 
 
+@api_view(['GET', 'POST'])
+def contest_batch(request, topic_id):
+    topic = get_object_or_404(Topic, id=topic_id)
+
+    if request.method == 'GET':
+        # List the current contest and the ones queued after it, so clients
+        # can vote on several while offline
+        try:
+            count = min(max(int(request.GET.get('count', 10)), 1), 100)
+        except ValueError:
+            raise ParseError('Invalid count')
+        current = Contest.current_for(topic=topic, user=request.user)
+        Contest.fill_queue(topic, request.user, count - 1)
+
+        contest_ids = [current.id] + list(
+            Contest.queued(topic.id, request.user.id)
+            .values_list('id', flat=True)[:count - 1])
+        contestants = (OptionRanking.objects
+                       .filter(contest__in=contest_ids)
+                       .order_by('topicoption__option_id')
+                       .values_list('contest', 'topicoption__option_id',
+                                    'topicoption__option__label'))
+        options = {contest_id: [] for contest_id in contest_ids}
+        for contest_id, option_id, label in contestants:
+            options[contest_id].append({'id': option_id, 'label': label})
+
+        return Response([{'id': contest_id, 'options': options[contest_id]}
+                         for contest_id in contest_ids])
+
+    serialized = VoteSerializer(data=request.data, many=True)
+    serialized.is_valid(raise_exception=True)
+    votes = [(vote['contest'], vote['winner'])
+             for vote in serialized.validated_data]
+
+    errors = Contest.set_winners(topic, request.user, votes)
+    return Response([
+        {'contest': contest_id, 'status': 'error', 'error': error}
+        if error else {'contest': contest_id, 'status': 'OK'}
+        for (contest_id, _), error in zip(votes, errors)
+    ])
+
+
 @api_view(['GET'])
+@reads_from_replica
 def topic_rankings(request, topic_id):
     topic = get_object_or_404(Topic, id=topic_id)
 
-    count = int(request.GET.get('count', 5))
-    top_n = topic.calculate_top_options(count)
+    method = request.GET.get('method', 'copeland')
+    if method not in Topic.RANKING_METHODS:
+        raise ParseError('Unknown ranking method')
+
+    count = max(int(request.GET.get('count', 5)), 0)
+    snapshot = topic.ranking_snapshots.filter(method=method).first()
+    if snapshot is not None:
+        # Computed by the ranking worker, and possibly behind the latest
+        # contests
+        top_ids = snapshot.ranked_option_ids()[:count]
+    else:
+        # Only the best options are ranked, and any smaller count is served
+        # from the same cached ordering
+        top_ids = get_ranked_option_ids(topic, method, count)[:count]
+    top_n = Option.in_order(top_ids)
 
     serialized = OptionSerializer(top_n, many=True)
-    return Response(serialized.data)
+    response = Response(serialized.data)
+    if snapshot is not None:
+        response['X-Rankings-Age'] = '{:.0f}'.format(snapshot.age())
+    return response
+
+
+@api_view(['GET'])
+@reads_from_replica
+def topic_leaderboard(request, topic_id):
+    topic = get_object_or_404(Topic, id=topic_id)
+    try:
+        count = min(max(int(request.GET.get('count', 20)), 1), 100)
+    except ValueError:
+        raise ParseError('Invalid count')
+
+    # Pages are read from the (topic, mean_score) index, continuing after
+    # the last entry of the previous page rather than skipping rows
+    aggregates = (OptionAggregate.objects.filter(topic=topic)
+                  .order_by('-mean_score', 'topicoption_id'))
+    cursor = request.GET.get('cursor')
+    if cursor is not None:
+        try:
+            score, topicoption_id = cursor.split(':')
+            score, topicoption_id = float(score), int(topicoption_id)
+        except ValueError:
+            raise ParseError('Invalid cursor')
+        aggregates = aggregates.filter(
+            Q(mean_score__lt=score) |
+            Q(mean_score=score, topicoption_id__gt=topicoption_id))
+
+    rows = list(aggregates.values_list(
+        'topicoption_id', 'topicoption__option_id',
+        'topicoption__option__label', 'mean_score', 'votes', 'wins',
+        'losses')[:count + 1])
+
+    next_url = None
+    if len(rows) > count:
+        rows = rows[:count]
+        next_url = replace_query_param(
+            request.build_absolute_uri(), 'cursor',
+            '{!r}:{}'.format(rows[-1][3], rows[-1][0]))
+
+    return Response({
+        'results': [
+            {'id': option_id, 'label': label, 'score': score,
+             'votes': votes, 'wins': wins, 'losses': losses}
+            for _, option_id, label, score, votes, wins, losses in rows
+        ],
+        'next': next_url,
+    })
+
+
+@api_view(['GET', 'DELETE'])
+@permission_classes([IsAdminUser])
+def request_timings(request):
+    # Timings are collected by each process separately
+    if request.method == 'DELETE':
+        timing.histograms.clear()
+    return Response(timing.histograms.as_dict())
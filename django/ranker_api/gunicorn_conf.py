@@ -0,0 +1,31 @@
+"""
+Gunicorn settings for serving ranker_api on a pool of threads in each worker
+process, so that slow clients don't hold up a whole process:
+
+    gunicorn -c ranker_api/gunicorn_conf.py ranker_api.wsgi
+
+Like the Django settings, these are configured with RANKER_* environment
+variables. Each thread keeps its own database connection, so the database
+must accept WORKERS * THREADS connections. Several workers also need
+RANKER_CACHE_BACKEND set to a cache they share, see settings.py.
+"""
+
+import multiprocessing
+import os
+
+
+def env(name, default):
+    return os.environ.get('RANKER_' + name, default)
+
+
+bind = env('BIND', '127.0.0.1:8000')
+worker_class = 'gthread'
+workers = int(env('WORKERS', multiprocessing.cpu_count() + 1))
+threads = int(env('THREADS', 8))
+timeout = int(env('TIMEOUT', 30))
+
+if workers > 1 and env('CACHE_BACKEND', 'locmem') == 'locmem':
+    # Each worker would only invalidate its own copy of the cached rankings,
+    # matchup candidates and tokens
+    raise RuntimeError('RANKER_CACHE_BACKEND must be a shared cache to run '
+                       'more than one worker')
@@ -11,21 +11,40 @@ https://docs.djangoproject.com/en/1.9/ref/settings/
 """
 
 import os
+import sys
 
 # Build paths inside the project like this: os.path.join(BASE_DIR, ...)
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
 
-# Quick-start development settings - unsuitable for production
-# See https://docs.djangoproject.com/en/1.9/howto/deployment/checklist/
+# Deployments are configured with RANKER_* environment variables. Without
+# any, these settings are for local development.
+def env(name, default=None):
+    return os.environ.get('RANKER_' + name, default)
+
+
+def env_bool(name, default):
+    value = env(name)
+    if value is None:
+        return default
+    return value.lower() in ('1', 'true', 'yes', 'on')
+
+
+def env_list(name):
+    return [value.strip() for value in env(name, '').split(',')
+            if value.strip()]
+
+
+TESTING = sys.argv[1:2] == ['test']
 
 # SECURITY WARNING: keep the secret key used in production secret!
-SECRET_KEY = '&8s6ewo!l7(p74r4yz@sj*%eojc(pwv&t1s$r(f#njd2^+be@u'
+SECRET_KEY = env('SECRET_KEY',
+                 '&8s6ewo!l7(p74r4yz@sj*%eojc(pwv&t1s$r(f#njd2^+be@u')
 
 # SECURITY WARNING: don't run with debug turned on in production!
-DEBUG = True
+DEBUG = env_bool('DEBUG', True)
 
-ALLOWED_HOSTS = []
+ALLOWED_HOSTS = env_list('ALLOWED_HOSTS')
 
 CORS_ORIGIN_ALLOW_ALL = True
 
@@ -43,13 +62,14 @@ INSTALLED_APPS = [
     'rest_framework.authtoken',
     'corsheaders',
 
+    'auth',
     'categorizer',
 
     'django_extensions',
-    'debug_toolbar',
 ]
 
 MIDDLEWARE_CLASSES = [
+    'categorizer.middleware.RequestTimingMiddleware',
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.security.SecurityMiddleware',
@@ -60,9 +80,11 @@ MIDDLEWARE_CLASSES = [
     'django.contrib.auth.middleware.SessionAuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
-    'debug_toolbar.middleware.DebugToolbarMiddleware',
 ]
 
+# Fraction of requests to time, see categorizer.middleware
+REQUEST_TIMING_SAMPLE_RATE = 1.0
+
 ROOT_URLCONF = 'ranker_api.urls'
 
 TEMPLATES = [
@@ -87,12 +109,76 @@ WSGI_APPLICATION = 'ranker_api.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/1.9/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': os.path.join(BASE_DIR, 'db.sqlite3'),
+if env('DB_ENGINE', 'sqlite') == 'postgresql':
+    # Connections are kept open between requests, and checked at the start
+    # of each one in case the server dropped them
+    database = {
+        'ENGINE': 'django.db.backends.postgresql',
+        'NAME': env('DB_NAME', 'ranker'),
+        'USER': env('DB_USER', ''),
+        'PASSWORD': env('DB_PASSWORD', ''),
+        'HOST': env('DB_HOST', ''),
+        'PORT': env('DB_PORT', ''),
+        'CONN_MAX_AGE': int(env('DB_CONN_MAX_AGE', 300)),
+        'CONN_HEALTH_CHECKS': True,
     }
-}
+    DATABASES = {'default': database}
+    # Read replicas, as a comma separated list of hosts
+    for n, host in enumerate(env_list('DB_REPLICAS'), 1):
+        DATABASES['replica{}'.format(n)] = dict(
+            database, HOST=host, TEST={'MIRROR': 'default'})
+else:
+    # A single file, where writers wait for the lock rather than failing,
+    # and write-ahead logging lets reads continue during a write
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': env('DB_NAME', os.path.join(BASE_DIR, 'db.sqlite3')),
+            'OPTIONS': {
+                'timeout': float(env('DB_BUSY_TIMEOUT', 20)),
+            },
+        }
+    }
+    SQLITE_PRAGMAS = {
+        'journal_mode': 'WAL',
+        'synchronous': 'NORMAL',
+    }
+
+DATABASE_REPLICAS = [alias for alias in DATABASES if alias != 'default']
+
+if TESTING and not DATABASE_REPLICAS:
+    # A second alias for the test database, so that the replica routing can
+    # be tested without a second server. It is only read from by tests that
+    # set DATABASE_REPLICAS.
+    DATABASES['replica'] = dict(DATABASES['default'],
+                                TEST={'MIRROR': 'default'})
+
+DATABASE_ROUTERS = ['categorizer.db.ReplicaRouter']
+
+
+# Cache
+# https://docs.djangoproject.com/en/1.9/topics/cache/
+
+# Rankings, matchup candidates and tokens are invalidated through the default
+# cache, so it must be shared when serving from several processes. The local
+# memory cache is only seen by the process it is in.
+if env('CACHE_BACKEND', 'locmem') == 'memcached':
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+            'LOCATION': env_list('CACHE_LOCATION') or ['127.0.0.1:11211'],
+            'KEY_PREFIX': env('CACHE_KEY_PREFIX', 'ranker'),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Seconds a cached ordering is served for, in case an invalidation was missed
+RANKINGS_CACHE_TIMEOUT = int(env('RANKINGS_CACHE_TIMEOUT', 60))
 
 
 # Password validation
@@ -116,7 +202,7 @@ AUTH_PASSWORD_VALIDATORS = [
 # Django Rest Framework authentication options
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
-        'rest_framework.authentication.TokenAuthentication',
+        'auth.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ),
     'DEFAULT_PERMISSION_CLASSES': (
@@ -143,7 +229,3 @@ USE_TZ = True
 # https://docs.djangoproject.com/en/1.9/howto/static-files/
 
 STATIC_URL = '/static/'
-
-INTERNAL_IPS = [
-    '127.0.0.1'
-]